@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from app.core import registry
+from app.utils import tracing
+from app.utils.profiler import profiler
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+class ProfileRequest(BaseModel):
+    seconds: float = Field(10.0, gt=0, le=600)
+    interval_ms: float = Field(5.0, ge=1, le=1000)
+    # 0 = sample continuously; otherwise only while this fraction of requests is in flight
+    request_fraction: float = Field(0.0, ge=0, le=1)
+
+
+class TracingConfig(BaseModel):
+    enabled: bool | None = None
+    sample_rate: float | None = Field(None, ge=0, le=1)
+    slow_ms: float | None = Field(None, ge=0)
+
+
+# Async on purpose: the profiler samples the thread that starts it, i.e. the event loop
+@router.post("/profile/start")
+async def start_profile(req: ProfileRequest):
+    try:
+        profiler.start(req.seconds, req.interval_ms / 1000, req.request_fraction)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@router.post("/profile/stop")
+async def stop_profile():
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profile")
+async def get_profile(format: str = "folded"):
+    """Profile status, or the collected stacks as folded text (flamegraph.pl / speedscope input)."""
+    if format == "status":
+        return profiler.status()
+    return PlainTextResponse(profiler.folded())
+
+
+@router.get("/tracing")
+async def get_tracing():
+    return tracing.configure()
+
+
+@router.post("/tracing")
+async def set_tracing(config: TracingConfig):
+    return tracing.configure(config.enabled, config.sample_rate, config.slow_ms)
+
+
+class ModelActivation(BaseModel):
+    version: str
+
+
+class ShadowConfig(BaseModel):
+    version: str | None = None
+    fraction: float = Field(0.05, ge=0, le=1)
+
+
+def _registry(name: str) -> registry.ModelRegistry:
+    model = registry.registries.get(name)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    return model
+
+
+@router.get("/models")
+async def list_models():
+    return [model.status() for model in registry.registries.values()]
+
+
+# Loading happens in the background refresh; poll GET /admin/models for progress
+@router.post("/models/{name}/activate", status_code=202)
+async def activate_model(name: str, req: ModelActivation):
+    model = _registry(name)
+    try:
+        model.activate(req.version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    asyncio.create_task(asyncio.to_thread(model.refresh))
+    return model.status()
+
+
+@router.post("/models/{name}/shadow", status_code=202)
+async def shadow_model(name: str, req: ShadowConfig):
+    model = _registry(name)
+    try:
+        model.set_shadow(req.version, req.fraction)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    asyncio.create_task(asyncio.to_thread(model.refresh))
+    return model.status()
@@ -1,6 +1,9 @@
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import uuid
 
 # Secret key for signing JWT (keep secret in production)
 SECRET_KEY = "spy_gear5_secret_key"
@@ -10,6 +13,9 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# "Authorization: Bearer <token>" from /auth/login
+bearer_scheme = HTTPBearer(auto_error=False)
+
 # -------------------
 # Password Functions
 # -------------------
@@ -30,3 +36,15 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+def get_current_company(credentials: HTTPAuthorizationCredentials | None = Depends(bearer_scheme)) -> uuid.UUID:
+    """Dependency: the authenticated company's id (the token's "sub"); 401 without a valid token."""
+    unauthorized = HTTPException(status_code=401, detail="Not authenticated",
+                                 headers={"WWW-Authenticate": "Bearer"})
+    if credentials is None:
+        raise unauthorized
+    try:
+        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        return uuid.UUID(payload["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise unauthorized
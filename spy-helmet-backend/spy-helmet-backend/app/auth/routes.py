@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException
 
 from app.auth import schemas, auth 
-from app.core.buffer import reset_buffer
 from app.db.db import get_db_connection  # Ensure this imports your psycopg2 connection function
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -83,9 +82,6 @@ def login_user(user_data: schemas.UserLogin):
         if not user or not auth.verify_password(user_data.password, user[3]):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        # Reset buffer on successful login
-        reset_buffer()
-
         # Create Token (user[0] is the UUID)
         token = auth.create_access_token(data={"sub": str(user[0])})
         
@@ -0,0 +1,200 @@
+# app/core/admission.py
+#
+# Per-helmet and per-company admission control for /submit_reading.
+#
+# Every reading takes a token from its helmet's bucket and from its company's bucket
+# (token buckets: ADMIT_*_RATE tokens per second, up to ADMIT_*_BURST). Buckets are
+# refilled lazily when a reading arrives, so a check is a couple of dict lookups and
+# float operations; the ingest path runs on the event loop, so no locks are needed. An
+# empty bucket answers 429 with the time until the next token as Retry-After.
+#
+# Priority readings are always admitted and take no tokens: one that raises a gas alert
+# (gas_rules.any_raised), or one from a helmet still in gas alert or in Fatigue
+# (shedding.is_critical). A reading that only clears an alert takes a token like any other.
+#
+# Each API process keeps its own buckets. Every ADMIT_SYNC_INTERVAL seconds a background
+# task adds the tokens this process used to a Redis hash for the current interval
+# (admission:<interval>, field = bucket key) and takes the other processes' usage of the
+# previous interval out of its own buckets, so a helmet hopping between processes gets
+# roughly the configured rate overall (one interval late).
+#
+# helmet_ID -> company comes from the helmets table, reloaded every
+# ADMIT_COMPANY_REFRESH seconds; helmets not registered yet only have a helmet bucket.
+
+import asyncio
+import math
+import os
+import time
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("admission")
+
+# Tokens per second and bucket size; a rate of 0 disables that limit
+HELMET_RATE = float(os.getenv("ADMIT_HELMET_RATE", "5"))
+HELMET_BURST = float(os.getenv("ADMIT_HELMET_BURST", "20"))
+COMPANY_RATE = float(os.getenv("ADMIT_COMPANY_RATE", "500"))
+COMPANY_BURST = float(os.getenv("ADMIT_COMPANY_BURST", "1000"))
+SYNC_INTERVAL = float(os.getenv("ADMIT_SYNC_INTERVAL", "1.0"))
+COMPANY_REFRESH = float(os.getenv("ADMIT_COMPANY_REFRESH", "60"))
+KEY_PREFIX = "admission:"
+
+ADMISSION = metrics.Counter("admission_decisions", "Ingest admission decisions", ["decision"])
+ADMITTED = ADMISSION.labels("admitted")
+PRIORITY = ADMISSION.labels("priority")
+REJECTED_HELMET = ADMISSION.labels("rejected_helmet")
+REJECTED_COMPANY = ADMISSION.labels("rejected_company")
+BUCKETS = metrics.Gauge("admission_buckets", "Token buckets held by this process")
+
+# "h:<helmet_ID>" / "c:<company_id>" -> [tokens, last refill (monotonic)]
+buckets: dict[str, list] = {}
+# Tokens taken by this process since the last sync, per bucket key
+used: dict[str, int] = {}
+# interval -> this process's usage reported into that interval's hash
+reported: dict[int, dict[str, int]] = {}
+companies: dict[str, str] = {}
+
+BUCKETS.set_function(lambda: len(buckets))
+
+
+def _take(key: str, rate: float, burst: float, now: float) -> float:
+    """Takes a token; returns 0 if there was one, else the seconds until there is."""
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = [burst, now]
+    else:
+        tokens = bucket[0] + (now - bucket[1]) * rate
+        bucket[0] = burst if tokens > burst else tokens
+        bucket[1] = now
+    if bucket[0] < 1:
+        return (1 - bucket[0]) / rate
+    bucket[0] -= 1
+    used[key] = used.get(key, 0) + 1
+    return 0.0
+
+
+def _give_back(key: str):
+    buckets[key][0] += 1
+    used[key] -= 1
+
+
+def admit(helmet_id: str, priority: bool = False) -> float:
+    """
+    0 if the reading may go on, else the Retry-After in seconds.
+    priority: the reading carries an alert and is admitted regardless.
+    """
+    if priority:
+        PRIORITY.inc()
+        return 0.0
+    now = time.monotonic()
+    helmet_key = None
+    if HELMET_RATE > 0:
+        helmet_key = "h:" + helmet_id
+        wait = _take(helmet_key, HELMET_RATE, HELMET_BURST, now)
+        if wait:
+            REJECTED_HELMET.inc()
+            return wait
+    company = companies.get(helmet_id)
+    if company is not None and COMPANY_RATE > 0:
+        wait = _take("c:" + company, COMPANY_RATE, COMPANY_BURST, now)
+        if wait:
+            # The helmet's token was not used after all
+            if helmet_key is not None:
+                _give_back(helmet_key)
+            REJECTED_COMPANY.inc()
+            return wait
+    ADMITTED.inc()
+    return 0.0
+
+
+def retry_after(wait: float) -> int:
+    return max(1, math.ceil(wait))
+
+
+def _limits(key: str) -> tuple[float, float]:
+    return (HELMET_RATE, HELMET_BURST) if key.startswith("h:") else (COMPANY_RATE, COMPANY_BURST)
+
+
+def apply_remote_usage(totals: dict, own: dict):
+    """Takes what other processes used (totals minus our own share) out of the local buckets."""
+    for key, total in totals.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        others = int(total) - own.get(key, 0)
+        if others <= 0:
+            continue
+        bucket = buckets.get(key)
+        if bucket is None:
+            _, burst = _limits(key)
+            bucket = buckets[key] = [burst, time.monotonic()]
+        # May go below zero: the tokens were already spent elsewhere
+        bucket[0] -= others
+
+
+def prune(now: float | None = None):
+    """Drops buckets that have been refilling long enough to be full again."""
+    now = time.monotonic() if now is None else now
+    for key, (tokens, last) in list(buckets.items()):
+        rate, burst = _limits(key)
+        if rate <= 0 or tokens + (now - last) * rate >= burst:
+            del buckets[key]
+
+
+async def sync(client):
+    """Reports this process's usage and applies the others', for the app's lifetime."""
+    global used
+    applied = None
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        interval = int(time.time() // SYNC_INTERVAL)
+        mine, used = used, {}
+        mine = {key: count for key, count in mine.items() if count}
+        # The other processes have reported into the previous interval by now; each
+        # interval is applied once, however the sleeps drift
+        reconcile = interval - 1 if applied != interval - 1 else None
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for key, count in mine.items():
+                    pipe.hincrby(f"{KEY_PREFIX}{interval}", key, count)
+                pipe.expire(f"{KEY_PREFIX}{interval}", max(10, int(SYNC_INTERVAL * 10)))
+                if reconcile is not None:
+                    pipe.hgetall(f"{KEY_PREFIX}{reconcile}")
+                results = await pipe.execute()
+            own = reported.setdefault(interval, {})
+            for key, count in mine.items():
+                own[key] = own.get(key, 0) + count
+            if reconcile is not None:
+                apply_remote_usage(results[-1] or {}, reported.get(reconcile, {}))
+                applied = reconcile
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Limits stay per process until Redis is back
+            logger.warning("Admission sync with Redis failed: %s", e)
+        for old in [i for i in reported if i < interval - 1]:
+            del reported[old]
+        prune()
+
+
+def load_companies() -> dict[str, str]:
+    from app.db.database import SessionLocal
+    from app.db.models import Helmet
+
+    db = SessionLocal()
+    try:
+        return {code: str(company_id) for code, company_id in db.query(Helmet.helmet_code, Helmet.company_id)}
+    finally:
+        db.close()
+
+
+async def company_refresher():
+    """Keeps helmet_ID -> company current, for the app's lifetime."""
+    global companies
+    while True:
+        try:
+            companies = await asyncio.to_thread(load_companies)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Could not load helmet companies for admission control: %s", e)
+        await asyncio.sleep(COMPANY_REFRESH)
@@ -0,0 +1,222 @@
+# app/core/archive.py
+#
+# Columnar archive of closed work sessions.
+#
+# The archive job moves the readings of closed sessions out of Postgres into one
+# compressed Parquet file per session:
+#
+#   {ARCHIVE_DIR}/readings/day=YYYY-MM-DD/session=<uuid>.parquet    (day of session start)
+#
+# Files use zstd with dictionary encoding for the repeated strings (ids, fatigue state),
+# delta encoding for the id / timestamp columns and byte-stream-split for the floats.
+# A session is marked archived (work_sessions.archived_at) and its rows deleted only
+# after its file has been written and fsynced. Rollups stay in Postgres.
+#
+# Every row carries its company_id, and the historical endpoints read archived sessions
+# from these files transparently, filtered on the caller's company. DuckDB can scan the
+# whole archive in place:
+#
+#   python -m app.core.archive run [--older-than-hours 24] [--limit 100] [--keep-rows]
+#   python -m app.core.archive query "SELECT day, avg(hr) FROM readings_archive GROUP BY day"
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.db.models import Reading, WorkSession
+from app.utils.log import get_logger
+
+logger = get_logger("archive")
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/tmp/spy-helmet/archive")
+# Sessions are archived once they have been closed for this long
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+READ_CHUNK = 50_000
+
+COLUMNS = ("id", "session_id", "helmet_id", "company_id", "inserted_at", "temperature", "env_temp", "humidity", "hr",
+           "spo2", "co_ppm", "ch4_ppm", "fatigue_state", "confidence", "score_normal", "score_stressed",
+           "score_fatigue")
+FLOAT_COLUMNS = ("temperature", "env_temp", "humidity", "hr", "spo2", "co_ppm", "ch4_ppm", "confidence",
+                 "score_normal", "score_stressed", "score_fatigue")
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("The reading archive needs pyarrow (see requirement.txt)") from e
+    return pa, pq
+
+
+def schema():
+    pa, _ = _arrow()
+    types = {"id": pa.int64(), "session_id": pa.string(), "helmet_id": pa.string(), "company_id": pa.string(),
+             "inserted_at": pa.timestamp("us"), "fatigue_state": pa.string()}
+    return pa.schema([(name, types.get(name, pa.float64())) for name in COLUMNS])
+
+
+def session_path(session: WorkSession, root: str | None = None) -> str:
+    day = (session.start_time or datetime.utcnow()).strftime("%Y-%m-%d")
+    return os.path.join(root or ARCHIVE_DIR, "readings", f"day={day}", f"session={session.id}.parquet")
+
+
+# --------------------------------------------------
+# Writing
+# --------------------------------------------------
+
+def write_session(db: Session, session: WorkSession, root: str | None = None) -> tuple[str, int]:
+    """Streams one session's readings into its Parquet file. Returns (path, rows)."""
+    pa, pq = _arrow()
+    path = session_path(session, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+
+    columns = [getattr(Reading, name) for name in COLUMNS]
+    result = db.execute(
+        select(*columns).where(Reading.session_id == session.id).order_by(Reading.inserted_at, Reading.id),
+        execution_options={"stream_results": True, "yield_per": READ_CHUNK},
+    )
+
+    arrow_schema = schema()
+    rows = 0
+    with pq.ParquetWriter(
+        tmp_path, arrow_schema,
+        compression="zstd",
+        use_dictionary=["session_id", "helmet_id", "company_id", "fatigue_state"],
+        column_encoding={
+            "id": "DELTA_BINARY_PACKED",
+            "inserted_at": "DELTA_BINARY_PACKED",
+            **{name: "BYTE_STREAM_SPLIT" for name in FLOAT_COLUMNS},
+        },
+    ) as writer:
+        for chunk in result.partitions():
+            data = list(zip(*chunk))
+            arrays = {name: list(values) for name, values in zip(COLUMNS, data)}
+            for name in ("session_id", "helmet_id", "company_id"):
+                arrays[name] = [str(v) for v in arrays[name]]
+            writer.write_table(pa.Table.from_pydict(arrays, schema=arrow_schema))
+            rows += len(chunk)
+
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path, rows
+
+
+def archive_sessions(db: Session, older_than_hours: float = ARCHIVE_AFTER_HOURS, limit: int | None = None,
+                     keep_rows: bool = False, root: str | None = None) -> int:
+    """Archives closed sessions that ended more than `older_than_hours` ago."""
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    query = db.query(WorkSession).filter(
+        WorkSession.is_active == False,  # noqa: E712
+        WorkSession.end_time < cutoff,
+        WorkSession.archived_at.is_(None),
+    ).order_by(WorkSession.end_time)
+    if limit:
+        query = query.limit(limit)
+
+    archived = 0
+    for session in query.all():
+        start = time.perf_counter()
+        path, rows = write_session(db, session, root)
+        if not keep_rows:
+            db.execute(delete(Reading).where(Reading.session_id == session.id))
+        session.archived_at = datetime.utcnow()
+        db.commit()
+        archived += 1
+        logger.info("Archived session %s: %s readings -> %s (%s bytes, %.2fs)",
+                    session.id, rows, path, os.path.getsize(path), time.perf_counter() - start)
+    return archived
+
+
+# --------------------------------------------------
+# Reading
+# --------------------------------------------------
+
+def _read_table(path: str, columns: list[str] | None, company_id):
+    """The file's rows of `company_id` (all rows when None)."""
+    _, pq = _arrow()
+    names = pq.read_schema(path).names
+    if columns is not None:
+        columns = [name for name in columns if name in names]
+    # Files written before company_id was archived hold one session, already scoped by the caller
+    if company_id is None or "company_id" not in names:
+        return pq.read_table(path, columns=columns)
+    return pq.read_table(path, columns=columns, filters=[("company_id", "=", str(company_id))])
+
+
+def read_session(session: WorkSession, columns: list[str] | None = None, root: str | None = None,
+                 company_id=None) -> list[dict]:
+    """Readings of an archived session (of `company_id` only, if given), keyed like the readings columns."""
+    path = session_path(session, root)
+    if not os.path.exists(path):
+        return []
+    return _read_table(path, columns, company_id).to_pylist()
+
+
+def read_session_columns(session: WorkSession, columns: list[str] | None = None, root: str | None = None,
+                         company_id=None) -> dict:
+    """Same as read_session, as {column: [values]} (no per-row dicts)."""
+    path = session_path(session, root)
+    if not os.path.exists(path):
+        return {name: [] for name in columns or COLUMNS}
+    return _read_table(path, columns, company_id).to_pydict()
+
+
+def session_summary(session: WorkSession, root: str | None = None, company_id=None) -> dict:
+    """avg_hr / max_temp / fatigue_events for an archived session (what all_sessions shows)."""
+    import pyarrow.compute as pc
+
+    path = session_path(session, root)
+    if not os.path.exists(path):
+        return {"avg_hr": None, "max_temp": None, "fatigue_events": 0}
+    table = _read_table(path, ["hr", "temperature", "fatigue_state"], company_id)
+    return {
+        "avg_hr": pc.mean(table["hr"]).as_py(),
+        "max_temp": pc.max(table["temperature"]).as_py(),
+        "fatigue_events": pc.sum(pc.equal(table["fatigue_state"], "Fatigue")).as_py() or 0,
+    }
+
+
+def connect(root: str | None = None):
+    """DuckDB connection with the whole archive as the `readings_archive` view."""
+    try:
+        import duckdb
+    except ImportError as e:
+        raise RuntimeError("Querying the archive needs duckdb (see requirement.txt)") from e
+
+    pattern = os.path.join(root or ARCHIVE_DIR, "readings", "*", "*.parquet")
+    conn = duckdb.connect()
+    conn.execute(
+        f"CREATE VIEW readings_archive AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+    )
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed sessions to Parquet / query the archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    run.add_argument("--older-than-hours", type=float, default=ARCHIVE_AFTER_HOURS)
+    run.add_argument("--limit", type=int, default=None)
+    run.add_argument("--keep-rows", action="store_true", help="write files but leave the rows in Postgres")
+    query = commands.add_parser("query")
+    query.add_argument("sql")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        from app.db.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            count = archive_sessions(db, args.older_than_hours, args.limit, args.keep_rows)
+            print(f"✅ Archived {count} sessions to {ARCHIVE_DIR}")
+        finally:
+            db.close()
+    else:
+        print(connect().sql(args.sql))
@@ -0,0 +1,456 @@
+# app/core/backfill.py
+#
+# Offline recomputation of fatigue predictions for stored readings: after a new model
+# version is activated in the registry (app/core/registry.py) or its file is retrained in
+# place, or for rows written while the model was missing ("Error").
+#
+# Helmets are processed one at a time. Their readings are streamed in
+# (inserted_at, id) order with server-side cursors, in keyset-paged segments of
+# BACKFILL_SEGMENT_ROWS so no read transaction stays open for hours. Every chunk is
+# turned into (100, 2) windows with a strided view over [last 99 readings + chunk]
+# (the same window the live path built for each reading), the windows are scored in
+# large batches across a process pool (each worker loads the model once), and the new
+# states and scores are written back with one bulk UPDATE per chunk. Rollup fatigue
+# counts and the stored summaries of closed sessions (app/core/sessions.py) are
+# corrected in the same transaction, and the rewritten sessions are dropped from the
+# historical response cache (app/core/response_cache.py).
+#
+# A window never spans a gap longer than BACKFILL_MAX_GAP_SECONDS: like a restarted API,
+# the helmet starts collecting again. Readings already moved to the Parquet archive are
+# not touched.
+#
+# Progress is checkpointed to a JSON file after every chunk, so an interrupted run picks
+# up where it stopped (a different active model version, a changed model file or
+# different options start over), and
+# --max-rows-per-second bounds the write load on the live database.
+#
+#   python -m app.core.backfill [--helmet H-001 ...] [--since 2026-01-01] [--until ...]
+#                               [--only-missing] [--workers 4] [--max-rows-per-second 5000]
+#                               [--restart]
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import redis
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import select, text, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.core import buffer, response_cache, rollups, sessions
+from app.db.models import Helmet, Reading
+from app.utils.log import get_logger
+
+logger = get_logger("backfill")
+
+CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT", "/tmp/spy-helmet/backfill.json")
+# Rows fetched (and written back) per round trip
+CHUNK_ROWS = int(os.getenv("BACKFILL_CHUNK_ROWS", "20000"))
+# Rows per server-side cursor, i.e. per read transaction
+SEGMENT_ROWS = int(os.getenv("BACKFILL_SEGMENT_ROWS", "500000"))
+# Windows per model call
+BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "2048"))
+WORKERS = int(os.getenv("BACKFILL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+MAX_GAP_SECONDS = float(os.getenv("BACKFILL_MAX_GAP_SECONDS", str(buffer.RESTORE_MAX_AGE)))
+# TensorFlow does not survive fork() well
+START_METHOD = os.getenv("BACKFILL_START_METHOD", "spawn")
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# States written without a real prediction (--only-missing rewrites just these)
+MISSING_STATES = ("Error", "Collecting")
+CONTEXT = buffer.BUFFER_SIZE - 1
+EPOCH = datetime(1970, 1, 1)
+
+
+# --------------------------------------------------
+# Scoring (runs in the pool workers)
+# --------------------------------------------------
+
+_predict_batch = None
+
+
+def _init_worker():
+    global _predict_batch
+    from app.core.predictor import predict_fatigue_batch
+
+    _predict_batch = predict_fatigue_batch
+
+
+def _score(windows: np.ndarray) -> list[dict]:
+    return _predict_batch(windows)
+
+
+def _model_info() -> dict:
+    """The fatigue model version a scoring process serves, from its registry."""
+    from app.core.predictor import registry
+
+    active = registry.active
+    if active is None:
+        return {"version": None, "error": registry.last_error, "directory": registry.directory}
+    try:
+        stat = os.stat(active.path)
+        artifact = f"{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        artifact = "missing"
+    return {"version": active.version, "path": active.path, "artifact": artifact}
+
+
+class _InlineScorer:
+    """Same interface as the pool, in this process (--workers 0)."""
+
+    def __init__(self):
+        _init_worker()
+
+    def map(self, fn, batches):
+        return map(fn, batches)
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def make_scorer(workers: int):
+    if workers <= 0:
+        return _InlineScorer()
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD),
+                               initializer=_init_worker)
+
+
+def model_info(scorer) -> dict:
+    """Registry version (and artifact) the scorer serves; raises if it has no model loaded."""
+    info = scorer.submit(_model_info).result()
+    if info["version"] is None:
+        raise RuntimeError(f"No fatigue model loaded from the registry in {info['directory']}: {info['error']}")
+    return info
+
+
+def score(scorer, windows: np.ndarray, version: str | None = None) -> list[dict]:
+    """Scores windows; every result must come from `version` when it is given."""
+    batches = [windows[i:i + BATCH_SIZE] for i in range(0, len(windows), BATCH_SIZE)]
+    results = [result for batch in scorer.map(_score, batches) for result in batch]
+    for result in results:
+        if result["prediction"] == "Error":
+            raise RuntimeError(f"Fatigue model {version or ''} stopped answering in a scoring process")
+        if version is not None and result.get("model_version") != version:
+            raise RuntimeError(f"Scored with fatigue model {result.get('model_version')}, expected {version}")
+    return results
+
+
+# --------------------------------------------------
+# Windows
+# --------------------------------------------------
+
+def build_windows(values: np.ndarray, times: np.ndarray, prev_values: np.ndarray,
+                  prev_times: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Windows ending at each row of `values` (M, 2), preceded by up to CONTEXT earlier
+    readings. Returns (mask of rows with a full window, (mask.sum(), 100, 2) windows).
+    """
+    all_values = np.concatenate([prev_values, values]).astype(np.float32, copy=False)
+    all_times = np.concatenate([prev_times, times])
+    offset = len(prev_values)
+
+    # Index where each reading's gap-free run starts
+    run_start = np.zeros(len(all_times), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(all_times) > MAX_GAP_SECONDS) + 1
+    run_start[breaks] = breaks
+    run_start = np.maximum.accumulate(run_start)
+
+    rows = np.arange(offset, len(all_values))
+    full = rows - run_start[offset:] >= CONTEXT
+    if not full.any():
+        return full, np.empty((0, buffer.BUFFER_SIZE, 2), dtype=np.float32)
+    # view[k] = readings k .. k + 99, the window of reading k + 99
+    view = sliding_window_view(all_values, (buffer.BUFFER_SIZE, 2))[:, 0]
+    return full, view[rows[full] - CONTEXT]
+
+
+# --------------------------------------------------
+# Reading and writing
+# --------------------------------------------------
+
+def _columns():
+    return Reading.id, Reading.hr, Reading.temperature, Reading.inserted_at, Reading.fatigue_state, Reading.session_id
+
+
+def _filters(helmet_id):
+    return (Reading.helmet_id == helmet_id, Reading.hr.isnot(None), Reading.temperature.isnot(None))
+
+
+def _seconds(timestamps) -> np.ndarray:
+    return np.fromiter(((ts - EPOCH).total_seconds() for ts in timestamps), dtype=np.float64, count=len(timestamps))
+
+
+def load_context(db: Session, helmet_id, after: tuple | None, since: datetime | None) -> tuple[np.ndarray, np.ndarray]:
+    """The CONTEXT readings just before the starting point, oldest first."""
+    query = select(Reading.hr, Reading.temperature, Reading.inserted_at).where(*_filters(helmet_id))
+    if after is not None:
+        query = query.where(tuple_(Reading.inserted_at, Reading.id) <= tuple_(*after))
+    elif since is not None:
+        query = query.where(Reading.inserted_at < since)
+    else:
+        return np.empty((0, 2), dtype=np.float32), np.empty(0)
+    rows = db.execute(query.order_by(Reading.inserted_at.desc(), Reading.id.desc()).limit(CONTEXT)).all()[::-1]
+    values = np.array([(hr, temperature) for hr, temperature, _ in rows], dtype=np.float32).reshape(-1, 2)
+    return values, _seconds([ts for _, _, ts in rows])
+
+
+def stream_chunks(db: Session, helmet_id, after: tuple | None, since: datetime | None, until: datetime | None):
+    """Yields chunks of (id, hr, temperature, inserted_at, fatigue_state, session_id) rows in time order."""
+    while True:
+        query = select(*_columns()).where(*_filters(helmet_id))
+        if after is not None:
+            query = query.where(tuple_(Reading.inserted_at, Reading.id) > tuple_(*after))
+        elif since is not None:
+            query = query.where(Reading.inserted_at >= since)
+        if until is not None:
+            query = query.where(Reading.inserted_at < until)
+        query = query.order_by(Reading.inserted_at, Reading.id).limit(SEGMENT_ROWS)
+
+        fetched = 0
+        result = db.execute(query, execution_options={"stream_results": True, "yield_per": CHUNK_ROWS})
+        for chunk in result.partitions():
+            fetched += len(chunk)
+            after = (chunk[-1].inserted_at, chunk[-1].id)
+            yield chunk
+        # End the read transaction between segments
+        db.commit()
+        if fetched < SEGMENT_ROWS:
+            return
+
+
+UPDATE_SQL = text("""
+UPDATE readings AS r SET fatigue_state = v.fatigue_state, confidence = v.confidence,
+    score_normal = v.score_normal, score_stressed = v.score_stressed, score_fatigue = v.score_fatigue
+FROM unnest(CAST(:ids AS bigint[]), CAST(:states AS text[]), CAST(:confidence AS double precision[]),
+            CAST(:score_normal AS double precision[]), CAST(:score_stressed AS double precision[]),
+            CAST(:score_fatigue AS double precision[]))
+    AS v(id, fatigue_state, confidence, score_normal, score_stressed, score_fatigue)
+WHERE r.id = v.id
+""")
+
+
+def write_updates(db: Session, updates: list[dict]):
+    """One UPDATE for the whole chunk (caller commits)."""
+    if not updates:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(UPDATE_SQL, {
+            "ids": [u["id"] for u in updates],
+            "states": [u["fatigue_state"] for u in updates],
+            "confidence": [u["confidence"] for u in updates],
+            "score_normal": [u["score_normal"] for u in updates],
+            "score_stressed": [u["score_stressed"] for u in updates],
+            "score_fatigue": [u["score_fatigue"] for u in updates],
+        })
+    else:
+        db.execute(update(Reading), updates)
+
+
+def plan_updates(chunk, full: np.ndarray, results: list[dict], only_missing: bool) -> list[dict]:
+    updates = []
+    predictions = iter(results)
+    for row, has_window in zip(chunk, full.tolist()):
+        if has_window:
+            result = next(predictions)
+            scores = result["raw_scores"]
+            new = {"id": row.id, "fatigue_state": result["prediction"], "confidence": result["confidence"],
+                   "score_normal": scores[0], "score_stressed": scores[1], "score_fatigue": scores[2]}
+        elif row.fatigue_state == "Collecting":
+            continue
+        else:
+            new = {"id": row.id, "fatigue_state": "Collecting", "confidence": None,
+                   "score_normal": None, "score_stressed": None, "score_fatigue": None}
+        if only_missing and row.fatigue_state not in MISSING_STATES:
+            continue
+        updates.append(new)
+    return updates
+
+
+# --------------------------------------------------
+# Checkpoints
+# --------------------------------------------------
+
+def fingerprint(model: dict, since: datetime | None, until: datetime | None, only_missing: bool) -> str:
+    """Identifies a run: model_info() of the scorer plus the options."""
+    return json.dumps({
+        "model": f"{model['version']}:{model['artifact']}",
+        "since": since and since.isoformat(),
+        "until": until and until.isoformat(),
+        "only_missing": only_missing,
+    }, sort_keys=True)
+
+
+def load_checkpoint(path: str, run: str) -> dict:
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return {"run": run, "helmets": {}}
+    if checkpoint.get("run") != run:
+        logger.warning("Checkpoint %s is from a different model or options, starting over", path)
+        return {"run": run, "helmets": {}}
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+# --------------------------------------------------
+# Driver
+# --------------------------------------------------
+
+class Throttle:
+    """Sleeps so that no more than `rate` rows per second are written on average."""
+
+    def __init__(self, rate: float | None):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows: int):
+        self.rows += rows
+        if not self.rate:
+            return
+        ahead = self.rows / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def backfill_helmet(read_db: Session, write_db: Session, scorer, helmet_id, progress: dict,
+                    since: datetime | None, until: datetime | None, only_missing: bool,
+                    throttle: Throttle, on_chunk=None, rewritten_sessions: set | None = None,
+                    version: str | None = None) -> int:
+    """
+    Rescores one helmet from its checkpoint onwards (with model `version`, if given).
+    Returns the rows written; the sessions of rewritten rows are added to `rewritten_sessions`.
+    """
+    after = None
+    if progress.get("inserted_at"):
+        after = (datetime.fromisoformat(progress["inserted_at"]), progress["id"])
+    prev_values, prev_times = load_context(read_db, helmet_id, after, since)
+    read_db.commit()
+
+    written = 0
+    for chunk in stream_chunks(read_db, helmet_id, after, since, until):
+        values = np.array([(row.hr, row.temperature) for row in chunk], dtype=np.float32)
+        times = _seconds([row.inserted_at for row in chunk])
+        full, windows = build_windows(values, times, prev_values, prev_times)
+        results = score(scorer, windows, version) if len(windows) else []
+        updates = plan_updates(chunk, full, results, only_missing)
+
+        old_states = {row.id: (row.fatigue_state, row.inserted_at, row.session_id) for row in chunk}
+        changes = []
+        # Sessions whose fatigue_events changed
+        changed_sessions = set()
+        for u in updates:
+            old_state, inserted_at, session_id = old_states[u["id"]]
+            was, now = old_state == "Fatigue", u["fatigue_state"] == "Fatigue"
+            if was != now:
+                changes.append((helmet_id, inserted_at, 1 if now else -1))
+                changed_sessions.add(session_id)
+            if rewritten_sessions is not None:
+                rewritten_sessions.add(session_id)
+
+        write_updates(write_db, updates)
+        rollups.adjust_fatigue_counts(write_db, changes)
+        sessions.refresh_summaries(write_db, changed_sessions)
+        write_db.commit()
+
+        prev_values = np.concatenate([prev_values, values])[-CONTEXT:]
+        prev_times = np.concatenate([prev_times, times])[-CONTEXT:]
+        progress["inserted_at"] = chunk[-1].inserted_at.isoformat()
+        progress["id"] = chunk[-1].id
+        written += len(updates)
+        if on_chunk:
+            on_chunk()
+        throttle.wait(len(updates))
+    return written
+
+
+def invalidate_cached(company_id, helmet_code: str, session_ids: set):
+    """Drops rewritten sessions and the helmet's session list from the API's response cache (best effort)."""
+    if not session_ids:
+        return
+    try:
+        keys = [key for session_id in session_ids for key in response_cache.readings_keys(company_id, session_id)]
+        # The list carries the stored session summaries
+        keys.append(response_cache.sessions_key(company_id, helmet_code))
+        response_cache.invalidate(redis.from_url(REDIS_URL), keys)
+    except Exception as e:
+        logger.warning("Could not invalidate %s cached sessions (cached views may be stale until "
+                       "HIST_CACHE_CLOSED_TTL): %s", len(session_ids), e)
+
+
+def run(helmet_codes: list[str] | None = None, since: datetime | None = None, until: datetime | None = None,
+        only_missing: bool = False, workers: int = WORKERS, max_rows_per_second: float | None = None,
+        checkpoint_path: str = CHECKPOINT_PATH, restart: bool = False) -> int:
+    from app.db.database import SessionLocal
+
+    scorer = make_scorer(workers)
+    read_db, write_db = SessionLocal(), SessionLocal()
+    throttle = Throttle(max_rows_per_second)
+    total = 0
+    try:
+        model = model_info(scorer)
+        logger.info("Backfilling with fatigue model %s (%s)", model["version"], model["path"])
+        run_id = fingerprint(model, since, until, only_missing)
+        checkpoint = {"run": run_id, "helmets": {}} if restart else load_checkpoint(checkpoint_path, run_id)
+
+        query = read_db.query(Helmet.id, Helmet.helmet_code, Helmet.company_id)
+        if helmet_codes:
+            query = query.filter(Helmet.helmet_code.in_(helmet_codes))
+        helmets = query.order_by(Helmet.helmet_code).all()
+        read_db.commit()
+
+        for helmet_id, helmet_code, company_id in helmets:
+            progress = checkpoint["helmets"].setdefault(str(helmet_id), {})
+            if progress.get("done"):
+                continue
+            start = time.perf_counter()
+            rewritten = set()
+            written = backfill_helmet(read_db, write_db, scorer, helmet_id, progress, since, until, only_missing,
+                                      throttle, on_chunk=lambda: save_checkpoint(checkpoint_path, checkpoint),
+                                      rewritten_sessions=rewritten, version=model["version"])
+            progress["done"] = True
+            save_checkpoint(checkpoint_path, checkpoint)
+            invalidate_cached(company_id, helmet_code, rewritten)
+            total += written
+            logger.info("Backfilled helmet %s: %s readings rewritten (%.1fs)", helmet_code, written,
+                        time.perf_counter() - start)
+    finally:
+        scorer.shutdown()
+        read_db.close()
+        write_db.close()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute fatigue predictions for stored readings")
+    parser.add_argument("--helmet", action="append", dest="helmets", help="helmet code (repeatable, default: all)")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--only-missing", action="store_true", help="only rewrite rows stored as Error / Collecting")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="inference processes (0: in this process)")
+    parser.add_argument("--max-rows-per-second", type=float, default=None)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    count = run(args.helmets, args.since, args.until, args.only_missing, args.workers,
+                args.max_rows_per_second, args.checkpoint, args.restart)
+    print(f"✅ Backfill finished: {count} readings rewritten")
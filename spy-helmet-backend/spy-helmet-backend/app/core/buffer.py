@@ -1,38 +1,272 @@
 # app/core/buffer.py
+#
+# Sliding window of the latest readings, kept separately for every helmet.
+#
+# Windows survive restarts and scale-outs: changed windows are snapshotted to a Redis
+# hash (packed float32, one field per helmet) every BUFFER_SNAPSHOT_INTERVAL seconds
+# and on shutdown. On startup they are restored from there; live helmets without a
+# usable snapshot are then rebuilt from their last 100 stored readings in the background
+# (merged in front of whatever readings arrived meanwhile).
+#
+# A window with no reading for BUFFER_RESTORE_MAX_AGE seconds is dropped, here and from
+# the snapshot hash, so retired helmets do not stay in either.
+
+import asyncio
+import os
+import struct
+import time
+from bisect import bisect_left
+from collections import deque
 
 import numpy as np
 
-# Global buffer to store readings
+from app.utils.log import get_logger
+
+logger = get_logger("buffer")
+
 BUFFER_SIZE = 100
-buffer = []
+DEFAULT_KEY = "default"
+buffers: dict[str, deque] = {}
+
+WINDOWS_KEY = "helmet_windows"
+SNAPSHOT_INTERVAL = float(os.getenv("BUFFER_SNAPSHOT_INTERVAL", "5"))
+# Windows older than this are not resumed (the helmet was off; start collecting again)
+RESTORE_MAX_AGE = float(os.getenv("BUFFER_RESTORE_MAX_AGE", "600"))
+# Snapshot header: time of the window's last reading
+SNAPSHOT_HEADER = struct.Struct("<d")
+
+# Last reading time per helmet, and helmets changed since the last snapshot
+updated_at: dict[str, float] = {}
+dirty: set[str] = set()
+# Epoch ms of the first reading of windows started in this process (not restored)
+started_at: dict[str, int] = {}
+# Helmets whose window expired, still to be deleted from the snapshot hash
+expired: set[str] = set()
 
-def reset_buffer():
-    """Resets the buffer at the start of a new session."""
-    global buffer
-    buffer = []
+def reset_buffer(helmet_id: str | None = None):
+    """Resets one helmet's window, or every window when no helmet is given."""
+    if helmet_id is None:
+        buffers.clear()
+        updated_at.clear()
+        dirty.clear()
+        started_at.clear()
+    else:
+        buffers.pop(helmet_id, None)
+        updated_at.pop(helmet_id, None)
+        started_at.pop(helmet_id, None)
 
-def add_reading(reading: list[float]) -> np.ndarray | None:
+def add_reading(reading: list[float], helmet_id: str = DEFAULT_KEY) -> np.ndarray | None:
     """
-    Adds a single reading to the buffer.
-    Returns a full (100, 2
-    ) numpy array when ready, else None.
+    Adds a single reading to the helmet's buffer.
+    Returns a full (100, 2) numpy array when ready, else None.
     """
-    global buffer
-
     if len(reading) != 2:
         raise ValueError("Each reading must have exactly 2 values.")
 
-    buffer.append(reading)
+    buffer = buffers.get(helmet_id)
+    if buffer is None:
+        # Sliding Window: deque drops the oldest reading once 100 are held
+        buffer = buffers[helmet_id] = deque(maxlen=BUFFER_SIZE)
+        # Taken before the reading is queued, so its stored inserted_at is never earlier
+        started_at[helmet_id] = int(time.time() * 1000)
 
-    # Sliding Window: Maintain exactly 100 latest readings
-    if len(buffer) > BUFFER_SIZE:
-        buffer.pop(0)  # Remove oldest reading
+    buffer.append(reading)
+    updated_at[helmet_id] = time.time()
+    dirty.add(helmet_id)
 
     if len(buffer) == BUFFER_SIZE:
-        return np.array(buffer).astype(np.float32)
+        return np.array(buffer, dtype=np.float32)
     else:
         return None
 
-def return_progress():
-    global buffer
-    return len(buffer)
+def return_progress(helmet_id: str | None = None):
+    if helmet_id is None:
+        # Most advanced window, used by the single-helmet dashboard
+        return max((len(b) for b in buffers.values()), default=0)
+    return len(buffers.get(helmet_id, ()))
+
+# --------------------------------------------------
+# Snapshots (Redis)
+# --------------------------------------------------
+
+def dump_window(helmet_id: str) -> bytes:
+    window = np.asarray(buffers[helmet_id], dtype=np.float32)
+    return SNAPSHOT_HEADER.pack(updated_at.get(helmet_id, 0.0)) + window.tobytes()
+
+def load_window(helmet_id: str, raw: bytes, now: float | None = None) -> bool:
+    """Restores one window from dump_window() bytes. False if it is too old or malformed."""
+    now = time.time() if now is None else now
+    if len(raw) < SNAPSHOT_HEADER.size or (len(raw) - SNAPSHOT_HEADER.size) % 8:
+        return False
+    (last_reading,) = SNAPSHOT_HEADER.unpack_from(raw)
+    if now - last_reading > RESTORE_MAX_AGE:
+        return False
+    window = np.frombuffer(raw, dtype=np.float32, offset=SNAPSHOT_HEADER.size).reshape(-1, 2)
+    buffers[helmet_id] = deque(window.tolist(), maxlen=BUFFER_SIZE)
+    updated_at[helmet_id] = last_reading
+    return True
+
+def expire_windows(now: float | None = None):
+    """Drops windows with no reading for RESTORE_MAX_AGE (they would not be resumed anyway)."""
+    now = time.time() if now is None else now
+    for helmet_id in [helmet_id for helmet_id, at in updated_at.items() if now - at > RESTORE_MAX_AGE]:
+        reset_buffer(helmet_id)
+        dirty.discard(helmet_id)
+        expired.add(helmet_id)
+
+async def snapshot(client, now: float | None = None):
+    """Writes every window changed since the last snapshot and deletes expired ones (one pipeline)."""
+    expire_windows(now)
+    helmet_ids = list(dirty)
+    dirty.clear()
+    mapping = {helmet_id: dump_window(helmet_id) for helmet_id in helmet_ids if helmet_id in buffers}
+    gone = list(expired)
+    expired.clear()
+    if not mapping and not gone:
+        return
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            if mapping:
+                pipe.hset(WINDOWS_KEY, mapping=mapping)
+            if gone:
+                pipe.hdel(WINDOWS_KEY, *gone)
+            await pipe.execute()
+    except Exception as e:
+        dirty.update(mapping)
+        expired.update(gone)
+        logger.warning("Could not snapshot %s windows: %s", len(mapping), e)
+
+async def snapshotter(client):
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        await snapshot(client)
+
+async def restore(client) -> int:
+    """Loads recent window snapshots from Redis. Returns how many were restored."""
+    try:
+        snapshots = await client.hgetall(WINDOWS_KEY)
+    except Exception as e:
+        logger.warning("Could not read window snapshots from Redis: %s", e)
+        return 0
+    now = time.time()
+    restored = 0
+    for helmet_id, raw in snapshots.items():
+        helmet_id = helmet_id.decode() if isinstance(helmet_id, bytes) else helmet_id
+        if load_window(helmet_id, raw, now):
+            restored += 1
+        else:
+            # Too old to resume (or unreadable): deleted with the next snapshot
+            expired.add(helmet_id)
+    return restored
+
+# --------------------------------------------------
+# Rebuild from stored readings
+# --------------------------------------------------
+
+def load_recent_windows(db, now: float | None = None) -> dict:
+    """
+    {helmet_code: (readings oldest first, their inserted_at in epoch ms)} for helmets with an
+    active session: their last BUFFER_SIZE readings within RESTORE_MAX_AGE.
+
+    On Postgres this is one query with a LATERAL ... ORDER BY inserted_at DESC LIMIT per
+    helmet, so each helmet is a short backward scan of ix_readings_helmet_inserted_at and
+    nothing else in `readings` is read. Elsewhere (local SQLite stand-ins) it is one such
+    query per helmet.
+    """
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, true
+    from app.db.models import Helmet, Reading, WorkSession
+
+    now = time.time() if now is None else now
+    since = datetime.utcfromtimestamp(now) - timedelta(seconds=RESTORE_MAX_AGE)
+
+    def latest(helmet_id):
+        return select(Reading.id, Reading.hr, Reading.temperature, Reading.inserted_at)\
+            .where(Reading.helmet_id == helmet_id, Reading.inserted_at >= since,
+                   Reading.hr.isnot(None), Reading.temperature.isnot(None))\
+            .order_by(Reading.inserted_at.desc(), Reading.id.desc())\
+            .limit(BUFFER_SIZE)
+
+    # Live helmets: one row each from uq_work_sessions_active_helmet
+    active = select(WorkSession.helmet_id, Helmet.helmet_code)\
+        .join(Helmet, Helmet.id == WorkSession.helmet_id)\
+        .where(WorkSession.is_active == True)  # noqa: E712
+
+    if db.get_bind().dialect.name == "postgresql":
+        recent = latest(WorkSession.helmet_id).lateral("recent")
+        rows = db.execute(
+            active.add_columns(recent.c.id, recent.c.hr, recent.c.temperature, recent.c.inserted_at)
+            .join(recent, true())
+        ).all()
+    else:
+        rows = []
+        for helmet_id, helmet_code in db.execute(active).all():
+            rows.extend((helmet_id, helmet_code, *row) for row in db.execute(latest(helmet_id)).all())
+
+    windows = {}
+    for _, helmet_code, reading_id, hr, temperature, inserted_at in sorted(rows, key=lambda r: (r[1], r[5], r[2])):
+        readings, times = windows.setdefault(helmet_code, ([], []))
+        readings.append([float(hr), float(temperature)])
+        times.append(round((inserted_at - datetime(1970, 1, 1)).total_seconds() * 1000))
+    return windows
+
+def apply_windows(windows: dict) -> int:
+    """
+    Installs load_recent_windows() results. A window started by readings received since
+    startup keeps them: the stored readings from before the first of them go in front,
+    up to BUFFER_SIZE in all. Restored and full windows are left alone.
+    """
+    applied = 0
+    for helmet_code, (readings, times) in windows.items():
+        live = buffers.get(helmet_code)
+        if live is None:
+            buffers[helmet_code] = deque(readings, maxlen=BUFFER_SIZE)
+            updated_at[helmet_code] = times[-1] / 1000
+        else:
+            first = started_at.get(helmet_code)
+            if first is None or len(live) >= BUFFER_SIZE:
+                continue
+            # The worker stored the live readings too: keep only the ones before them
+            older = readings[:bisect_left(times, first)]
+            if not older:
+                continue
+            buffers[helmet_code] = deque(older + list(live), maxlen=BUFFER_SIZE)
+        dirty.add(helmet_code)
+        applied += 1
+    return applied
+
+def rebuild_from_db(db, now: float | None = None) -> int:
+    """Fills windows for live helmets that have none from their stored readings."""
+    return apply_windows(load_recent_windows(db, now))
+
+async def warm_start(client) -> int:
+    """Startup: restores the Redis snapshots. Returns how many windows were restored."""
+    restored = await restore(client)
+    if restored:
+        logger.info("Warm start: %s windows from snapshots", restored)
+    return restored
+
+async def rebuild_missing():
+    """
+    Background task started after warm_start(): rebuilds the windows that had no snapshot
+    from stored readings. The query runs in a thread and startup does not wait for it;
+    windows are installed (or merged) on the event loop, after any reading that arrived
+    meanwhile.
+    """
+    from app.db.database import SessionLocal
+
+    def load():
+        db = SessionLocal()
+        try:
+            return load_recent_windows(db)
+        finally:
+            db.close()
+
+    try:
+        windows = await asyncio.to_thread(load)
+    except Exception as e:
+        logger.warning("Could not rebuild windows from stored readings: %s", e)
+        return
+    rebuilt = apply_windows(windows)
+    if rebuilt:
+        logger.info("Warm start: %s windows rebuilt from readings", rebuilt)
@@ -0,0 +1,117 @@
+# app/core/codec.py
+
+import json
+import struct
+import time
+
+# Compact binary frame for one sensor reading.
+#
+#   byte 0      : format version
+#   byte 1      : length of helmet_ID (utf-8, max 255 bytes)
+#   bytes 2..n  : helmet_ID
+#   rest        : fixed-layout body (little endian, see BODY_V* below)
+#
+# Temperatures, humidity and gas values are sent as fixed-point "centi" integers
+# (value * 100) so the frame is exact to 2 decimals, which is the sensor precision.
+# A JSON object (starts with "{") is still accepted everywhere as a fallback.
+#
+# Versions:
+#   1 : sensor fields + fatigue_state
+#   2 : v1 + received_at (epoch milliseconds, stamped by the API)
+#   3 : v2 + model output: confidence (centi-percent, 0xFFFF = none) and 3 raw scores
+
+VERSION = 3
+
+HEADER = struct.Struct("<BB")
+# BodyTemp, EnvTemp, Humidity, CO_ppm, CH4_ppm, HR, SpO2, Packet_no, fatigue_state
+BODY_V1 = struct.Struct("<hhHIIHBIB")
+BODY_V2 = struct.Struct("<hhHIIHBIBQ")
+BODY_V3 = struct.Struct("<hhHIIHBIBQHfff")
+BODIES = {1: BODY_V1, 2: BODY_V2, 3: BODY_V3}
+
+NO_CONFIDENCE = 0xFFFF
+
+# fatigue_state travels as a single byte
+STATES = [None, "Collecting", "Normal", "Stressed", "Fatigue", "Error"]
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+CONTENT_TYPE = "application/octet-stream"
+
+
+def encode_reading(data, fatigue_state: str | None = None, received_at: int | None = None,
+                   result: dict | None = None) -> bytes:
+    """
+    Packs a reading (any object with the SensorInput attributes) into a binary frame.
+    result is the predictor output (confidence + raw_scores), if there is one.
+    received_at defaults to now. Raises ValueError if a value does not fit the frame layout.
+    """
+    helmet_id = data.helmet_ID.encode("utf-8")
+    if received_at is None:
+        received_at = int(time.time() * 1000)
+    if result is None:
+        confidence, scores = NO_CONFIDENCE, (0.0, 0.0, 0.0)
+    else:
+        confidence, scores = round(result["confidence"] * 100), result["raw_scores"]
+    try:
+        return HEADER.pack(VERSION, len(helmet_id)) + helmet_id + BODY_V3.pack(
+            round(data.BodyTemp * 100),
+            round(data.EnvTemp * 100),
+            round(data.Humidity * 100),
+            round(data.CO_ppm * 100),
+            round(data.CH4_ppm * 100),
+            data.HR,
+            data.SpO2,
+            data.Packet_no,
+            STATE_CODES.get(fatigue_state, 0),
+            received_at,
+            confidence,
+            *scores,
+        )
+    except (struct.error, OverflowError) as e:
+        # OverflowError: round() of an infinite value
+        raise ValueError(f"Reading does not fit binary frame: {e}")
+
+
+def decode_reading(frame: bytes) -> dict:
+    """
+    Unpacks a binary frame into a dict with the same keys as SensorInput (plus
+    "fatigue_state", "received_at", "confidence" and "raw_scores").
+    Raises ValueError on malformed frames.
+    """
+    try:
+        version, id_len = HEADER.unpack_from(frame, 0)
+        body = BODIES.get(version)
+        if body is None:
+            raise ValueError(f"Unsupported frame version: {version}")
+
+        offset = HEADER.size + id_len
+        if len(frame) != offset + body.size:
+            raise ValueError(f"Bad frame length: {len(frame)}")
+
+        values = body.unpack_from(frame, offset)
+        body_temp, env_temp, humidity, co, ch4, hr, spo2, packet_no, state = values[:9]
+        has_result = version >= 3 and values[10] != NO_CONFIDENCE
+        return {
+            "helmet_ID": frame[HEADER.size:offset].decode("utf-8"),
+            "BodyTemp": body_temp / 100,
+            "EnvTemp": env_temp / 100,
+            "Humidity": humidity / 100,
+            "CO_ppm": co / 100,
+            "CH4_ppm": ch4 / 100,
+            "HR": hr,
+            "SpO2": spo2,
+            "Packet_no": packet_no,
+            "fatigue_state": STATES[state] if state < len(STATES) else None,
+            "received_at": values[9] if version >= 2 else None,
+            "confidence": values[10] / 100 if has_result else None,
+            "raw_scores": list(values[11:14]) if has_result else None,
+        }
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed reading frame: {e}")
+
+
+def decode_payload(raw: bytes) -> dict:
+    """Decodes a queued payload, accepting both binary frames and legacy JSON."""
+    if raw[:1] == b"{":
+        return json.loads(raw)
+    return decode_reading(raw)
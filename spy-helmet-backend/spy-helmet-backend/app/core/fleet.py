@@ -0,0 +1,284 @@
+# app/core/fleet.py
+#
+# Fleet state index: which helmets are in which fatigue state right now, per company,
+# and how long ago each was last heard from, without touching `readings`.
+#
+# Every reading the API processes updates the local index (a few dict operations on the
+# event loop). Every FLEET_SYNC_INTERVAL seconds the helmets whose entry changed are sent
+# to Redis in one pipeline, which also reads back what the other processes sent since:
+#
+#   fleet:helmets   hash    helmet_ID -> "state|since|last seen|company" (epoch ms)
+#   fleet:changes   stream  one entry {helmet, record} per changed helmet per sync,
+#                           capped at FLEET_CHANGES_MAXLEN entries
+#
+# An entry changes when the helmet enters another state (since is the time it did, kept
+# with the state), its company becomes known, or its last reading is FLEET_SEEN_RESOLUTION
+# seconds newer than the one last sent. A sync costs O(changes), not O(fleet): each
+# process reads only the stream entries after the last one it applied. The whole hash
+# (plus the retained stream) is read only on the first sync, or when the stream was
+# trimmed past that entry. Records are merged, not replaced: the later since wins the
+# state, the later last-seen time wins last_seen, so replays and races are harmless.
+#
+# Queries only read the local mirror:
+#
+#   counts by state for a company      O(number of states)
+#   helmets of a company in a state    O(result)
+#   helmets not heard from for N sec   O(silent helmets) (last_seen is kept roughly oldest
+#                                      first: other processes' times arrive up to
+#                                      FLEET_ORDER_SLACK seconds out of order)
+#
+# Helmets silent for FLEET_FORGET_AFTER seconds are dropped from the index.
+# helmet_ID -> company comes from admission control's map of the helmets table.
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from app.core import admission, codec
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("fleet")
+
+SYNC_INTERVAL = float(os.getenv("FLEET_SYNC_INTERVAL", "1.0"))
+FORGET_AFTER = float(os.getenv("FLEET_FORGET_AFTER", str(24 * 3600)))
+SEEN_RESOLUTION = float(os.getenv("FLEET_SEEN_RESOLUTION", "5.0"))
+ORDER_SLACK_MS = int(float(os.getenv("FLEET_ORDER_SLACK", "10.0")) * 1000)
+CHANGES_MAXLEN = int(os.getenv("FLEET_CHANGES_MAXLEN", "100000"))
+KEY_PREFIX = "fleet:"
+HELMETS_KEY = KEY_PREFIX + "helmets"
+CHANGES_KEY = KEY_PREFIX + "changes"
+
+STATES = tuple(state for state in codec.STATES if state)
+
+FLEET_HELMETS = metrics.Gauge("fleet_helmets", "Helmets in the fleet state index", ["state"])
+SYNC_FAILURES = metrics.Counter("fleet_sync_failures", "Fleet index syncs with Redis that failed")
+FULL_READS = metrics.Counter("fleet_full_reads", "Fleet index syncs that read the whole Redis index")
+
+
+class FleetIndex:
+    def __init__(self):
+        # helmet_ID -> [state, since (epoch ms), company or None]
+        self.helmets: dict[str, list] = {}
+        # (company, state) -> {helmet_ID: since}
+        self.members: dict[tuple, dict[str, int]] = {}
+        # company -> helmet_IDs
+        self.companies: dict[str, set] = {}
+        # helmet_ID -> last reading (epoch ms), roughly oldest first
+        self.last_seen: OrderedDict[str, int] = OrderedDict()
+        # Newest last_seen time so far; set when one arrived too late to keep the order
+        self.newest = 0
+        self.unsorted = False
+
+    def set_state(self, helmet_id: str, state: str, since: int, company: str | None):
+        entry = self.helmets.get(helmet_id)
+        if entry is not None:
+            self.members[(entry[2], entry[0])].pop(helmet_id, None)
+            if entry[2] is not None and entry[2] != company:
+                self.companies[entry[2]].discard(helmet_id)
+        self.helmets[helmet_id] = [state, since, company]
+        self.members.setdefault((company, state), {})[helmet_id] = since
+        if company is not None:
+            self.companies.setdefault(company, set()).add(helmet_id)
+
+    def seen(self, helmet_id: str, at: int):
+        # Times arrive in order up to ORDER_SLACK_MS, so moving to the end keeps last_seen
+        # close enough to sorted for seen_before(); a later straggler marks it for a re-sort
+        self.last_seen[helmet_id] = at
+        self.last_seen.move_to_end(helmet_id)
+        if at < self.newest - ORDER_SLACK_MS:
+            self.unsorted = True
+        self.newest = max(self.newest, at)
+
+    def forget(self, helmet_id: str):
+        entry = self.helmets.pop(helmet_id, None)
+        if entry is not None:
+            self.members[(entry[2], entry[0])].pop(helmet_id, None)
+            if entry[2] is not None:
+                self.companies[entry[2]].discard(helmet_id)
+        self.last_seen.pop(helmet_id, None)
+
+    # --------------------------------------------------
+    # Queries
+    # --------------------------------------------------
+
+    def counts(self, company: str) -> dict:
+        return {state: len(self.members.get((company, state), ())) for state in STATES}
+
+    def in_state(self, company: str, state: str) -> dict:
+        """{helmet_ID: since} of the company's helmets in `state`."""
+        return self.members.get((company, state), {})
+
+    def seen_before(self, before: int, helmets=None) -> list[str]:
+        """Helmets (of `helmets`, if given) last heard from before `before` (epoch ms), roughly oldest first."""
+        if self.unsorted:
+            self.last_seen = OrderedDict(sorted(self.last_seen.items(), key=lambda item: item[1]))
+            self.unsorted = False
+        if helmets is None:
+            helmets = self.last_seen
+        older = []
+        items = iter(self.last_seen.items())
+        for helmet_id, at in items:
+            if at >= before:
+                break
+            if helmet_id in helmets:
+                older.append(helmet_id)
+        # Anything within ORDER_SLACK_MS after that may still be followed by older times
+        until = before + ORDER_SLACK_MS
+        for helmet_id, at in items:
+            if at >= until:
+                break
+            if at < before and helmet_id in helmets:
+                older.append(helmet_id)
+        return older
+
+    def silent_since(self, company: str, before: int) -> list[str]:
+        """The company's helmets last heard from before `before` (epoch ms), roughly oldest first."""
+        return self.seen_before(before, self.companies.get(company, ()))
+
+    def describe(self, helmet_id: str) -> dict:
+        state, since, _ = self.helmets[helmet_id]
+        return {"helmet_id": helmet_id, "state": state, "since": since, "last_seen": self.last_seen.get(helmet_id)}
+
+
+index = FleetIndex()
+# helmet_IDs whose entry changed locally since the last sync
+pending: set[str] = set()
+# helmet_ID -> last-seen time this process last sent to Redis
+sent_seen: dict[str, int] = {}
+# Last fleet:changes entry applied; None until the first (full) read
+stream_id = None
+
+
+def _state_counts() -> dict:
+    counts = {(state,): 0 for state in STATES}
+    for (_, state), members in list(index.members.items()):
+        counts[(state,)] += len(members)
+    return counts
+
+
+FLEET_HELMETS.set_function(_state_counts)
+
+
+def update(helmet_id: str, state: str, now_ms: int | None = None):
+    """Records a processed reading of `helmet_id` (called on the event loop for every prediction)."""
+    if state not in STATES:
+        return
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    company = admission.companies.get(helmet_id)
+    entry = index.helmets.get(helmet_id)
+    if entry is None or entry[0] != state:
+        index.set_state(helmet_id, state, now_ms, company)
+        pending.add(helmet_id)
+    elif company is not None and entry[2] != company:
+        index.set_state(helmet_id, state, entry[1], company)
+        pending.add(helmet_id)
+    elif now_ms - sent_seen.get(helmet_id, 0) >= SEEN_RESOLUTION * 1000:
+        pending.add(helmet_id)
+    index.seen(helmet_id, now_ms)
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _entry_id(value) -> tuple:
+    ms, _, seq = _decode(value).partition("-")
+    return int(ms), int(seq or 0)
+
+
+def encode(helmet_id: str) -> str:
+    state, since, company = index.helmets[helmet_id]
+    return f"{state}|{since}|{index.last_seen[helmet_id]}|{company or ''}"
+
+
+def merge(helmet_id: str, record: str, forget_before: int = 0):
+    """Folds one helmet record from Redis into the local index."""
+    state, since, seen, company = record.split("|", 3)
+    since, seen = int(since), int(seen)
+    if state not in STATES or seen < forget_before:
+        return
+    company = company or admission.companies.get(helmet_id)
+    entry = index.helmets.get(helmet_id)
+    # The later state change wins, whichever process saw it
+    if entry is None or since > entry[1]:
+        index.set_state(helmet_id, state, since, company)
+    elif company is not None and entry[2] != company:
+        index.set_state(helmet_id, entry[0], entry[1], company)
+    if seen > index.last_seen.get(helmet_id, -1):
+        index.seen(helmet_id, seen)
+
+
+async def sync_once(client, now_ms: int | None = None):
+    """Sends local changes to Redis and merges in the changes the other processes sent."""
+    global pending, stream_id
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    forget_before = now_ms - int(FORGET_AFTER * 1000)
+    forgotten = index.seen_before(forget_before)
+    for helmet_id in forgotten:
+        index.forget(helmet_id)
+        sent_seen.pop(helmet_id, None)
+        pending.discard(helmet_id)
+
+    changed, pending = pending, set()
+    records = {helmet_id: encode(helmet_id) for helmet_id in changed}
+    full = stream_id is None
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            if records:
+                pipe.hset(HELMETS_KEY, mapping=records)
+                for helmet_id, record in records.items():
+                    pipe.xadd(CHANGES_KEY, {"helmet": helmet_id, "record": record},
+                              maxlen=CHANGES_MAXLEN, approximate=True)
+            if forgotten:
+                pipe.hdel(HELMETS_KEY, *forgotten)
+            if full:
+                pipe.hgetall(HELMETS_KEY)
+                pipe.xrange(CHANGES_KEY, "-", "+")
+            else:
+                pipe.xrange(CHANGES_KEY, "-", "+", count=1)
+                pipe.xread({CHANGES_KEY: stream_id})
+            results = await pipe.execute()
+    except BaseException:
+        # Not sent: retried with whatever changed meanwhile
+        pending |= changed
+        raise
+    for helmet_id in changed:
+        sent_seen[helmet_id] = index.last_seen[helmet_id]
+
+    if full:
+        FULL_READS.inc()
+        snapshot, entries = results[-2], results[-1]
+        for helmet_id, record in snapshot.items():
+            merge(_decode(helmet_id), _decode(record), forget_before)
+    else:
+        oldest, read = results[-2], results[-1]
+        if oldest and stream_id != "0-0" and _entry_id(oldest[0][0]) > _entry_id(stream_id):
+            # Trimmed past the last entry applied here: some changes are gone from the stream
+            logger.warning("Fleet changes stream trimmed past %s, reading the whole index", _decode(stream_id))
+            stream_id = None
+            return await sync_once(client, now_ms)
+        entries = read[0][1] if read else []
+
+    for _, fields in entries:
+        merge(_decode(fields[b"helmet"]), _decode(fields[b"record"]), forget_before)
+    if entries:
+        stream_id = _decode(entries[-1][0])
+    elif full:
+        stream_id = "0-0"
+
+
+async def syncer(client):
+    """Keeps Redis and the local mirror in step, for the app's lifetime."""
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        try:
+            await sync_once(client)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            SYNC_FAILURES.inc()
+            logger.warning("Fleet index sync with Redis failed, serving the local view: %s", e)
@@ -0,0 +1,258 @@
+# app/core/gas_rules.py
+#
+# Gas hazard rules, evaluated on every reading before it is buffered.
+#
+# For each gas (CO, CH4) three kinds of rule are checked:
+#   warn / alarm : instantaneous concentration thresholds (ppm)
+#   rate         : rise rate (ppm per minute), measured over at least RATE_MIN_SECONDS
+#   twa          : time-weighted average exposure over TWA_WINDOW_SECONDS
+#
+# The rule set is compiled into numpy arrays and the per-helmet state is kept as
+# struct-of-arrays (one row per helmet), so a single reading and a batch of readings
+# from thousands of helmets go through the same vectorized code. TWA exposure is kept
+# in per-minute buckets (a ring per helmet), integrating the previous concentration
+# over the time since the previous reading.
+#
+# Alerts are edge-triggered: one message when a rule trips and one when it clears
+# (thresholds clear with hysteresis), published on GAS_ALERT_CHANNEL.
+
+import json
+import os
+import time
+
+import numpy as np
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("gas_rules")
+
+GAS_ALERT_CHANNEL = os.getenv("GAS_ALERT_CHANNEL", "helmet_gas_alerts")
+
+GASES = ("CO", "CH4")
+RULES = ("warn", "alarm", "rate", "twa")
+SEVERITY = {"warn": "warning", "alarm": "alarm", "rate": "warning", "twa": "alarm"}
+
+# ppm, ppm/min. None disables a rule.
+# CO: 25 ppm 8h TLV, 35 ppm REL, 200 ppm ceiling. CH4: 10% / 20% of LEL (5% by volume).
+DEFAULT_RULES = {
+    "CO": {"warn": 35, "alarm": 200, "rate": 50, "twa": 25},
+    "CH4": {"warn": 5000, "alarm": 10000, "rate": 2500, "twa": None},
+}
+
+TWA_WINDOW_SECONDS = int(os.getenv("GAS_TWA_WINDOW_SECONDS", str(8 * 3600)))
+BUCKET_SECONDS = 60
+# Sensor silent for longer than this: hold the last value only for this long
+MAX_GAP_SECONDS = float(os.getenv("GAS_MAX_GAP_SECONDS", "60"))
+RATE_MIN_SECONDS = float(os.getenv("GAS_RATE_MIN_SECONDS", "10"))
+# A tripped threshold clears once the value drops below limit * HYSTERESIS
+HYSTERESIS = float(os.getenv("GAS_HYSTERESIS", "0.9"))
+
+GAS_ALERTS = metrics.Counter("gas_alerts", "Gas rule alerts raised", ["gas", "rule"])
+GAS_EVAL_LATENCY = metrics.Histogram("gas_rules_duration_seconds", "Gas rule evaluation time per call",
+                                     buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                                              0.0025, 0.005, 0.01, 0.05))
+
+
+def load_rules() -> dict:
+    """DEFAULT_RULES, overridden per gas/rule by the GAS_RULES env var (JSON)."""
+    rules = {gas: dict(limits) for gas, limits in DEFAULT_RULES.items()}
+    override = os.getenv("GAS_RULES")
+    if override:
+        for gas, limits in json.loads(override).items():
+            rules[gas].update(limits)
+    return rules
+
+
+def compile_rules(rules: dict) -> np.ndarray:
+    """(len(GASES), len(RULES)) float64 limits, inf for disabled rules."""
+    limits = np.full((len(GASES), len(RULES)), np.inf)
+    for g, gas in enumerate(GASES):
+        for r, rule in enumerate(RULES):
+            value = rules.get(gas, {}).get(rule)
+            if value is not None:
+                limits[g, r] = float(value)
+    return limits
+
+
+class GasRuleEngine:
+    def __init__(self, limits: np.ndarray, capacity: int = 64):
+        self.limits = limits
+        self.buckets_per_window = max(1, TWA_WINDOW_SECONDS // BUCKET_SECONDS)
+        self.slots: dict[str, int] = {}
+        self.helmets: list[str] = []
+        self._allocate(capacity)
+
+    # --------------------------------------------------
+    # Per-helmet state (struct of arrays, grown by doubling)
+    # --------------------------------------------------
+
+    def _allocate(self, capacity: int):
+        g, b = len(GASES), self.buckets_per_window
+        fresh = {
+            "last_value": np.zeros((capacity, g)),
+            "last_time": np.zeros(capacity),
+            "rate_value": np.zeros((capacity, g)),
+            "rate_time": np.zeros(capacity),
+            "exposure": np.zeros((capacity, b, g)),
+            "bucket_id": np.full((capacity, b), -1, dtype=np.int64),
+            "active": np.zeros((capacity, g, len(RULES)), dtype=bool),
+        }
+        for name, array in fresh.items():
+            old = getattr(self, name, None)
+            if old is not None:
+                array[:len(old)] = old
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def _slot(self, helmet_id: str) -> int:
+        slot = self.slots.get(helmet_id)
+        if slot is None:
+            slot = self.slots[helmet_id] = len(self.helmets)
+            self.helmets.append(helmet_id)
+            if slot >= self.capacity:
+                self._allocate(self.capacity * 2)
+        return slot
+
+    def reset(self):
+        self.slots.clear()
+        self.helmets.clear()
+        for name in ("last_value", "last_time", "rate_value", "rate_time", "exposure"):
+            getattr(self, name)[:] = 0
+        self.bucket_id[:] = -1
+        self.active[:] = False
+
+    def is_active(self, helmet_id: str) -> bool:
+        slot = self.slots.get(helmet_id)
+        return slot is not None and bool(self.active[slot].any())
+
+    def twa(self, helmet_id: str, now: float | None = None) -> dict:
+        slot = self.slots.get(helmet_id)
+        if slot is None:
+            return {gas: 0.0 for gas in GASES}
+        now = time.time() if now is None else now
+        values = self._twa(np.array([slot]), np.array([int(now // BUCKET_SECONDS)]))[0]
+        return {gas: float(values[g]) for g, gas in enumerate(GASES)}
+
+    # --------------------------------------------------
+    # Evaluation
+    # --------------------------------------------------
+
+    def evaluate(self, helmet_id: str, values, now: float | None = None) -> list[dict]:
+        """One reading: values are the concentrations in GASES order."""
+        now = time.time() if now is None else now
+        slot = self._slot(helmet_id)
+        return self._step(np.array([slot]), np.array([values], dtype=np.float64), np.array([now]))
+
+    def evaluate_batch(self, helmet_ids: list[str], values: np.ndarray, timestamps: np.ndarray) -> list[dict]:
+        """
+        Many readings: values is (N, len(GASES)), timestamps (N,) in seconds.
+        Readings of the same helmet must be in time order; they are applied in rounds
+        so every round touches each helmet at most once.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        slots = np.fromiter((self._slot(h) for h in helmet_ids), dtype=np.int64, count=len(helmet_ids))
+
+        # Occurrence number of each reading within its helmet -> round it belongs to
+        seen: dict[int, int] = {}
+        rounds = np.empty(len(slots), dtype=np.int64)
+        for i, slot in enumerate(slots.tolist()):
+            rounds[i] = seen.get(slot, 0)
+            seen[slot] = rounds[i] + 1
+
+        alerts = []
+        for r in range(int(rounds.max()) + 1 if len(rounds) else 0):
+            idx = np.flatnonzero(rounds == r)
+            alerts.extend(self._step(slots[idx], values[idx], timestamps[idx]))
+        return alerts
+
+    def _twa(self, slots: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+        in_window = self.bucket_id[slots] > (bucket - self.buckets_per_window)[:, None]
+        exposure = np.einsum("nb,nbg->ng", in_window, self.exposure[slots])
+        return exposure / (self.buckets_per_window * BUCKET_SECONDS)
+
+    def _step(self, slots: np.ndarray, values: np.ndarray, now: np.ndarray) -> list[dict]:
+        """Applies one reading per helmet (slots are unique)."""
+        start = time.perf_counter()
+        limits = self.limits
+        n = len(slots)
+
+        # Time-weighted exposure: previous concentration held since the previous reading
+        last_time = self.last_time[slots]
+        known = last_time > 0
+        dt = np.where(known, np.clip(now - last_time, 0.0, MAX_GAP_SECONDS), 0.0)
+        bucket = (now // BUCKET_SECONDS).astype(np.int64)
+        ring = bucket % self.buckets_per_window
+        stale = self.bucket_id[slots, ring] != bucket
+        self.exposure[slots[stale], ring[stale]] = 0.0
+        self.bucket_id[slots, ring] = bucket
+        self.exposure[slots, ring] += self.last_value[slots] * dt[:, None]
+        twa = self._twa(slots, bucket)
+
+        self.last_value[slots] = values
+        self.last_time[slots] = now
+
+        # Rise rate against a reference reading at least RATE_MIN_SECONDS old
+        rate_time = self.rate_time[slots]
+        rate_dt = now - rate_time
+        rate_ready = (rate_time > 0) & (rate_dt >= RATE_MIN_SECONDS)
+        rate = (values - self.rate_value[slots]) * (60.0 / np.maximum(rate_dt, RATE_MIN_SECONDS))[:, None]
+        reset_ref = rate_ready | (rate_time <= 0)
+        self.rate_value[slots[reset_ref]] = values[reset_ref]
+        self.rate_time[slots[reset_ref]] = now[reset_ref]
+
+        # (n, gases, rules): measured value per rule, then trip / hold with hysteresis
+        measured = np.stack([values, values, rate, twa], axis=2)
+        was = self.active[slots]
+        trip = measured >= limits
+        hold = measured >= limits * HYSTERESIS
+        active = np.where(was, hold, trip)
+        # Rate only changes when a new rate was measured
+        active[:, :, 2] = np.where(rate_ready[:, None], active[:, :, 2], was[:, :, 2])
+        self.active[slots] = active
+
+        alerts = []
+        changed = active != was
+        if changed.any():
+            for i, g, r in zip(*np.nonzero(changed)):
+                alerts.append(self._alert(int(slots[i]), g, r, bool(active[i, g, r]),
+                                          float(measured[i, g, r]), float(now[i])))
+        GAS_EVAL_LATENCY.observe(time.perf_counter() - start)
+        return alerts
+
+    def _alert(self, slot: int, g: int, r: int, raised: bool, value: float, now: float) -> dict:
+        gas, rule = GASES[g], RULES[r]
+        if raised:
+            GAS_ALERTS.labels(gas, rule).inc()
+        return {
+            "helmet_ID": self.helmets[slot],
+            "gas": gas,
+            "rule": rule,
+            "severity": SEVERITY[rule],
+            "state": "raised" if raised else "cleared",
+            "value": round(value, 3),
+            "limit": float(self.limits[g, r]),
+            "timestamp": int(now * 1000),
+        }
+
+
+engine = GasRuleEngine(compile_rules(load_rules()))
+
+
+def evaluate(data, now: float | None = None) -> list[dict]:
+    """Evaluates one SensorInput-like reading; returns the alerts it raised or cleared."""
+    return engine.evaluate(data.helmet_ID, (data.CO_ppm, data.CH4_ppm), now)
+
+
+def in_alert(helmet_id: str) -> bool:
+    return engine.is_active(helmet_id)
+
+
+def any_raised(alerts: list[dict]) -> bool:
+    """True if a reading's alerts raise a hazard (a "cleared" transition is not one)."""
+    return any(alert["state"] == "raised" for alert in alerts)
+
+
+def encode_alert(alert: dict) -> bytes:
+    return json.dumps(alert).encode("utf-8")
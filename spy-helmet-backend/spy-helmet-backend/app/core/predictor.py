@@ -6,30 +6,54 @@ import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2" # Reduce TF logging
 
-print(f"DEBUG: CUDA_VISIBLE_DEVICES = {os.environ.get('CUDA_VISIBLE_DEVICES')}")
+import time
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("predictor")
+logger.debug("CUDA_VISIBLE_DEVICES = %s", os.environ.get("CUDA_VISIBLE_DEVICES"))
 
 from tensorflow.keras.models import load_model
 import numpy as np
 
-# Load model only once
-# Load model only once
+from app.core.registry import ModelRegistry
+
+# Original model file: the version "helmet2" in the registry. Newer versions are
+# app/model/registry/fatigue/<version>.keras (see app/core/registry.py).
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 MODEL_PATH = os.path.join(BASE_DIR, "app", "model", "helmet2.keras")
 
-try:
-    if os.path.exists(MODEL_PATH):
-        model = load_model(MODEL_PATH)
-        print(f"SUCCESS: Loaded fatigue model from {MODEL_PATH}")
-    else:
-        print(f"CRITICAL WARNING: Fatigue model not found at {MODEL_PATH}")
-        model = None
-except Exception as e:
-    print(f"CRITICAL ERROR: Failed to load fatigue model: {e}")
-    model = None
-
 # Class index to label mapping
 class_names = {0: "Normal", 1: "Stressed", 2: "Fatigue"}
 
+def _predict(model, sequences: np.ndarray) -> np.ndarray:
+    return model.predict(sequences, verbose=0)
+
+def _same_class(active: np.ndarray, shadow: np.ndarray) -> np.ndarray:
+    return np.argmax(active, axis=1) == np.argmax(shadow, axis=1)
+
+registry = ModelRegistry(
+    "fatigue",
+    loader=load_model,
+    predict=_predict,
+    agree=_same_class,
+    warmup_input=lambda: np.zeros((1, 100, 2), dtype=np.float32),
+    legacy_path=MODEL_PATH,
+    extension=".keras",
+)
+# Initial load happens at import, before the app serves anything; later versions are
+# swapped in by the registry's refresher
+registry.refresh()
+if registry.active is None:
+    logger.critical("No fatigue model loaded (%s)", registry.last_error or f"nothing at {MODEL_PATH}")
+
+def __getattr__(name):
+    # `predictor.model` is whatever version is active right now
+    if name == "model":
+        return registry.active.model if registry.active else None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def predict_fatigue(sequence: np.ndarray) -> dict:
     """
     Takes a (100, 5) sequence and returns the predicted class and confidence.
@@ -41,19 +65,53 @@ def predict_fatigue(sequence: np.ndarray) -> dict:
     sequence = np.expand_dims(sequence, axis=0)
 
     # Run prediction
-    if model is None:
+    start = time.perf_counter()
+    version, prediction = registry.predict(sequence)
+    if prediction is None:
         return {
             "prediction": "Error",
             "confidence": 0.0,
             "raw_scores": [0.0, 0.0, 0.0]
         }
-    
-    prediction = model.predict(sequence)
+    metrics.INFERENCE_LATENCY.observe(time.perf_counter() - start)
+    metrics.INFERENCE_BATCH_SIZE.observe(1)
+
     predicted_index = int(np.argmax(prediction[0]))
     confidence = float(prediction[0][predicted_index] * 100)
 
     return {
         "prediction": class_names[predicted_index],
         "confidence": confidence,
-        "raw_scores": prediction[0].tolist()
+        "raw_scores": prediction[0].tolist(),
+        "model_version": version
     }
+
+def predict_fatigue_batch(sequences: np.ndarray) -> list[dict]:
+    """
+    Takes a (N, 100, 2) stack of sequences and predicts all of them in one model call.
+    Returns one result dict per sequence, in the same format as predict_fatigue.
+    """
+    if sequences.ndim != 3 or sequences.shape[1:] != (100, 2):
+        raise ValueError("Expected input shape (N, 100, 2), got: " + str(sequences.shape))
+
+    start = time.perf_counter()
+    version, predictions = registry.predict(sequences)
+    if predictions is None:
+        return [
+            {"prediction": "Error", "confidence": 0.0, "raw_scores": [0.0, 0.0, 0.0]}
+            for _ in range(len(sequences))
+        ]
+    metrics.INFERENCE_LATENCY.observe(time.perf_counter() - start)
+    metrics.INFERENCE_BATCH_SIZE.observe(len(sequences))
+
+    indices = np.argmax(predictions, axis=1)
+
+    return [
+        {
+            "prediction": class_names[int(idx)],
+            "confidence": float(scores[idx] * 100),
+            "raw_scores": scores.tolist(),
+            "model_version": version
+        }
+        for idx, scores in zip(indices, predictions)
+    ]
@@ -0,0 +1,245 @@
+# app/core/publisher.py
+#
+# Non-blocking publisher for helmet_data_queue.
+#
+# Request handlers call publish(), which only appends to an in-memory list. A background
+# task on the event loop drains it and sends everything pending as one pipelined LPUSH,
+# so concurrent requests share a single Redis round-trip and Redis latency never blocks
+# a request. If Redis is unreachable, messages go to the local spool (app/core/spool.py)
+# and are replayed, in order, as soon as Redis answers again. While the spool holds
+# anything, new messages are spooled too so the queue keeps arrival order. Spilling only
+# writes to the memory map; the msync runs in a thread from the background loop, so a
+# spill never blocks requests on disk I/O.
+#
+# Each API process (uvicorn worker) needs a spool of its own: start() takes the first of
+# SPOOL_PATH, SPOOL_PATH.1, ... SPOOL_PATH.{SPOOL_SLOTS - 1} that no live process holds, so
+# a restarted worker picks up (and replays) a spool left behind by a dead one.
+#
+# notify() is the pub/sub side (e.g. gas alerts): notices are sent ahead of queued
+# readings on the next loop iteration and are never spooled, since a late alert is
+# worse than a logged one.
+
+import asyncio
+import os
+import threading
+import time
+
+import redis.asyncio as aioredis
+
+from app.core.spool import Spool, SpoolBusy
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("publisher")
+
+QUEUE_KEY = "helmet_data_queue"
+PUBLISH_BATCH = int(os.getenv("PUBLISH_BATCH", "500"))
+# Messages held in memory before they are spilled to the spool
+MAX_PENDING = int(os.getenv("PUBLISH_MAX_PENDING", "20000"))
+RETRY_INTERVAL = float(os.getenv("PUBLISH_RETRY_INTERVAL", "1.0"))
+SPOOL_PATH = os.getenv("SPOOL_PATH", "/tmp/spy-helmet/queue.spool")
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(64 * 1024 * 1024)))
+# Spool files to try, one per API process
+SPOOL_SLOTS = int(os.getenv("SPOOL_SLOTS", "64"))
+
+SPOOL_DEPTH = metrics.Gauge("spool_depth_messages", "Messages waiting in the local spool")
+SPOOL_BYTES = metrics.Gauge("spool_bytes", "Bytes used in the local spool")
+SPOOL_REPLAYED = metrics.Counter("spool_replayed_messages", "Messages replayed from the spool into Redis")
+SPOOLED = metrics.Counter("spool_appended_messages", "Messages written to the spool while Redis was unavailable")
+PUBLISH_BATCH_SIZE = metrics.Histogram("publish_batch_size", "Messages per pipelined Redis publish",
+                                       buckets=metrics.SIZE_BUCKETS)
+PUBLISH_LATENCY = metrics.Histogram("publish_duration_seconds", "Redis round-trip per publish batch")
+NOTIFY_FAILURES = metrics.Counter("notify_failures", "Pub/sub notices that could not be delivered to Redis")
+
+
+class Publisher:
+    def __init__(self, redis_url: str, spool_path: str = SPOOL_PATH, spool_max_bytes: int = SPOOL_MAX_BYTES):
+        self.client = aioredis.from_url(redis_url)
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+        self.spool = None
+        # Set by _spill(); the background loop msyncs the spool off the event loop
+        self.spool_dirty = False
+        # Held while a thread msyncs the spool, so stop() does not unmap it underneath
+        self.spool_lock = threading.Lock()
+        self.pending = []
+        self.notices = []
+        self.wakeup = None
+        self.task = None
+        self.redis_ok = True
+
+    # --------------------------------------------------
+    # Called from request handlers (event loop thread)
+    # --------------------------------------------------
+
+    def publish(self, message: bytes):
+        self.pending.append(message)
+        if len(self.pending) >= MAX_PENDING:
+            self._spill(self._take_pending())
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def notify(self, channel: str, message: bytes):
+        self.notices.append((channel, message))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def backlog(self) -> int:
+        """Messages accepted but not yet in Redis."""
+        return len(self.pending) + (len(self.spool) if self.spool is not None else 0)
+
+    # --------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------
+
+    def _open_spool(self) -> Spool:
+        for slot in range(SPOOL_SLOTS):
+            path = self.spool_path if slot == 0 else f"{self.spool_path}.{slot}"
+            try:
+                return Spool(path, self.spool_max_bytes)
+            except SpoolBusy:
+                continue
+        raise RuntimeError(f"All {SPOOL_SLOTS} spool files at {self.spool_path} are held by other processes")
+
+    async def start(self):
+        self.spool = self._open_spool()
+        logger.info("Spooling to %s", self.spool.path)
+        SPOOL_DEPTH.set_function(lambda: len(self.spool))
+        SPOOL_BYTES.set_function(lambda: self.spool.used_bytes)
+        if len(self.spool):
+            logger.warning("Spool holds %s messages from a previous run, replaying", len(self.spool))
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Whatever could not be sent is kept for the next start
+        if self.pending:
+            self._spill(self._take_pending())
+        if self.spool is not None:
+            with self.spool_lock:
+                self.spool.close()
+            self.spool = None
+
+    async def flush(self):
+        """Waits until every pending message has been sent (or spooled)."""
+        while self.pending or self.notices or (self.redis_ok and self.spool is not None and len(self.spool)):
+            await asyncio.sleep(0.001)
+
+    # --------------------------------------------------
+    # Background loop
+    # --------------------------------------------------
+
+    async def _run(self):
+        while True:
+            if not self.pending and not self.notices and not (self.spool and len(self.spool)):
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            if self.notices:
+                await self._send_notices()
+
+            if not self.redis_ok:
+                await asyncio.sleep(RETRY_INTERVAL)
+                self.redis_ok = await self._ping()
+                if not self.redis_ok:
+                    self._spill(self._take_pending())
+                    await self._sync_spool()
+                    continue
+                logger.info("Redis is back, replaying %s spooled messages", len(self.spool))
+
+            if len(self.spool):
+                # Keep order: the spool is older than anything pending
+                self._spill(self._take_pending())
+                await self._sync_spool()
+                await self._replay()
+            else:
+                await self._send_pending()
+            await self._sync_spool()
+
+    async def _sync_spool(self):
+        if not self.spool_dirty:
+            return
+        self.spool_dirty = False
+        await asyncio.to_thread(self._msync)
+
+    def _msync(self):
+        with self.spool_lock:
+            if self.spool is not None:
+                self.spool.flush()
+
+    async def _send_pending(self):
+        batch = self._take_pending()
+        if not batch:
+            return
+        try:
+            await self._push(batch)
+        except Exception as e:
+            self._on_redis_error(e)
+            self._spill(batch)
+
+    async def _send_notices(self):
+        notices, self.notices = self.notices, []
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for channel, message in notices:
+                    pipe.publish(channel, message)
+                await pipe.execute()
+        except Exception as e:
+            NOTIFY_FAILURES.inc(len(notices))
+            logger.error("Could not publish %s notices: %s", len(notices), e)
+
+    async def _replay(self):
+        messages, offset = self.spool.peek(PUBLISH_BATCH)
+        if not messages:
+            return
+        try:
+            await self._push(messages)
+        except Exception as e:
+            self._on_redis_error(e)
+            return
+        self.spool.consume(len(messages), offset)
+        SPOOL_REPLAYED.inc(len(messages))
+
+    async def _push(self, batch: list[bytes]):
+        start = time.perf_counter()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(batch), PUBLISH_BATCH):
+                pipe.lpush(QUEUE_KEY, *batch[i:i + PUBLISH_BATCH])
+            await pipe.execute()
+        PUBLISH_LATENCY.observe(time.perf_counter() - start)
+        PUBLISH_BATCH_SIZE.observe(len(batch))
+
+    async def _ping(self) -> bool:
+        try:
+            return bool(await self.client.ping())
+        except Exception:
+            return False
+
+    def _on_redis_error(self, error):
+        if self.redis_ok:
+            logger.error("Redis publish failed, spooling locally: %s", error)
+        self.redis_ok = False
+
+    def _take_pending(self) -> list[bytes]:
+        batch, self.pending = self.pending, []
+        return batch
+
+    def _spill(self, batch: list[bytes]):
+        if not batch:
+            return
+        if self.spool is None:
+            metrics.ENQUEUE_FAILURES.inc(len(batch))
+            return
+        written = self.spool.append_many(batch)
+        self.spool_dirty = True
+        SPOOLED.inc(written)
+        if written < len(batch):
+            metrics.ENQUEUE_FAILURES.inc(len(batch) - written)
+            logger.error("Spool full, dropped %s messages", len(batch) - written)
@@ -0,0 +1,153 @@
+# app/core/recent.py
+#
+# Recent-history tier: the last RECENT_MINUTES of every helmet's readings in Redis, so
+# live charts never query Postgres.
+#
+# Ingest appends each accepted reading as one fixed-size packed record (RECORD, 22 bytes:
+# offset in the minute plus the sensor values as fixed-point integers, like the binary
+# frames in app/core/codec.py) to the helmet's key for that minute:
+#
+#   recent:{helmet_ID}:{epoch minute} = record + record + ...      (APPEND)
+#
+# The minute in the key is the time index: the last N minutes of a helmet are N + 1
+# known keys, read with one MGET. Every key expires RECENT_MINUTES after its last append,
+# which caps the series. Appends are collected per key and sent every
+# RECENT_FLUSH_INTERVAL seconds as one pipelined APPEND / EXPIRE batch; if Redis is down
+# the batch is dropped (the readings still reach Postgres through the queue).
+
+import asyncio
+import os
+import struct
+import time
+
+import numpy as np
+
+from app.core import codec
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("recent")
+
+RECENT_MINUTES = int(os.getenv("RECENT_MINUTES", "10"))
+FLUSH_INTERVAL = float(os.getenv("RECENT_FLUSH_INTERVAL", "0.1"))
+# Helmets per /recent request
+MAX_HELMETS = int(os.getenv("RECENT_MAX_HELMETS", "200"))
+KEY_PREFIX = "recent:"
+KEY_TTL = (RECENT_MINUTES + 1) * 60
+
+# ms into the minute, BodyTemp, EnvTemp, Humidity, CO_ppm, CH4_ppm, HR, SpO2, fatigue_state, confidence
+RECORD = struct.Struct("<HhhHIIHBBH")
+DTYPE = np.dtype([("offset", "<u2"), ("temperature", "<i2"), ("env_temp", "<i2"), ("humidity", "<u2"),
+                  ("co_ppm", "<u4"), ("ch4_ppm", "<u4"), ("hr", "<u2"), ("spo2", "u1"), ("state", "u1"),
+                  ("confidence", "<u2")])
+
+FIELDS = ("received_at", "temperature", "env_temp", "humidity", "hr", "spo2", "co_ppm", "ch4_ppm",
+          "fatigue_state", "confidence")
+CENTI_FIELDS = ("temperature", "env_temp", "humidity", "co_ppm", "ch4_ppm")
+_STATES = np.array(codec.STATES, dtype=object)
+
+RECENT_RECORDS = metrics.Counter("recent_records", "Readings appended to the recent-history tier", ["outcome"])
+APPENDED = RECENT_RECORDS.labels("appended")
+UNENCODABLE = RECENT_RECORDS.labels("unencodable")
+FLUSH_DROPPED = RECENT_RECORDS.labels("dropped")
+
+# key -> packed records not sent to Redis yet (filled on the event loop, drained by flusher())
+pending: dict[str, bytearray] = {}
+
+
+def minute_key(helmet_id: str, minute: int) -> str:
+    return f"{KEY_PREFIX}{helmet_id}:{minute}"
+
+
+def append(data, fatigue_state: str | None, result: dict | None = None, now_ms: int | None = None):
+    """Queues one reading (any object with the SensorInput attributes) for the next flush."""
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    minute, offset = divmod(now_ms, 60000)
+    try:
+        record = RECORD.pack(
+            offset,
+            round(data.BodyTemp * 100),
+            round(data.EnvTemp * 100),
+            round(data.Humidity * 100),
+            round(data.CO_ppm * 100),
+            round(data.CH4_ppm * 100),
+            data.HR,
+            data.SpO2,
+            codec.STATE_CODES.get(fatigue_state, 0),
+            codec.NO_CONFIDENCE if result is None else round(result["confidence"] * 100),
+        )
+    except (struct.error, OverflowError, ValueError):
+        # Out-of-range or non-finite value: it is still stored, just not in the live tier
+        UNENCODABLE.inc()
+        return
+    key = minute_key(data.helmet_ID, minute)
+    chunk = pending.get(key)
+    if chunk is None:
+        pending[key] = bytearray(record)
+    else:
+        chunk += record
+    APPENDED.inc()
+
+
+async def flusher(client):
+    """Sends pending records every FLUSH_INTERVAL seconds, for the app's lifetime."""
+    global pending
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        if not pending:
+            continue
+        batch, pending = pending, {}
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for key, records in batch.items():
+                    pipe.append(key, bytes(records))
+                    pipe.expire(key, KEY_TTL)
+                await pipe.execute()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            FLUSH_DROPPED.inc(sum(len(records) for records in batch.values()) // RECORD.size)
+            logger.warning("Recent-history flush to Redis failed, dropped %s keys: %s", len(batch), e)
+
+
+def decode(chunks, first_minute: int, since_ms: int) -> dict:
+    """{field: [values]} from the per-minute values of one helmet, oldest first."""
+    parts, starts = [], []
+    for i, chunk in enumerate(chunks):
+        if chunk:
+            records = np.frombuffer(chunk, dtype=DTYPE, count=len(chunk) // RECORD.size)
+            parts.append(records)
+            starts.append(np.full(len(records), (first_minute + i) * 60000, dtype=np.int64))
+    if not parts:
+        return {field: [] for field in FIELDS}
+
+    records = np.concatenate(parts)
+    received_at = np.concatenate(starts) + records["offset"]
+    # Appends from several API processes may interleave slightly out of order
+    order = np.argsort(received_at, kind="stable")
+    order = order[received_at[order] >= since_ms]
+    records, received_at = records[order], received_at[order]
+
+    columns = {"received_at": received_at.tolist()}
+    for field in CENTI_FIELDS:
+        columns[field] = (records[field] / 100).tolist()
+    columns["hr"] = records["hr"].tolist()
+    columns["spo2"] = records["spo2"].tolist()
+    columns["fatigue_state"] = _STATES[records["state"]].tolist()
+    confidence = records["confidence"]
+    columns["confidence"] = [None if value == codec.NO_CONFIDENCE else value / 100 for value in confidence.tolist()]
+    return {field: columns[field] for field in FIELDS}
+
+
+def read(client, helmet_ids: list[str], minutes: float, now_ms: int | None = None) -> dict:
+    """{helmet_ID: {field: [values]}} for the last `minutes`, in one pipelined round-trip."""
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    since_ms = now_ms - int(minutes * 60000)
+    first, last = since_ms // 60000, now_ms // 60000
+    pipe = client.pipeline(transaction=False)
+    for helmet_id in helmet_ids:
+        pipe.mget([minute_key(helmet_id, minute) for minute in range(first, last + 1)])
+    results = pipe.execute()
+    return {helmet_id: decode(chunks, first, since_ms) for helmet_id, chunks in zip(helmet_ids, results)}
@@ -0,0 +1,328 @@
+# app/core/registry.py
+#
+# Versioned model artifacts with hot swap, for the fatigue model (app/core/predictor.py)
+# and the weekly report model (app_report/pipeline.py).
+#
+# Versions of a model live next to each other:
+#
+#   {MODEL_REGISTRY_DIR}/{name}/{version}{extension}     e.g. fatigue/2026-10-01.keras
+#   {MODEL_REGISTRY_DIR}/{name}/state.json               {"active": ..., "shadow": ..., "shadow_fraction": ...}
+#
+# plus the model's original file, available as the version named after it (e.g.
+# "helmet2"), which is what runs when no state.json exists.
+#
+# A version is loaded and warmed up with a dummy batch off the request path (a refresh
+# task on the event loop polls state.json, so every API process follows an activation
+# within MODEL_REFRESH_INTERVAL seconds), then swapped in with a single assignment.
+# Requests keep using the version they started with and never wait for a load.
+#
+# A shadow version scores a random SHADOW fraction of the same inputs on a background
+# thread; its latency and its agreement with the active version are reported per version.
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("registry")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(BASE_DIR, "model", "registry"))
+REFRESH_INTERVAL = float(os.getenv("MODEL_REFRESH_INTERVAL", "10"))
+# Shadow batches waiting for the shadow thread; more are dropped, not queued
+SHADOW_MAX_PENDING = int(os.getenv("MODEL_SHADOW_MAX_PENDING", "32"))
+
+MODEL_LATENCY = metrics.Histogram("model_inference_duration_seconds", "Inference latency per model version",
+                                  ["model", "version", "role"])
+SHADOW_RESULTS = metrics.Counter("model_shadow_results", "Shadow predictions compared with the active version",
+                                 ["model", "version", "result"])
+MODEL_LOADS = metrics.Counter("model_loads", "Model version loads", ["model", "version", "outcome"])
+
+_shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-shadow")
+_shadow_pending = 0
+_shadow_lock = threading.Lock()
+
+# name -> ModelRegistry, refreshed by refresher()
+registries: dict = {}
+
+
+class ModelVersion:
+    __slots__ = ("version", "model", "path", "loaded_at", "warmup_ms")
+
+    def __init__(self, version: str, model, path: str, warmup_ms: float):
+        self.version = version
+        self.model = model
+        self.path = path
+        self.loaded_at = datetime.utcnow()
+        self.warmup_ms = warmup_ms
+
+
+class ModelRegistry:
+    def __init__(self, name: str, loader, predict, agree, warmup_input, legacy_path: str | None = None,
+                 extension: str = ""):
+        """
+        loader(path) -> model; predict(model, inputs) -> outputs (one row per input row);
+        agree(active_outputs, shadow_outputs) -> bool per row; warmup_input() -> dummy batch.
+        """
+        self.name = name
+        self.loader = loader
+        self.predict_fn = predict
+        self.agree = agree
+        self.warmup_input = warmup_input
+        self.legacy_path = legacy_path
+        self.extension = extension
+        self.directory = os.path.join(REGISTRY_DIR, name)
+
+        self.active: ModelVersion | None = None
+        self.shadow: ModelVersion | None = None
+        self.shadow_fraction = 0.0
+        self.loading: str | None = None
+        self.last_error: str | None = None
+        self.agreement = {"agree": 0, "disagree": 0}
+        # One load at a time per model
+        self._load_lock = threading.Lock()
+        # version -> artifact mtime of a failed load; retried once the file changes
+        self._failed: dict[str, float | None] = {}
+        registries[name] = self
+
+    # --------------------------------------------------
+    # Versions and desired state
+    # --------------------------------------------------
+
+    @property
+    def legacy_version(self) -> str | None:
+        if self.legacy_path is None:
+            return None
+        return os.path.splitext(os.path.basename(self.legacy_path))[0]
+
+    def path_for(self, version: str) -> str:
+        if version == self.legacy_version:
+            return self.legacy_path
+        return os.path.join(self.directory, version + self.extension)
+
+    def versions(self) -> list[str]:
+        found = []
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            found.append(self.legacy_version)
+        if os.path.isdir(self.directory):
+            found.extend(sorted(
+                entry[:len(entry) - len(self.extension)] if self.extension else entry
+                for entry in os.listdir(self.directory)
+                if entry != "state.json" and (not self.extension or entry.endswith(self.extension))
+            ))
+        return found
+
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, "state.json")
+
+    def desired_state(self) -> dict:
+        try:
+            with open(self._state_path()) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        if not state.get("active"):
+            available = self.versions()
+            state["active"] = self.legacy_version if self.legacy_version in available else \
+                (available[-1] if available else None)
+        return state
+
+    def _write_state(self, **changes):
+        state = self.desired_state()
+        state.update(changes)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._state_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path())
+
+    def activate(self, version: str):
+        """Makes `version` the active one for every process (loaded by the next refresh)."""
+        self._check(version)
+        self._failed.pop(version, None)
+        if self.desired_state().get("shadow") == version:
+            # Promoting the shadow: it stops being compared with itself
+            self._write_state(active=version, shadow=None, shadow_fraction=0.0)
+        else:
+            self._write_state(active=version)
+
+    def set_shadow(self, version: str | None, fraction: float = 0.0):
+        if version is not None:
+            self._check(version)
+            if version == self.desired_state().get("active"):
+                raise ValueError(f"{self.name} model {version} is already active")
+            self._failed.pop(version, None)
+        self._write_state(shadow=version, shadow_fraction=fraction if version else 0.0)
+
+    def _check(self, version: str):
+        if version not in self.versions():
+            raise ValueError(f"Unknown {self.name} model version: {version}")
+
+    # --------------------------------------------------
+    # Loading (never on the request path)
+    # --------------------------------------------------
+
+    def load(self, version: str) -> ModelVersion:
+        path = self.path_for(version)
+        self.loading = version
+        try:
+            model = self.loader(path)
+            start = time.perf_counter()
+            # First calls build graphs / allocate; pay for that here, not in a request
+            self.predict_fn(model, self.warmup_input())
+            warmup_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            MODEL_LOADS.labels(self.name, version, "error").inc()
+            self.last_error = f"{version}: {e}"
+            raise
+        finally:
+            self.loading = None
+        MODEL_LOADS.labels(self.name, version, "ok").inc()
+        logger.info("Loaded %s model %s from %s (warm-up %.0f ms)", self.name, version, path, warmup_ms)
+        return ModelVersion(version, model, path, warmup_ms)
+
+    def _mtime(self, version: str) -> float | None:
+        try:
+            return os.path.getmtime(self.path_for(version))
+        except OSError:
+            return None
+
+    def _may_load(self, version: str) -> bool:
+        return version not in self._failed or self._failed[version] != self._mtime(version)
+
+    def refresh(self):
+        """Brings the loaded versions in line with state.json (blocking; run off the event loop)."""
+        if not self._load_lock.acquire(blocking=False):
+            return
+        try:
+            state = self.desired_state()
+            wanted, wanted_shadow = state.get("active"), state.get("shadow")
+
+            if wanted and self._may_load(wanted) and (self.active is None or self.active.version != wanted):
+                if self.shadow is not None and self.shadow.version == wanted:
+                    self.active = self.shadow
+                else:
+                    try:
+                        # The old version keeps serving until this returns
+                        self.active = self.load(wanted)
+                    except Exception as e:
+                        self._failed[wanted] = self._mtime(wanted)
+                        logger.critical("Failed to load %s model %s: %s", self.name, wanted, e)
+                if self.active is not None and self.active.version == wanted:
+                    logger.info("🔁 %s model now serving version %s", self.name, wanted)
+
+            current_shadow = self.shadow.version if self.shadow else None
+            if wanted_shadow != current_shadow and (not wanted_shadow or self._may_load(wanted_shadow)):
+                self.shadow_fraction = 0.0
+                self.shadow = None
+                self.agreement = {"agree": 0, "disagree": 0}
+                if wanted_shadow:
+                    try:
+                        self.shadow = self.load(wanted_shadow)
+                    except Exception as e:
+                        self._failed[wanted_shadow] = self._mtime(wanted_shadow)
+                        logger.error("Failed to load %s shadow model %s: %s", self.name, wanted_shadow, e)
+            self.shadow_fraction = float(state.get("shadow_fraction") or 0.0) if self.shadow else 0.0
+        finally:
+            self._load_lock.release()
+
+    # --------------------------------------------------
+    # Inference
+    # --------------------------------------------------
+
+    def predict(self, inputs) -> tuple[str, object] | tuple[None, None]:
+        """(version, outputs) from the active version, or (None, None) if none is loaded."""
+        current = self.active
+        if current is None:
+            return None, None
+        start = time.perf_counter()
+        outputs = self.predict_fn(current.model, inputs)
+        MODEL_LATENCY.labels(self.name, current.version, "active").observe(time.perf_counter() - start)
+
+        shadow = self.shadow
+        if shadow is not None and self.shadow_fraction > 0:
+            self._submit_shadow(shadow, inputs, outputs)
+        return current.version, outputs
+
+    def _submit_shadow(self, shadow: ModelVersion, inputs, outputs):
+        global _shadow_pending
+        n = len(inputs)
+        if n == 1:
+            if random.random() >= self.shadow_fraction:
+                return
+            rows = None
+        else:
+            rows = np.flatnonzero(np.random.random(n) < self.shadow_fraction)
+            if not len(rows):
+                return
+
+        with _shadow_lock:
+            if _shadow_pending >= SHADOW_MAX_PENDING:
+                SHADOW_RESULTS.labels(self.name, shadow.version, "dropped").inc()
+                return
+            _shadow_pending += 1
+        sample = inputs if rows is None else inputs[rows]
+        expected = outputs if rows is None else np.asarray(outputs)[rows]
+        _shadow_executor.submit(self._score_shadow, shadow, sample, expected)
+
+    def _score_shadow(self, shadow: ModelVersion, inputs, expected):
+        global _shadow_pending
+        try:
+            start = time.perf_counter()
+            outputs = self.predict_fn(shadow.model, inputs)
+            MODEL_LATENCY.labels(self.name, shadow.version, "shadow").observe(time.perf_counter() - start)
+            agreed = int(np.count_nonzero(self.agree(expected, outputs)))
+            disagreed = len(inputs) - agreed
+            if shadow is self.shadow:
+                self.agreement["agree"] += agreed
+                self.agreement["disagree"] += disagreed
+            SHADOW_RESULTS.labels(self.name, shadow.version, "agree").inc(agreed)
+            SHADOW_RESULTS.labels(self.name, shadow.version, "disagree").inc(disagreed)
+        except Exception as e:
+            SHADOW_RESULTS.labels(self.name, shadow.version, "error").inc()
+            logger.warning("Shadow scoring with %s model %s failed: %s", self.name, shadow.version, e)
+        finally:
+            with _shadow_lock:
+                _shadow_pending -= 1
+
+    def status(self) -> dict:
+        compared = self.agreement["agree"] + self.agreement["disagree"]
+        return {
+            "name": self.name,
+            "versions": self.versions(),
+            "desired": self.desired_state(),
+            "active": _describe(self.active),
+            "shadow": _describe(self.shadow),
+            "shadow_fraction": self.shadow_fraction,
+            "shadow_agreement": round(self.agreement["agree"] / compared, 4) if compared else None,
+            "shadow_compared": compared,
+            "loading": self.loading,
+            "last_error": self.last_error,
+        }
+
+
+def _describe(version: ModelVersion | None) -> dict | None:
+    if version is None:
+        return None
+    return {"version": version.version, "path": version.path, "loaded_at": version.loaded_at.isoformat(),
+            "warmup_ms": round(version.warmup_ms, 1)}
+
+
+async def refresher():
+    """Follows state.json changes for every registry, for the app's lifetime."""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        for registry in list(registries.values()):
+            try:
+                await asyncio.to_thread(registry.refresh)
+            except Exception as e:
+                logger.error("Model refresh for %s failed: %s", registry.name, e)
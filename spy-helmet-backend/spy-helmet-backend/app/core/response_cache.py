@@ -0,0 +1,226 @@
+# app/core/response_cache.py
+#
+# Response cache for the historical endpoints (/historical/sessions/{helmet_code},
+# /historical/readings/{session_id}).
+#
+# Two tiers hold the serialized JSON body and its ETag:
+#   local : per-process LRU, bounded by HIST_CACHE_LOCAL_BYTES
+#   redis : "hist:{key}" = etag + b"\n" + body, shared by every API process
+#
+# A closed session only changes when the backfill rewrites it, which invalidates it, so
+# its entries never expire (HIST_CACHE_CLOSED_TTL can put a bound on the Redis copy). Anything that can still change (an active
+# session, a helmet whose session is open) is kept for HIST_CACHE_ACTIVE_TTL seconds.
+# The worker (and the backfill) invalidate the keys they change: the Redis entries are
+# deleted and the keys are published on HIST_CACHE_CHANNEL, where every API process
+# drops its local copies.
+#
+# Keys start with the company the response was built for (the endpoints only store it
+# after checking the company owns the helmet / session), so a cached body is never
+# served to another tenant.
+#
+# Responses are sent with Cache-Control: no-cache, so clients always revalidate with
+# If-None-Match and get a 304 without a body while the entry is unchanged.
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.utils import fastjson, metrics
+from app.utils.log import get_logger
+
+logger = get_logger("response_cache")
+
+LOCAL_MAX_BYTES = int(os.getenv("HIST_CACHE_LOCAL_BYTES", str(64 * 1024 * 1024)))
+ACTIVE_TTL = float(os.getenv("HIST_CACHE_ACTIVE_TTL", "5"))
+# 0: closed-session entries stay in Redis until evicted by its maxmemory policy
+CLOSED_TTL = int(os.getenv("HIST_CACHE_CLOSED_TTL", "0"))
+CHANNEL = os.getenv("HIST_CACHE_CHANNEL", "hist_cache_invalidate")
+KEY_PREFIX = "hist:"
+
+CACHE_LOOKUPS = metrics.Counter("hist_cache_lookups", "Historical response cache lookups", ["tier"])
+CACHE_BYTES = metrics.Gauge("hist_cache_local_bytes", "Bytes held by the local historical response cache")
+
+
+class Entry:
+    __slots__ = ("etag", "body", "expires")
+
+    def __init__(self, etag: str, body: bytes, expires: float | None):
+        self.etag = etag
+        self.body = body
+        # time.monotonic() deadline; None for immutable entries
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires is None or time.monotonic() < self.expires
+
+
+class LocalCache:
+    """LRU of Entry by key, bounded by total body size (thread-safe: sync routes run in the threadpool)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, Entry] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Entry | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not entry.fresh:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+
+local = LocalCache(LOCAL_MAX_BYTES)
+CACHE_BYTES.set_function(lambda: local.size)
+
+
+def readings_key(company_id, session_id, shape: str = "rows") -> str:
+    key = f"{company_id}:readings:{session_id}"
+    return key if shape == "rows" else f"{key}:{shape}"
+
+
+def readings_keys(company_id, session_id) -> list[str]:
+    """Every cached shape of a session's readings."""
+    return [readings_key(company_id, session_id, shape) for shape in fastjson.SHAPES]
+
+
+def sessions_key(company_id, helmet_code: str) -> str:
+    return f"{company_id}:sessions:{helmet_code}"
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def lookup(client, key: str) -> Entry | None:
+    entry = local.get(key)
+    if entry is not None:
+        CACHE_LOOKUPS.labels("local").inc()
+        return entry
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.get(KEY_PREFIX + key)
+        pipe.pttl(KEY_PREFIX + key)
+        stored, ttl_ms = pipe.execute()
+    except Exception as e:
+        logger.warning("Response cache read from Redis failed: %s", e)
+        stored = None
+    if not stored:
+        CACHE_LOOKUPS.labels("miss").inc()
+        return None
+    etag, _, body = stored.partition(b"\n")
+    # pttl is -1 for keys without expiry; the local copy lives as long as the Redis one
+    expires = None if ttl_ms is None or ttl_ms < 0 else time.monotonic() + ttl_ms / 1000
+    entry = Entry(etag.decode(), body, expires)
+    local.put(key, entry)
+    CACHE_LOOKUPS.labels("redis").inc()
+    return entry
+
+
+def store(client, key: str, payload, immutable: bool) -> Entry:
+    body = fastjson.dumps(payload)
+    etag = _etag(body)
+    if immutable:
+        entry = Entry(etag, body, None)
+        ttl = CLOSED_TTL or None
+    else:
+        entry = Entry(etag, body, time.monotonic() + ACTIVE_TTL)
+        ttl = max(1, int(ACTIVE_TTL * 1000))
+    local.put(key, entry)
+    try:
+        if immutable:
+            client.set(KEY_PREFIX + key, etag.encode() + b"\n" + body, ex=ttl)
+        else:
+            client.set(KEY_PREFIX + key, etag.encode() + b"\n" + body, px=ttl)
+    except Exception as e:
+        logger.warning("Response cache write to Redis failed: %s", e)
+    return entry
+
+
+def respond(request: Request, entry: Entry) -> Response:
+    headers = {
+        "ETag": entry.etag,
+        # Even a closed session can be rewritten (backfill): browsers always revalidate, which
+        # costs a 304 from the cache
+        "Cache-Control": "private, no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and entry.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def invalidate(client, keys):
+    """Drops keys from Redis and from every API process's local cache."""
+    keys = list(keys)
+    if not keys:
+        return
+    local.discard(keys)
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(*(KEY_PREFIX + key for key in keys))
+    pipe.publish(CHANNEL, json.dumps(keys))
+    pipe.execute()
+
+
+async def listener(client):
+    """Applies invalidations published by the worker to the local cache, for the app's lifetime."""
+    while True:
+        pubsub = None
+        try:
+            pubsub = client.pubsub()
+            await pubsub.subscribe(CHANNEL)
+            # Whatever changed while unsubscribed is unknown
+            local.clear()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    local.discard(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Response cache invalidation listener failed, retrying: %s", e)
+            local.clear()
+            await asyncio.sleep(5)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
@@ -0,0 +1,258 @@
+# app/core/rollups.py
+#
+# Continuous per-helmet aggregates of readings at several resolutions (10 s, 1 min,
+# 15 min, 1 h), kept in reading_rollups with min / max / sum / count per metric.
+#
+# The worker folds every batch it writes into these buckets (one upsert per batch, in
+# the same transaction as the readings), so charts over a shift or a week read a few
+# thousand bucket rows instead of every raw reading.
+#
+# Readings written before rollups existed can be aggregated once with:
+#   python -m app.core.rollups --since 2026-01-01 [--until 2026-02-01]   (Postgres only)
+
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.db.models import ReadingRollup
+
+# Bucket widths in seconds, finest first
+RESOLUTIONS = (10, 60, 900, 3600)
+# Reading column -> rollup column prefix
+METRICS = ("hr", "temperature", "spo2", "co_ppm", "ch4_ppm")
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(ts: datetime, resolution: int) -> datetime:
+    seconds = int((ts - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def _new_bucket(row: dict) -> list:
+    # [count, fatigue_count, mins, maxs, sums], metrics in METRICS order
+    values = [row.get(metric) for metric in METRICS]
+    return [1, 1 if row.get("fatigue_state") == "Fatigue" else 0, values, list(values), list(values)]
+
+
+def _merge(bucket: list, other: list):
+    bucket[0] += other[0]
+    bucket[1] += other[1]
+    mins, maxs, sums = bucket[2], bucket[3], bucket[4]
+    for i, total in enumerate(other[4]):
+        if total is None:
+            continue
+        if sums[i] is None:
+            mins[i], maxs[i], sums[i] = other[2][i], other[3][i], total
+        else:
+            if other[2][i] < mins[i]:
+                mins[i] = other[2][i]
+            if other[3][i] > maxs[i]:
+                maxs[i] = other[3][i]
+            sums[i] += total
+
+
+def aggregate(rows: list[dict]) -> list[dict]:
+    """Folds reading rows (as written by the worker) into one rollup row per bucket."""
+    # Rows -> finest buckets, then each resolution from the one before it
+    finest = RESOLUTIONS[0]
+    level: dict[tuple, list] = {}
+    for row in rows:
+        seconds = int((row["inserted_at"] - EPOCH).total_seconds())
+        key = (row["helmet_id"], seconds - seconds % finest)
+        bucket = level.get(key)
+        if bucket is None:
+            level[key] = _new_bucket(row)
+        else:
+            _merge(bucket, _new_bucket(row))
+
+    levels = {finest: level}
+    for resolution in RESOLUTIONS[1:]:
+        coarser: dict[tuple, list] = {}
+        for (helmet_id, start), bucket in level.items():
+            key = (helmet_id, start - start % resolution)
+            target = coarser.get(key)
+            if target is None:
+                coarser[key] = [bucket[0], bucket[1], list(bucket[2]), list(bucket[3]), list(bucket[4])]
+            else:
+                _merge(target, bucket)
+        levels[resolution] = level = coarser
+
+    out = []
+    for resolution, buckets in levels.items():
+        for (helmet_id, start), (count, fatigue_count, mins, maxs, sums) in buckets.items():
+            row = {"helmet_id": helmet_id, "resolution": resolution,
+                   "bucket_start": EPOCH + timedelta(seconds=start),
+                   "count": count, "fatigue_count": fatigue_count}
+            for i, metric in enumerate(METRICS):
+                row[f"{metric}_min"], row[f"{metric}_max"], row[f"{metric}_sum"] = mins[i], maxs[i], sums[i]
+            out.append(row)
+    # Sorted so concurrent writers lock bucket rows in the same order
+    out.sort(key=lambda r: (str(r["helmet_id"]), r["resolution"], r["bucket_start"]))
+    return out
+
+
+UPSERT_SQL = """
+INSERT INTO reading_rollups (helmet_id, resolution, bucket_start, count, fatigue_count, {columns})
+VALUES (:helmet_id, :resolution, :bucket_start, :count, :fatigue_count, {values})
+ON CONFLICT (helmet_id, resolution, bucket_start) DO UPDATE SET
+    count = reading_rollups.count + excluded.count,
+    fatigue_count = reading_rollups.fatigue_count + excluded.fatigue_count,
+    {updates}
+"""
+
+_upsert_cache: dict = {}
+
+
+def _upsert_statement(dialect: str):
+    # Plain SQL: the ORM's ON CONFLICT construct is not cacheable and was recompiled per batch
+    statement = _upsert_cache.get(dialect)
+    if statement is not None:
+        return statement
+
+    least, greatest = ("least", "greatest") if dialect == "postgresql" else ("min", "max")
+    columns = [f"{metric}_{agg}" for metric in METRICS for agg in ("min", "max", "sum")]
+    updates = []
+    for metric in METRICS:
+        lo, hi, total = f"{metric}_min", f"{metric}_max", f"{metric}_sum"
+        # coalesce: a bucket (or batch) may have no value for a metric yet
+        updates.append(f"{lo} = {least}(coalesce(reading_rollups.{lo}, excluded.{lo}), "
+                       f"coalesce(excluded.{lo}, reading_rollups.{lo}))")
+        updates.append(f"{hi} = {greatest}(coalesce(reading_rollups.{hi}, excluded.{hi}), "
+                       f"coalesce(excluded.{hi}, reading_rollups.{hi}))")
+        updates.append(f"{total} = coalesce(reading_rollups.{total}, 0) + coalesce(excluded.{total}, 0)")
+
+    table = ReadingRollup.__table__.c
+    statement = text(UPSERT_SQL.format(
+        columns=", ".join(columns),
+        values=", ".join(f":{c}" for c in columns),
+        updates=",\n    ".join(updates),
+    )).bindparams(bindparam("helmet_id", type_=table.helmet_id.type),
+                  bindparam("bucket_start", type_=table.bucket_start.type))
+    _upsert_cache[dialect] = statement
+    return statement
+
+
+def upsert(db: Session, rows: list[dict]):
+    """Adds a batch of reading rows to their buckets (caller commits)."""
+    rollups = aggregate(rows)
+    if rollups:
+        db.execute(_upsert_statement(db.get_bind().dialect.name), rollups)
+
+
+ADJUST_FATIGUE_SQL = text("""
+UPDATE reading_rollups SET fatigue_count = fatigue_count + :delta
+WHERE helmet_id = :helmet_id AND resolution = :resolution AND bucket_start = :bucket_start
+""").bindparams(bindparam("helmet_id", type_=ReadingRollup.__table__.c.helmet_id.type),
+                bindparam("bucket_start", type_=ReadingRollup.__table__.c.bucket_start.type))
+
+
+def adjust_fatigue_counts(db: Session, changes: list[tuple]):
+    """
+    Applies fatigue_state changes of already written readings to their buckets.
+    changes: (helmet_id, inserted_at, +1 / -1) per reading that became / stopped being
+    "Fatigue" (caller commits).
+    """
+    totals: dict[tuple, int] = {}
+    for helmet_id, inserted_at, delta in changes:
+        seconds = int((inserted_at - EPOCH).total_seconds())
+        for resolution in RESOLUTIONS:
+            key = (helmet_id, resolution, seconds - seconds % resolution)
+            totals[key] = totals.get(key, 0) + delta
+    params = [
+        {"helmet_id": helmet_id, "resolution": resolution,
+         "bucket_start": EPOCH + timedelta(seconds=start), "delta": delta}
+        for (helmet_id, resolution, start), delta in sorted(totals.items(), key=lambda item: str(item[0]))
+        if delta
+    ]
+    if params:
+        db.execute(ADJUST_FATIGUE_SQL, params)
+
+
+# --------------------------------------------------
+# Queries
+# --------------------------------------------------
+
+def pick_resolution(start: datetime, end: datetime, max_points: int) -> int:
+    """Finest resolution whose bucket count over [start, end) fits in max_points."""
+    span = max((end - start).total_seconds(), 0)
+    for resolution in RESOLUTIONS:
+        if span / resolution <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def query_series(db: Session, helmet_id, start: datetime, end: datetime, max_points: int) -> tuple[int, list[dict]]:
+    resolution = pick_resolution(start, end, max_points)
+    rows = db.query(ReadingRollup).filter(
+        ReadingRollup.helmet_id == helmet_id,
+        ReadingRollup.resolution == resolution,
+        ReadingRollup.bucket_start >= bucket_start(start, resolution),
+        ReadingRollup.bucket_start < end,
+    ).order_by(ReadingRollup.bucket_start.asc()).all()
+    return resolution, [serialize(row) for row in rows]
+
+
+# Keys of every serialized point, in order
+SERIES_FIELDS = ("t", "count", "fatigue_count") + tuple(
+    f"{metric}_{agg}" for metric in METRICS for agg in ("min", "max", "avg"))
+
+
+def serialize(row: ReadingRollup) -> dict:
+    point = {"t": row.bucket_start.isoformat(), "count": row.count, "fatigue_count": row.fatigue_count}
+    for metric in METRICS:
+        total = getattr(row, f"{metric}_sum")
+        point[f"{metric}_min"] = getattr(row, f"{metric}_min")
+        point[f"{metric}_max"] = getattr(row, f"{metric}_max")
+        point[f"{metric}_avg"] = round(total / row.count, 3) if total is not None and row.count else None
+    return point
+
+
+# --------------------------------------------------
+# One-off rebuild from raw readings (Postgres)
+# --------------------------------------------------
+
+REBUILD_SQL = """
+INSERT INTO reading_rollups (helmet_id, resolution, bucket_start, count, fatigue_count, {columns})
+SELECT helmet_id, :resolution,
+       to_timestamp(floor(extract(epoch FROM inserted_at) / :resolution) * :resolution) AT TIME ZONE 'UTC',
+       count(*), count(*) FILTER (WHERE fatigue_state = 'Fatigue'), {aggregates}
+FROM readings
+WHERE inserted_at >= :since AND inserted_at < :until
+GROUP BY 1, 3
+ON CONFLICT (helmet_id, resolution, bucket_start) DO UPDATE SET
+    count = excluded.count, fatigue_count = excluded.fatigue_count, {replacements}
+"""
+
+
+def rebuild(db: Session, since: datetime, until: datetime):
+    """
+    Recomputes buckets in [since, until) from readings, replacing what is there.
+    Only run it for ranges the worker is not writing to anymore.
+    """
+    # Whole hours, so no bucket at any resolution is rebuilt from part of its readings
+    since, until = bucket_start(since, RESOLUTIONS[-1]), bucket_start(until, RESOLUTIONS[-1])
+    columns = ", ".join(f"{m}_{agg}" for m in METRICS for agg in ("min", "max", "sum"))
+    aggregates = ", ".join(f"{agg}({m})" for m in METRICS for agg in ("min", "max", "sum"))
+    replacements = ", ".join(f"{c} = excluded.{c}" for c in columns.split(", "))
+    statement = text(REBUILD_SQL.format(columns=columns, aggregates=aggregates, replacements=replacements))
+    for resolution in RESOLUTIONS:
+        db.execute(statement, {"resolution": resolution, "since": since, "until": until})
+        db.commit()
+        print(f"✅ Rebuilt {resolution}s rollups for {since} .. {until}")
+
+
+if __name__ == "__main__":
+    from app.db.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild reading_rollups from raw readings")
+    parser.add_argument("--since", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        rebuild(session, args.since, args.until or datetime.utcnow())
+    finally:
+        session.close()
@@ -0,0 +1,210 @@
+# app/core/sequencing.py
+#
+# Per-helmet Packet_no tracking: drops retried (duplicate) packets and puts packets that
+# overtake each other on flaky Wi-Fi back in order before they reach the window, Redis
+# or Postgres.
+#
+# Every helmet keeps the highest Packet_no seen and a bitmap of the SEQ_WINDOW packets
+# below it (a Python int, bit i = highest - i), so a duplicate check is one shift and
+# mask. A packet that arrives ahead of the next expected one is held; it is released
+# as soon as the gap fills, or, when the gap does not fill within SEQ_REORDER_WINDOW
+# packets or SEQ_REORDER_DELAY seconds, the missing packets are counted as lost and
+# everything held is released in order. A packet arriving after its slot was given up
+# on is dropped as late.
+#
+# An ESP32 reboot starts its counter again at 1, so tracking starts over (the packet is
+# accepted) when a packet arrives after SEQ_RESTART_IDLE seconds without any, when the
+# Packet_no drops back below SEQ_RESTART_BELOW from further ahead than the reorder window,
+# or when it is far below the tracked range. Trackers of helmets silent for
+# SEQ_TRACKER_TTL seconds are dropped.
+#
+# Work done on a packet before it is accepted (the gas rules, whose TWA and rate state
+# must see each reading once) goes through precheck(): its result is kept until the
+# packet is accepted, so a retry of a refused (429) packet reuses it instead of doing
+# it twice.
+#
+# State is per API process: helmets are expected to stick to one instance, as their
+# sliding windows already do.
+
+import os
+import time
+
+from app.utils import metrics
+
+SEQ_WINDOW = int(os.getenv("SEQ_WINDOW", "1024"))
+REORDER_WINDOW = int(os.getenv("SEQ_REORDER_WINDOW", "8"))
+REORDER_DELAY = float(os.getenv("SEQ_REORDER_DELAY", "2.0"))
+WINDOW_MASK = (1 << SEQ_WINDOW) - 1
+RESTART_IDLE = float(os.getenv("SEQ_RESTART_IDLE", "10"))
+RESTART_BELOW = int(os.getenv("SEQ_RESTART_BELOW", "16"))
+TRACKER_TTL = float(os.getenv("SEQ_TRACKER_TTL", "300"))
+# Prechecked packets kept per helmet while they wait to be accepted
+MAX_PRECHECKED = int(os.getenv("SEQ_MAX_PRECHECKED", "64"))
+
+SEQUENCE_EVENTS = metrics.Counter("sequence_events", "Packet sequence events per type", ["event"])
+DUPLICATES = SEQUENCE_EVENTS.labels("duplicate")
+LATE = SEQUENCE_EVENTS.labels("late")
+LOST = SEQUENCE_EVENTS.labels("lost")
+REORDERED = SEQUENCE_EVENTS.labels("reordered")
+RESETS = SEQUENCE_EVENTS.labels("reset")
+
+
+class Tracker:
+    __slots__ = ("highest", "seen", "expected", "held", "held_since", "last_seen")
+
+    def __init__(self, packet_no: int, now: float):
+        self.highest = packet_no
+        self.seen = 1
+        self.expected = packet_no + 1
+        # Packet_no -> (arrival time, item)
+        self.held: dict[int, tuple] = {}
+        # Arrival time of the oldest held packet
+        self.held_since = 0.0
+        # Arrival time of the latest packet
+        self.last_seen = now
+
+
+trackers: dict[str, Tracker] = {}
+# helmet_ID -> {Packet_no: (key, result, time)} of packets prechecked but not accepted yet
+prechecked: dict[str, dict[int, tuple]] = {}
+
+
+def _restarted(tracker: Tracker, packet_no: int, now: float) -> bool:
+    """True if the device has most likely restarted its Packet_no counter."""
+    behind = tracker.highest - packet_no
+    return (now - tracker.last_seen >= RESTART_IDLE
+            or (packet_no < RESTART_BELOW and behind > REORDER_WINDOW)
+            or behind >= SEQ_WINDOW)
+
+
+def is_duplicate(helmet_id: str, packet_no: int, now: float | None = None) -> bool:
+    """True if this packet was already accepted (checked before any other work)."""
+    tracker = trackers.get(helmet_id)
+    if tracker is None:
+        return False
+    if _restarted(tracker, packet_no, time.monotonic() if now is None else now):
+        return False
+    offset = tracker.highest - packet_no
+    if offset < 0 or offset >= SEQ_WINDOW:
+        return False
+    return bool(tracker.seen >> offset & 1)
+
+
+def precheck(helmet_id: str, packet_no: int, key, compute, now: float | None = None) -> tuple:
+    """
+    (compute(), True) the first time a packet is checked, (the same result, False) when it
+    comes back before being accepted. `key` (e.g. the reading's values) tells a retry from
+    a packet of a restarted counter that reuses the number.
+    """
+    checks = prechecked.setdefault(helmet_id, {})
+    entry = checks.get(packet_no)
+    if entry is not None and entry[0] == key:
+        return entry[1], False
+    result = compute()
+    checks[packet_no] = (key, result, time.monotonic() if now is None else now)
+    if len(checks) > MAX_PRECHECKED:
+        del checks[next(iter(checks))]
+    return result, True
+
+
+def accept(helmet_id: str, packet_no: int, item, now: float | None = None) -> list:
+    """
+    Marks the packet as seen and returns the items that are now ready, in Packet_no
+    order: usually [item], [] while it is held (or a duplicate / late packet), or
+    several when it fills a gap.
+    """
+    now = time.monotonic() if now is None else now
+    checks = prechecked.get(helmet_id)
+    if checks is not None:
+        checks.pop(packet_no, None)
+        if not checks:
+            del prechecked[helmet_id]
+    tracker = trackers.get(helmet_id)
+    if tracker is None or _restarted(tracker, packet_no, now):
+        ready = []
+        if tracker is not None:
+            RESETS.inc()
+            # Whatever the old counter still held goes first
+            ready = _release(tracker, True)
+        trackers[helmet_id] = Tracker(packet_no, now)
+        ready.append(item)
+        return ready
+
+    tracker.last_seen = now
+
+    offset = tracker.highest - packet_no
+    if offset < 0:
+        tracker.seen = (tracker.seen << -offset | 1) & WINDOW_MASK
+        tracker.highest = packet_no
+    elif tracker.seen >> offset & 1:
+        DUPLICATES.inc()
+        return []
+    else:
+        tracker.seen |= 1 << offset
+
+    if packet_no < tracker.expected:
+        LATE.inc()
+        return []
+
+    if packet_no == tracker.expected:
+        tracker.expected += 1
+        ready = [item]
+    else:
+        if not tracker.held:
+            tracker.held_since = now
+        tracker.held[packet_no] = (now, item)
+        ready = []
+
+    if tracker.held:
+        force = len(tracker.held) > REORDER_WINDOW or now - tracker.held_since >= REORDER_DELAY
+        ready.extend(_release(tracker, force))
+    return ready
+
+
+def _release(tracker: Tracker, force: bool) -> list:
+    ready = []
+    while tracker.held:
+        entry = tracker.held.pop(tracker.expected, None)
+        if entry is None:
+            if not force:
+                break
+            # Give up on the missing packets: skip to the oldest held one
+            next_packet = min(tracker.held)
+            LOST.inc(next_packet - tracker.expected)
+            tracker.expected = next_packet
+            continue
+        REORDERED.inc()
+        ready.append(entry[1])
+        tracker.expected += 1
+    if ready and tracker.held:
+        tracker.held_since = min(arrived for arrived, _ in tracker.held.values())
+    return ready
+
+
+def expire(now: float | None = None) -> list:
+    """
+    Releases packets held longer than REORDER_DELAY (for helmets that went quiet) and
+    drops the trackers of helmets silent for TRACKER_TTL, and prechecks that old.
+    """
+    now = time.monotonic() if now is None else now
+    ready = []
+    for helmet_id, tracker in list(trackers.items()):
+        if tracker.held and now - tracker.held_since >= REORDER_DELAY:
+            ready.extend(_release(tracker, True))
+        if not tracker.held and now - tracker.last_seen >= TRACKER_TTL:
+            del trackers[helmet_id]
+    for helmet_id, checks in list(prechecked.items()):
+        for packet_no in [packet_no for packet_no, entry in checks.items() if now - entry[2] >= TRACKER_TTL]:
+            del checks[packet_no]
+        if not checks:
+            del prechecked[helmet_id]
+    return ready
+
+
+def reset(helmet_id: str | None = None):
+    if helmet_id is None:
+        trackers.clear()
+        prechecked.clear()
+    else:
+        trackers.pop(helmet_id, None)
+        prechecked.pop(helmet_id, None)
@@ -0,0 +1,130 @@
+# app/core/sessions.py
+#
+# WorkSession lifecycle: the worker opens a session when a helmet without one sends a
+# reading, and closes it once the helmet has been silent for SESSION_IDLE_GAP_SECONDS.
+#
+# Batches move their sessions' last_reading_at forward in one UPDATE, at most every
+# TOUCH_INTERVAL of stream time per session. The UPDATE also tells the worker if a
+# cached session was closed meanwhile; a helmet coming back after an idle gap is
+# always due for one. Every SESSION_SWEEP_INTERVAL seconds the worker closes all idle
+# sessions with one UPDATE, which sets end_time to the session's last inserted_at and
+# stores its summary (reading count, average HR, peak temperature, fatigue events), so
+# history views no longer aggregate readings for closed shifts. When the backfill
+# rewrites fatigue states of closed sessions it refreshes their summaries the same way.
+#
+# uq_work_sessions_active_helmet (unique on helmet_id where is_active, including id)
+# guarantees one active session per helmet and makes the active-session lookup
+# index-only.
+
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.db.models import Reading, WorkSession
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("sessions")
+
+IDLE_GAP_SECONDS = float(os.getenv("SESSION_IDLE_GAP_SECONDS", "1800"))
+SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# The worker writes last_reading_at at most this often per session (stream time)
+TOUCH_INTERVAL = IDLE_GAP_SECONDS / 10
+
+SESSIONS_OPENED = metrics.Counter("sessions_opened", "Work sessions opened by the worker")
+SESSIONS_CLOSED = metrics.Counter("sessions_closed", "Work sessions closed after an idle gap")
+
+
+def active_session_id(db: Session, helmet_id):
+    """id of the helmet's active session, or None (index-only on Postgres)."""
+    return db.execute(
+        select(WorkSession.id).where(WorkSession.helmet_id == helmet_id, WorkSession.is_active == True)  # noqa: E712
+    ).scalar()
+
+
+def open_session(db: Session, helmet_id, company_id):
+    """Creates the helmet's active session, or returns the one another worker just created."""
+    session = WorkSession(helmet_id=helmet_id, company_id=company_id, is_active=True)
+    db.add(session)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Lost the race on uq_work_sessions_active_helmet
+        db.rollback()
+        return active_session_id(db, helmet_id)
+    SESSIONS_OPENED.inc()
+    return session.id
+
+
+def touch(db: Session, last_reading: dict) -> set:
+    """
+    Moves last_reading_at of the given sessions ({session_id: latest inserted_at}) in one
+    UPDATE. Returns the ids that are still active (the caller commits).
+    """
+    if not last_reading:
+        return set()
+    rows = db.execute(
+        update(WorkSession)
+        .where(WorkSession.id.in_(list(last_reading)), WorkSession.is_active == True)  # noqa: E712
+        .values(last_reading_at=case(last_reading, value=WorkSession.id))
+        .returning(WorkSession.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {row[0] for row in rows}
+
+
+def _summary_values() -> dict:
+    # Company-led like ix_readings_company_session_inserted_at
+    of_session = (Reading.company_id == WorkSession.company_id) & (Reading.session_id == WorkSession.id)
+    return {
+        "reading_count": select(func.count()).where(of_session).scalar_subquery(),
+        "avg_hr": select(func.avg(Reading.hr)).where(of_session).scalar_subquery(),
+        "max_temp": select(func.max(Reading.temperature)).where(of_session).scalar_subquery(),
+        "fatigue_events": select(func.count()).where(of_session, Reading.fatigue_state == "Fatigue").scalar_subquery(),
+    }
+
+
+def close_idle(db: Session, now: datetime | None = None) -> list[tuple]:
+    """
+    Closes every active session without readings for IDLE_GAP_SECONDS, in one UPDATE.
+    `now` is the worker's position in the reading stream. Returns (session_id, helmet_id,
+    company_id) of the closed sessions.
+    """
+    now = now or datetime.utcnow()
+    last_seen = func.coalesce(WorkSession.last_reading_at, WorkSession.start_time)
+    # last_reading_at only moves every TOUCH_INTERVAL: end the session at its actual last reading
+    last_reading = select(func.max(Reading.inserted_at)).where(
+        Reading.company_id == WorkSession.company_id, Reading.session_id == WorkSession.id
+    ).scalar_subquery()
+    closed = db.execute(
+        update(WorkSession)
+        .where(WorkSession.is_active == True, last_seen < now - timedelta(seconds=IDLE_GAP_SECONDS))  # noqa: E712
+        .values(is_active=False, end_time=func.coalesce(last_reading, last_seen), **_summary_values())
+        .returning(WorkSession.id, WorkSession.helmet_id, WorkSession.company_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    if closed:
+        SESSIONS_CLOSED.inc(len(closed))
+        logger.info("🛑 Closed %s idle work sessions", len(closed))
+    return [tuple(row) for row in closed]
+
+
+def refresh_summaries(db: Session, session_ids) -> int:
+    """
+    Recomputes the stored summary of the given closed sessions after their readings
+    changed (the caller commits). Active sessions have none yet and are skipped.
+    """
+    if not session_ids:
+        return 0
+    result = db.execute(
+        update(WorkSession)
+        .where(WorkSession.id.in_(list(session_ids)), WorkSession.is_active == False,  # noqa: E712
+               WorkSession.reading_count.isnot(None))
+        .values(**_summary_values())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
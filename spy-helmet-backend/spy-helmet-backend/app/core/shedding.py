@@ -0,0 +1,212 @@
+# app/core/shedding.py
+#
+# Lag-aware load shedding for the ingest queue.
+#
+# A background task polls the backlog (helmet_data_queue length + anything still held by
+# the publisher/spool) and the consumer lag (age of the last reading the worker wrote,
+# published by app/worker.py). Crossing the soft or hard threshold switches the ingest
+# path to the configured policy:
+#
+#   downsample : enqueue only every Nth non-critical reading per helmet
+#   coalesce   : fold N non-critical readings per helmet into one averaged reading
+#   reject     : answer 429 with Retry-After before doing any work
+#
+# Critical readings always go through: any reading from a helmet with an active gas rule
+# (app/core/gas_rules.py), a Fatigue prediction, or any reading from a helmet whose latest
+# prediction was Fatigue. The sliding window still sees every
+# accepted reading; shedding only thins out what is persisted.
+
+import asyncio
+import math
+import os
+import time
+from types import SimpleNamespace
+
+from app.core import gas_rules
+from app.core.publisher import QUEUE_KEY
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("shedding")
+
+LAST_PROCESSED_KEY = "helmet_data_queue:last_received_at"
+
+NORMAL, SOFT, HARD = 0, 1, 2
+LEVEL_NAMES = {NORMAL: "normal", SOFT: "soft", HARD: "hard"}
+
+SOFT_DEPTH = int(os.getenv("SHED_SOFT_DEPTH", "50000"))
+HARD_DEPTH = int(os.getenv("SHED_HARD_DEPTH", "200000"))
+SOFT_LAG = float(os.getenv("SHED_SOFT_LAG", "30"))
+HARD_LAG = float(os.getenv("SHED_HARD_LAG", "120"))
+SOFT_POLICY = os.getenv("SHED_SOFT_POLICY", "downsample")
+HARD_POLICY = os.getenv("SHED_HARD_POLICY", "reject")
+DOWNSAMPLE_EVERY = int(os.getenv("SHED_DOWNSAMPLE_EVERY", "5"))
+COALESCE_N = int(os.getenv("SHED_COALESCE_N", "5"))
+POLL_INTERVAL = float(os.getenv("SHED_POLL_INTERVAL", "1.0"))
+MAX_RETRY_AFTER = int(os.getenv("SHED_MAX_RETRY_AFTER", "60"))
+
+SHED_LEVEL = metrics.Gauge("shed_level", "Load shedding level (0 normal, 1 soft, 2 hard)")
+SHED_READINGS = metrics.Counter("shed_readings", "Readings not enqueued individually because of load shedding",
+                                ["policy"])
+BACKLOG = metrics.Gauge("ingest_backlog_messages", "Queue + publisher backlog seen by the shedding monitor")
+CONSUMER_LAG = metrics.Gauge("ingest_consumer_lag_seconds", "Consumer lag seen by the shedding monitor")
+
+level = NORMAL
+backlog = 0
+lag = 0.0
+
+last_state: dict[str, str] = {}
+downsample_counts: dict[str, int] = {}
+aggregates: dict[str, dict] = {}
+
+
+def policy() -> str | None:
+    if level == HARD:
+        return HARD_POLICY
+    if level == SOFT:
+        return SOFT_POLICY
+    return None
+
+
+def is_critical(data, fatigue_state: str | None = None) -> bool:
+    # Gas rules run before shedding, so their state already includes this reading
+    return (fatigue_state == "Fatigue" or last_state.get(data.helmet_ID) == "Fatigue"
+            or gas_rules.in_alert(data.helmet_ID))
+
+
+def retry_after() -> int:
+    return max(1, min(MAX_RETRY_AFTER, math.ceil(lag) if lag else 1))
+
+
+def should_reject(data, gas_alerts: list | None = None) -> bool:
+    """Checked before any work is done for a reading (gas_alerts: what it raised or cleared)."""
+    # Raised alerts and helmets still in alert pass; a reading that only clears one does not
+    if policy() != "reject" or gas_rules.any_raised(gas_alerts or ()) or is_critical(data):
+        return False
+    SHED_READINGS.labels("reject").inc()
+    return True
+
+
+def shape(data, fatigue_state: str, result: dict | None) -> list[tuple]:
+    """
+    Decides what to enqueue for an accepted reading.
+    Returns a list of (reading, fatigue_state, result) tuples, possibly empty.
+    """
+    helmet_id = data.helmet_ID
+    critical = is_critical(data, fatigue_state)
+    if result is not None:
+        last_state[helmet_id] = fatigue_state
+
+    current = policy()
+    if critical or current in (None, "reject"):
+        out = [(data, fatigue_state, result)]
+        pending = aggregates.pop(helmet_id, None)
+        if pending is not None:
+            out.insert(0, _aggregate_item(pending))
+        return out
+
+    if current == "downsample":
+        count = downsample_counts.get(helmet_id, 0) + 1
+        downsample_counts[helmet_id] = count
+        if DOWNSAMPLE_EVERY <= 1 or count % DOWNSAMPLE_EVERY == 1:
+            return [(data, fatigue_state, result)]
+        SHED_READINGS.labels("downsample").inc()
+        return []
+
+    if current == "coalesce":
+        agg = aggregates.get(helmet_id)
+        if agg is None:
+            agg = aggregates[helmet_id] = {
+                "count": 0, "BodyTemp": 0.0, "EnvTemp": 0.0, "Humidity": 0.0, "HR": 0.0, "SpO2": 0.0,
+                "CO_ppm": 0.0, "CH4_ppm": 0.0,
+            }
+        agg["count"] += 1
+        for field in ("BodyTemp", "EnvTemp", "Humidity", "HR", "SpO2"):
+            agg[field] += getattr(data, field)
+        agg["CO_ppm"] = max(agg["CO_ppm"], data.CO_ppm)
+        agg["CH4_ppm"] = max(agg["CH4_ppm"], data.CH4_ppm)
+        agg["last"] = (data, fatigue_state, result)
+
+        if agg["count"] >= COALESCE_N:
+            del aggregates[helmet_id]
+            return [_aggregate_item(agg)]
+        SHED_READINGS.labels("coalesce").inc()
+        return []
+
+    return [(data, fatigue_state, result)]
+
+
+def _aggregate_item(agg: dict) -> tuple:
+    """One reading standing for `count` readings: averages, and peak gas values."""
+    data, fatigue_state, result = agg["last"]
+    n = agg["count"]
+    reading = SimpleNamespace(
+        helmet_ID=data.helmet_ID,
+        BodyTemp=agg["BodyTemp"] / n,
+        EnvTemp=agg["EnvTemp"] / n,
+        Humidity=agg["Humidity"] / n,
+        HR=round(agg["HR"] / n),
+        SpO2=round(agg["SpO2"] / n),
+        CO_ppm=agg["CO_ppm"],
+        CH4_ppm=agg["CH4_ppm"],
+        Packet_no=data.Packet_no,
+    )
+    return reading, fatigue_state, result
+
+
+def flush_aggregates() -> list[tuple]:
+    items = [_aggregate_item(agg) for agg in aggregates.values()]
+    aggregates.clear()
+    return items
+
+
+def update(queue_depth: int, last_processed_ms: int | None, now: float | None = None):
+    """Recomputes the shedding level from the latest backlog and consumer position."""
+    global level, backlog, lag
+    now = time.time() if now is None else now
+    backlog = queue_depth
+    # Nothing waiting means the consumer is caught up, whatever it processed last
+    lag = max(0.0, now - last_processed_ms / 1000) if queue_depth and last_processed_ms else 0.0
+
+    if backlog >= HARD_DEPTH or lag >= HARD_LAG:
+        new_level = HARD
+    elif backlog >= SOFT_DEPTH or lag >= SOFT_LAG:
+        new_level = SOFT
+    else:
+        new_level = NORMAL
+
+    if new_level != level:
+        logger.warning("Load shedding level %s -> %s (backlog=%s, lag=%.1fs)",
+                       LEVEL_NAMES[level], LEVEL_NAMES[new_level], backlog, lag)
+        level = new_level
+        if level == NORMAL:
+            downsample_counts.clear()
+
+    SHED_LEVEL.set(level)
+    BACKLOG.set(backlog)
+    CONSUMER_LAG.set(lag)
+
+
+async def monitor(publisher, encode):
+    """
+    Polls Redis for the backlog and consumer position; runs for the app's lifetime.
+    encode(reading, fatigue_state, result) builds the queue message for flushed aggregates.
+    """
+    while True:
+        try:
+            async with publisher.client.pipeline(transaction=False) as pipe:
+                pipe.llen(QUEUE_KEY)
+                pipe.get(LAST_PROCESSED_KEY)
+                depth, last_processed = await pipe.execute()
+            update(depth + publisher.backlog(), int(last_processed) if last_processed else None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Redis unreachable: the publisher's own backlog is all we know
+            logger.warning("Shedding monitor could not read queue state: %s", e)
+            update(publisher.backlog(), None)
+
+        if level == NORMAL and aggregates:
+            for item in flush_aggregates():
+                publisher.publish(encode(*item))
+        await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,121 @@
+# app/core/spool.py
+#
+# Bounded, memory-mapped, append-only spool for queue messages that could not be
+# delivered to Redis. Messages are replayed in the order they were appended.
+#
+# File layout:
+#   header (24 bytes): head offset, tail offset, record count (little endian uint64)
+#   records          : uint32 length + payload, appended at `tail`, consumed from `head`
+#
+# The header is rewritten after every append/consume, so a crash loses at most the
+# records that were not flushed yet. When the end of the file is reached the live
+# region is moved back to the start; if the spool is still full new messages are
+# rejected (the caller counts them as dropped).
+#
+# A spool file belongs to one process at a time: it is held with an exclusive flock
+# until close(), and opening a file another process holds raises SpoolBusy.
+
+import fcntl
+import mmap
+import os
+import struct
+
+HEADER = struct.Struct("<QQQ")
+LENGTH = struct.Struct("<I")
+
+
+class SpoolBusy(Exception):
+    """The spool file is held by another process."""
+
+
+class Spool:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.capacity = max_bytes
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.fd)
+            raise SpoolBusy(path) from None
+        try:
+            if os.fstat(self.fd).st_size != max_bytes:
+                os.ftruncate(self.fd, max_bytes)
+            self.mm = mmap.mmap(self.fd, max_bytes)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+        self.head, self.tail, self.count = HEADER.unpack_from(self.mm, 0)
+        if not (HEADER.size <= self.head <= self.tail <= self.capacity):
+            # New or corrupt file: start empty
+            self.head = self.tail = HEADER.size
+            self.count = 0
+            self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def used_bytes(self) -> int:
+        return self.tail - self.head
+
+    def _write_header(self):
+        HEADER.pack_into(self.mm, 0, self.head, self.tail, self.count)
+
+    def _compact(self):
+        live = self.tail - self.head
+        self.mm.move(HEADER.size, self.head, live)
+        self.head = HEADER.size
+        self.tail = HEADER.size + live
+
+    def append_many(self, messages: list[bytes]) -> int:
+        """Appends messages in order. Returns how many fit (the rest are rejected)."""
+        written = 0
+        for message in messages:
+            size = LENGTH.size + len(message)
+            if self.tail + size > self.capacity:
+                if self.head > HEADER.size:
+                    self._compact()
+                if self.tail + size > self.capacity:
+                    break
+            LENGTH.pack_into(self.mm, self.tail, len(message))
+            self.mm[self.tail + LENGTH.size:self.tail + size] = message
+            self.tail += size
+            self.count += 1
+            written += 1
+
+        if written:
+            self._write_header()
+        return written
+
+    def peek(self, limit: int) -> tuple[list[bytes], int]:
+        """Returns up to `limit` oldest messages and the offset just after them."""
+        messages = []
+        offset = self.head
+        while offset < self.tail and len(messages) < limit:
+            (length,) = LENGTH.unpack_from(self.mm, offset)
+            start = offset + LENGTH.size
+            messages.append(self.mm[start:start + length])
+            offset = start + length
+        return messages, offset
+
+    def consume(self, count: int, offset: int):
+        """Drops the messages returned by peek() once they have been delivered."""
+        self.head = offset
+        self.count -= count
+        if self.head >= self.tail:
+            self.head = self.tail = HEADER.size
+            self.count = 0
+        self._write_header()
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        # Also releases the lock
+        os.close(self.fd)
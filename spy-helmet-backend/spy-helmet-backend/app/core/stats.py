@@ -0,0 +1,293 @@
+# app/core/stats.py
+#
+# Streaming per-helmet statistics for HR, BodyTemp and SpO2, fed from the ingest path.
+#
+# Every metric keeps, in constant memory:
+#   - Welford count / mean / variance (the worker's long-run baseline)
+#   - EWMA mean / variance (recent level)
+#   - a merging t-digest style sketch (at most DIGEST_COMPRESSION centroids, sized with
+#     the arcsine scale function so the tails stay precise) for approximate quantiles
+#
+# A reading is flagged as an anomaly when, after STATS_MIN_SAMPLES readings, it falls
+# outside the worker's own [ANOMALY_LOW, ANOMALY_HIGH] quantile band and is at least
+# MIN_DEVIATION away from their mean (so integer-valued signals like SpO2 with a very
+# narrow band do not flag on every step). The check runs against the baseline before
+# the reading is added.
+#
+# State is snapshotted to a Redis hash (packed, one field per helmet) so it survives
+# API restarts.
+
+import asyncio
+import math
+import os
+import struct
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("stats")
+
+STATS_KEY = "helmet_stats"
+METRICS = ("HR", "BodyTemp", "SpO2")
+# Smallest |value - mean| that can count as an anomaly, per metric
+MIN_DEVIATION = {"HR": 8.0, "BodyTemp": 0.4, "SpO2": 2.0}
+
+EWMA_ALPHA = float(os.getenv("STATS_EWMA_ALPHA", "0.05"))
+MIN_SAMPLES = int(os.getenv("STATS_MIN_SAMPLES", "300"))
+ANOMALY_LOW = float(os.getenv("STATS_ANOMALY_LOW", "0.005"))
+ANOMALY_HIGH = float(os.getenv("STATS_ANOMALY_HIGH", "0.995"))
+DIGEST_COMPRESSION = int(os.getenv("STATS_DIGEST_COMPRESSION", "50"))
+DIGEST_BUFFER = 32
+SNAPSHOT_INTERVAL = float(os.getenv("STATS_SNAPSHOT_INTERVAL", "30"))
+
+ANOMALIES = metrics.Counter("stats_anomalies", "Readings outside the worker's personal baseline", ["metric"])
+TRACKED_HELMETS = metrics.Gauge("stats_tracked_helmets", "Helmets with streaming statistics in memory")
+
+SNAPSHOT_VERSION = 1
+STAT_HEADER = struct.Struct("<QddddH")
+CENTROID = struct.Struct("<dd")
+
+
+class Digest:
+    """Merging quantile sketch: sorted centroids, each spanning at most 1 unit of k(q)."""
+
+    def __init__(self, compression: int = DIGEST_COMPRESSION):
+        self.compression = compression
+        self.means: list[float] = []
+        self.weights: list[float] = []
+        self.buffer: list[float] = []
+        self.total = 0.0
+
+    def add(self, x: float):
+        self.buffer.append(x)
+        if len(self.buffer) >= DIGEST_BUFFER:
+            self.compress()
+
+    def compress(self):
+        if not self.buffer:
+            return
+        items = sorted(list(zip(self.means, self.weights)) + [(x, 1.0) for x in self.buffer])
+        self.buffer = []
+        total = self.total = sum(w for _, w in items)
+
+        means, weights = [items[0][0]], [items[0][1]]
+        # Weight to the left of the centroid being built
+        cumulative = 0.0
+        for mean, weight in items[1:]:
+            proposed = weights[-1] + weight
+            if self._k((cumulative + proposed) / total) - self._k(cumulative / total) <= 1:
+                means[-1] += (mean - means[-1]) * weight / proposed
+                weights[-1] = proposed
+            else:
+                cumulative += weights[-1]
+                means.append(mean)
+                weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(min(1.0, max(-1.0, 2 * q - 1)))
+
+    def quantile(self, q: float) -> float:
+        self.compress()
+        if not self.means:
+            return math.nan
+        target = q * self.total
+        cumulative = 0.0
+        previous_center, previous_mean = None, None
+        for mean, weight in zip(self.means, self.weights):
+            center = cumulative + weight / 2
+            if target <= center:
+                if previous_center is None:
+                    return mean
+                fraction = (target - previous_center) / (center - previous_center)
+                return previous_mean + fraction * (mean - previous_mean)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        return self.means[-1]
+
+
+class RunningStat:
+    __slots__ = ("count", "mean", "m2", "ewma", "ewm_var", "digest", "band")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = 0.0
+        self.ewm_var = 0.0
+        self.digest = Digest()
+        # Cached (low, high) quantiles, refreshed whenever the digest compresses
+        self.band = None
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, x: float) -> float:
+        std = self.std
+        return (x - self.mean) / std if std > 0 else 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        if self.count == 1:
+            self.ewma = x
+        else:
+            diff = x - self.ewma
+            increment = EWMA_ALPHA * diff
+            self.ewma += increment
+            self.ewm_var = (1 - EWMA_ALPHA) * (self.ewm_var + diff * increment)
+
+        self.digest.add(x)
+        if not self.digest.buffer:
+            self._refresh_band()
+
+    def _refresh_band(self):
+        self.band = (self.digest.quantile(ANOMALY_LOW), self.digest.quantile(ANOMALY_HIGH))
+
+    def is_anomaly(self, x: float, min_deviation: float) -> bool:
+        if self.count < MIN_SAMPLES or self.band is None:
+            return False
+        low, high = self.band
+        return (x < low or x > high) and abs(x - self.mean) >= min_deviation
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 3),
+            "std": round(self.std, 3),
+            "ewma": round(self.ewma, 3),
+            "ewm_std": round(math.sqrt(self.ewm_var), 3),
+            "p05": _round(self.digest.quantile(0.05)),
+            "p50": _round(self.digest.quantile(0.5)),
+            "p95": _round(self.digest.quantile(0.95)),
+        }
+
+
+def _round(x: float) -> float | None:
+    return None if math.isnan(x) else round(x, 3)
+
+
+# helmet_ID -> {metric: RunningStat}
+stats: dict[str, dict[str, RunningStat]] = {}
+dirty: set[str] = set()
+
+TRACKED_HELMETS.set_function(lambda: len(stats))
+
+
+def _helmet(helmet_id: str) -> dict[str, RunningStat]:
+    helmet = stats.get(helmet_id)
+    if helmet is None:
+        helmet = stats[helmet_id] = {metric: RunningStat() for metric in METRICS}
+    return helmet
+
+
+def update(data) -> list[dict]:
+    """Adds one reading to the helmet's statistics. Returns the metrics it flagged."""
+    helmet_id = data.helmet_ID
+    helmet = _helmet(helmet_id)
+    anomalies = []
+    for metric in METRICS:
+        stat = helmet[metric]
+        x = float(getattr(data, metric))
+        if stat.is_anomaly(x, MIN_DEVIATION[metric]):
+            ANOMALIES.labels(metric).inc()
+            anomalies.append({
+                "metric": metric,
+                "value": x,
+                "z": round(stat.zscore(x), 2),
+                "baseline": round(stat.mean, 3),
+                "band": [round(v, 3) for v in stat.band],
+            })
+        stat.add(x)
+    dirty.add(helmet_id)
+    return anomalies
+
+
+def normalize(helmet_id: str, metric: str, value: float) -> float:
+    """Value as a z-score against the worker's own baseline (0.0 until one exists)."""
+    helmet = stats.get(helmet_id)
+    return helmet[metric].zscore(value) if helmet else 0.0
+
+
+def summary(helmet_id: str) -> dict | None:
+    helmet = stats.get(helmet_id)
+    if helmet is None:
+        return None
+    return {metric: stat.summary() for metric, stat in helmet.items()}
+
+
+# --------------------------------------------------
+# Redis snapshots
+# --------------------------------------------------
+
+def dump_helmet(helmet: dict[str, RunningStat]) -> bytes:
+    parts = [bytes([SNAPSHOT_VERSION])]
+    for metric in METRICS:
+        stat = helmet[metric]
+        stat.digest.compress()
+        digest = stat.digest
+        parts.append(STAT_HEADER.pack(stat.count, stat.mean, stat.m2, stat.ewma, stat.ewm_var, len(digest.means)))
+        parts.extend(CENTROID.pack(m, w) for m, w in zip(digest.means, digest.weights))
+    return b"".join(parts)
+
+
+def load_helmet(raw: bytes) -> dict[str, RunningStat]:
+    if not raw or raw[0] != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported stats snapshot")
+    helmet = {}
+    offset = 1
+    for metric in METRICS:
+        stat = RunningStat()
+        stat.count, stat.mean, stat.m2, stat.ewma, stat.ewm_var, n = STAT_HEADER.unpack_from(raw, offset)
+        offset += STAT_HEADER.size
+        for _ in range(n):
+            mean, weight = CENTROID.unpack_from(raw, offset)
+            offset += CENTROID.size
+            stat.digest.means.append(mean)
+            stat.digest.weights.append(weight)
+        stat.digest.total = sum(stat.digest.weights)
+        if n:
+            stat._refresh_band()
+        helmet[metric] = stat
+    return helmet
+
+
+async def snapshot(client):
+    """Writes every helmet updated since the last snapshot to the Redis hash."""
+    if not dirty:
+        return
+    helmet_ids = list(dirty)
+    dirty.clear()
+    mapping = {helmet_id: dump_helmet(stats[helmet_id]) for helmet_id in helmet_ids if helmet_id in stats}
+    try:
+        await client.hset(STATS_KEY, mapping=mapping)
+    except Exception as e:
+        dirty.update(helmet_ids)
+        logger.warning("Could not snapshot stats for %s helmets: %s", len(helmet_ids), e)
+
+
+async def restore(client):
+    try:
+        snapshots = await client.hgetall(STATS_KEY)
+    except Exception as e:
+        logger.warning("Could not restore stats from Redis: %s", e)
+        return
+    for helmet_id, raw in snapshots.items():
+        helmet_id = helmet_id.decode() if isinstance(helmet_id, bytes) else helmet_id
+        try:
+            stats[helmet_id] = load_helmet(raw)
+        except (ValueError, struct.error) as e:
+            logger.warning("Skipping stats snapshot for %s: %s", helmet_id, e)
+    if snapshots:
+        logger.info("Restored streaming stats for %s helmets", len(stats))
+
+
+async def snapshotter(client):
+    """Periodic snapshots for the app's lifetime."""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        await snapshot(client)
@@ -1,8 +1,19 @@
 # app/db/database.py
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from fastapi import Request
+from fastapi.routing import APIRoute
+import itertools
 import os
+import time
+
+from app.utils import metrics
+from app.utils.log import get_logger
+
+logger = get_logger("database")
 
 # Get DB URL from env or default to generic one (though env is better)
 # Docker-compose sets DATABASE_URL=postgresql://postgres:helmet_2026@db:5432/helmetDB
@@ -24,3 +35,142 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# --------------------------------------------------
+# Read replicas
+# --------------------------------------------------
+# Read-only endpoints take their session from get_read_db(), which picks a replica
+# from READ_DATABASE_URLS (comma separated, round robin) whose replication lag is
+# within the request's staleness tolerance: X-Max-Staleness (seconds) or
+# READ_MAX_STALENESS. Replicas that are too far behind, or unreachable (skipped for
+# REPLICA_RETRY_AFTER seconds), fall back to the primary, as does everything when no
+# replica is configured. A replica that fails in the middle of a request is marked down
+# and the request is run again on the primary (ReadReplicaRoute), so the client never
+# sees the error. Writes (SessionLocal, get_db, the worker) always go to the primary.
+#
+# Lag is measured on the replica (time since the last replayed transaction, 0 when it
+# has replayed everything it received), at most every REPLICA_CHECK_INTERVAL seconds.
+# "Everything it received" only means caught up while WAL is streaming in: a replica
+# without a running WAL receiver (disconnected from the primary) is treated as down.
+# A server that is not in recovery reports 0, so any second Postgres instance can
+# stand in for a replica locally.
+
+READ_DATABASE_URLS = [url.strip() for url in os.getenv("READ_DATABASE_URLS", "").split(",") if url.strip()]
+READ_MAX_STALENESS = float(os.getenv("READ_MAX_STALENESS", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", "30"))
+
+# NULL: in recovery but no WAL receiver (pg_stat_wal_receiver has a row only while one runs)
+REPLICA_LAG_SQL = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+READ_ROUTES = metrics.Counter("db_read_routes", "Read-only sessions by target", ["target"])
+REPLICA_LAG = metrics.Gauge("db_replica_lag_seconds", "Last measured replication lag per replica", ["replica"])
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.lag = 0.0
+        self.checked_at = float("-inf")
+        self.down_until = 0.0
+
+    def current_lag(self) -> float | None:
+        """Replication lag in seconds, or None while the replica is unreachable."""
+        now = time.monotonic()
+        if now < self.down_until:
+            return None
+        if now - self.checked_at >= REPLICA_CHECK_INTERVAL:
+            try:
+                with self.engine.connect() as conn:
+                    lag = conn.execute(REPLICA_LAG_SQL).scalar() if self.engine.dialect.name == "postgresql" else 0
+            except Exception as e:
+                self.mark_down(e)
+                return None
+            if lag is None:
+                self.mark_down("no WAL receiver, replication is not running")
+                return None
+            self.lag = float(lag)
+            self.checked_at = now
+            REPLICA_LAG.labels(self.name).set(self.lag)
+        return self.lag
+
+    def mark_down(self, error):
+        self.down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        logger.warning("Read replica %s unavailable, using the primary for %ss: %s",
+                       self.name, REPLICA_RETRY_AFTER, error)
+
+replicas = [Replica(url) for url in READ_DATABASE_URLS]
+_next_replica = itertools.count()
+
+def open_read_session(max_staleness: float = READ_MAX_STALENESS):
+    """Session on a replica at most `max_staleness` seconds behind, else on the primary."""
+    if replicas:
+        start = next(_next_replica)
+        for i in range(len(replicas)):
+            replica = replicas[(start + i) % len(replicas)]
+            lag = replica.current_lag()
+            if lag is not None and lag <= max_staleness:
+                READ_ROUTES.labels("replica").inc()
+                db = replica.sessionmaker()
+                db.info["replica"] = replica
+                return db
+        READ_ROUTES.labels("primary_fallback").inc()
+    else:
+        READ_ROUTES.labels("primary").inc()
+    return SessionLocal()
+
+def _max_staleness(request: Request) -> float:
+    value = request.headers.get("x-max-staleness")
+    if value is None:
+        return READ_MAX_STALENESS
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return READ_MAX_STALENESS
+
+# Request scope keys: the replica a request's read session is on / rerun on the primary
+REPLICA_SCOPE_KEY = "read_db_replica"
+PRIMARY_RETRY_KEY = "read_db_primary_retry"
+
+# Dependency for read-only routes (see above)
+def get_read_db(request: Request):
+    if request.scope.get(PRIMARY_RETRY_KEY):
+        db = SessionLocal()
+    else:
+        db = open_read_session(_max_staleness(request))
+        request.scope[REPLICA_SCOPE_KEY] = db.info.get("replica")
+    try:
+        yield db
+    finally:
+        db.close()
+
+class ReadReplicaRoute(APIRoute):
+    """
+    Runs a request again on the primary when it failed with an OperationalError (lost
+    connection, recovery conflict) on a replica session; the replica is marked down.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            try:
+                return await handler(request)
+            except OperationalError as e:
+                replica = request.scope.pop(REPLICA_SCOPE_KEY, None)
+                if replica is None:
+                    raise
+                replica.mark_down(e)
+                READ_ROUTES.labels("primary_retry").inc()
+                request.scope[PRIMARY_RETRY_KEY] = True
+                return await handler(request)
+
+        return route_handler
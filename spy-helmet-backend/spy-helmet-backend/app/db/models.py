@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, BigInteger, text
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, BigInteger, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -31,16 +31,39 @@ class WorkSession(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     helmet_id = Column(UUID(as_uuid=True), ForeignKey("helmets.id"), nullable=False)
+    # The helmet's company, copied here so per-tenant queries never join through helmets
+    company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id"), nullable=False)
     start_time = Column(DateTime(timezone=False), server_default=func.now())
     end_time = Column(DateTime(timezone=False), nullable=True)
     is_active = Column(Boolean, default=True)
+    # Set once the session's readings have moved to the Parquet archive (app/core/archive.py)
+    archived_at = Column(DateTime(timezone=False), nullable=True)
+    # Idle sessions are closed from this (app/core/sessions.py)
+    last_reading_at = Column(DateTime(timezone=False), nullable=True)
+    # Summary stored when the session is closed
+    reading_count = Column(Integer, nullable=True)
+    avg_hr = Column(Float, nullable=True)
+    max_temp = Column(Float, nullable=True)
+    fatigue_events = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # One active session per helmet; the worker's lookup reads only this index
+        Index("uq_work_sessions_active_helmet", "helmet_id", unique=True,
+              postgresql_where=text("is_active"), postgresql_include=["id"], sqlite_where=text("is_active")),
+        # A tenant's sessions, newest first, overall and per helmet
+        Index("ix_work_sessions_company_start", "company_id", "start_time"),
+        Index("ix_work_sessions_company_helmet_start", "company_id", "helmet_id", "start_time"),
+    )
 
 class Reading(Base):
     __tablename__ = "readings"
 
-    id = Column(BigInteger, primary_key=True, index=True)
+    # BIGINT on Postgres; plain INTEGER on SQLite so local stand-ins still autoincrement
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True)
     session_id = Column(UUID(as_uuid=True), ForeignKey("work_sessions.id"), nullable=False, index=True)
     helmet_id = Column(UUID(as_uuid=True), ForeignKey("helmets.id"), nullable=False)
+    # Denormalized from the helmet (see WorkSession.company_id)
+    company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id"), nullable=False)
     temperature = Column(Float, nullable=True)
     env_temp = Column(Float, nullable=True)
     humidity = Column(Float, nullable=True)
@@ -49,4 +72,41 @@ class Reading(Base):
     co_ppm = Column(Float, nullable=True)
     ch4_ppm = Column(Float, nullable=True)
     fatigue_state = Column(String, nullable=True)
+    # Model output for this reading (NULL while the window is still collecting)
+    confidence = Column(Float, nullable=True)
+    score_normal = Column(Float, nullable=True)
+    score_stressed = Column(Float, nullable=True)
+    score_fatigue = Column(Float, nullable=True)
     inserted_at = Column(DateTime(timezone=False), server_default=func.now())
+
+    __table_args__ = (
+        # Latest readings per helmet (window rebuild on startup)
+        Index("ix_readings_helmet_inserted_at", "helmet_id", "inserted_at"),
+        # A tenant's readings of a session, in order
+        Index("ix_readings_company_session_inserted_at", "company_id", "session_id", "inserted_at"),
+    )
+
+class ReadingRollup(Base):
+    """Per-helmet min/max/sum/count of readings in fixed time buckets (see app/core/rollups.py)."""
+    __tablename__ = "reading_rollups"
+
+    helmet_id = Column(UUID(as_uuid=True), ForeignKey("helmets.id"), primary_key=True)
+    resolution = Column(Integer, primary_key=True)  # bucket width in seconds
+    bucket_start = Column(DateTime(timezone=False), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    fatigue_count = Column(Integer, nullable=False, default=0)
+    hr_min = Column(Float, nullable=True)
+    hr_max = Column(Float, nullable=True)
+    hr_sum = Column(Float, nullable=True)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+    temperature_sum = Column(Float, nullable=True)
+    spo2_min = Column(Float, nullable=True)
+    spo2_max = Column(Float, nullable=True)
+    spo2_sum = Column(Float, nullable=True)
+    co_ppm_min = Column(Float, nullable=True)
+    co_ppm_max = Column(Float, nullable=True)
+    co_ppm_sum = Column(Float, nullable=True)
+    ch4_ppm_min = Column(Float, nullable=True)
+    ch4_ppm_max = Column(Float, nullable=True)
+    ch4_ppm_sum = Column(Float, nullable=True)
@@ -0,0 +1,55 @@
+import time
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.auth.auth import get_current_company
+from app.core import fleet
+
+# Supervisor views of the caller's company, answered from the in-memory fleet state
+# index (app/core/fleet.py). Async on purpose: the index is updated on the event loop.
+router = APIRouter(prefix="/fleet", tags=["Fleet"])
+
+
+def _silent_before(silent_after: float | None) -> int | None:
+    if silent_after is None:
+        return None
+    return int(time.time() * 1000 - max(0.0, silent_after) * 1000)
+
+
+@router.get("/overview")
+async def fleet_overview(silent_after: float = 60.0, company_id: uuid.UUID = Depends(get_current_company)):
+    """Helmets per state, and how many have not been heard from for `silent_after` seconds."""
+    company = str(company_id)
+    index = fleet.index
+    return {
+        "as_of": int(time.time() * 1000),
+        "helmets": len(index.companies.get(company, ())),
+        "states": index.counts(company),
+        "silent": len(index.silent_since(company, _silent_before(silent_after))),
+        "silent_after": silent_after,
+    }
+
+
+@router.get("/helmets")
+async def fleet_helmets(state: str | None = None, silent_after: float | None = None, limit: int = 1000,
+                        company_id: uuid.UUID = Depends(get_current_company)):
+    """The company's helmets in `state` and / or silent for `silent_after` seconds (at most `limit`)."""
+    if state is None and silent_after is None:
+        raise HTTPException(status_code=400, detail="Give a state, silent_after, or both")
+    if state is not None and state not in fleet.STATES:
+        raise HTTPException(status_code=400, detail=f"state must be one of {', '.join(fleet.STATES)}")
+    company = str(company_id)
+    index = fleet.index
+    before = _silent_before(silent_after)
+
+    if state is None:
+        helmets = index.silent_since(company, before)
+    elif before is None:
+        helmets = list(index.in_state(company, state))
+    else:
+        helmets = [helmet_id for helmet_id in index.in_state(company, state)
+                   if index.last_seen.get(helmet_id, 0) < before]
+
+    limit = max(0, limit)
+    return {"count": len(helmets), "helmets": [index.describe(helmet_id) for helmet_id in helmets[:limit]]}
@@ -1,5 +1,8 @@
 import os
 import json
+import asyncio
+import time
+import uuid
 import redis
 
 # Fix CUDA errors on CPU-only machines
@@ -8,19 +11,32 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
 from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List
+from fastapi.responses import Response
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Literal
+from datetime import datetime, timedelta
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.db.database import get_db
+from app.db.database import ReadReplicaRoute, get_read_db
 from app.db.models import Helmet, WorkSession, Reading
 
 from app.core.buffer import add_reading
 from app.core.buffer import return_progress
+from app.core import admission, archive, buffer, codec, fleet, gas_rules, recent, registry, response_cache, rollups
+from app.core import sequencing, shedding, stats
+from app.core.publisher import Publisher
 
-from app.utils.logger import log_data
+from app.utils import fastjson, metrics, tracing
+from app.utils.fastjson import FastJSONResponse
+from app.utils.log import get_logger
+
+from app.auth.auth import get_current_company
 from app.auth.routes import router as auth_router
+from app.admin.routes import router as admin_router
+from app.fleet.routes import router as fleet_router
 
 # Import Predictor (TensorFlow) LAST to avoid Segfaults
 from app.core.predictor import predict_fatigue
@@ -28,12 +44,23 @@ from app.core.predictor import predict_fatigue
 # Connect to Redis Message Broker
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 redis_client = redis.from_url(REDIS_URL)
+# Async, pipelined enqueue into helmet_data_queue with a local spool when Redis is down
+publisher = Publisher(REDIS_URL)
+
+logger = get_logger("api")
+
+# Queue payload format: "binary" (compact frames, see app/core/codec.py) or "json" (legacy)
+QUEUE_FORMAT = os.getenv("QUEUE_FORMAT", "binary")
 
 app = FastAPI(
     title="SPY Helmet Fatigue API",
     version="1.0",
-    description="Real-time fatigue prediction for miners using 2-sensor input ⚡"
+    description="Real-time fatigue prediction for miners using 2-sensor input ⚡",
+    # orjson instead of the default encoder (app/utils/fastjson.py)
+    default_response_class=FastJSONResponse,
 )
+# Read-only routes whose replica fails mid-request are rerun on the primary (app/db/database.py)
+app.router.route_class = ReadReplicaRoute
 
 # CORS setup
 app.add_middleware(
@@ -44,6 +71,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histogram
+app.add_middleware(metrics.RequestLatencyMiddleware)
+# Stage spans / Server-Timing for sampled requests (off unless TRACE_SPANS=1 or enabled via /admin/tracing)
+app.add_middleware(tracing.TracingMiddleware)
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_publisher():
+    await publisher.start()
+    # Per-helmet baselines and sliding windows from the last snapshots, so predictions
+    # resume right away (app/core/stats.py, app/core/buffer.py)
+    await stats.restore(publisher.client)
+    await buffer.warm_start(publisher.client)
+    background_tasks.extend([
+        # Windows without a snapshot, from stored readings (startup does not wait for it)
+        asyncio.create_task(buffer.rebuild_missing()),
+        # Backlog / consumer lag polling for load shedding (app/core/shedding.py)
+        asyncio.create_task(shedding.monitor(publisher, encode_queue_payload)),
+        asyncio.create_task(stats.snapshotter(publisher.client)),
+        asyncio.create_task(buffer.snapshotter(publisher.client)),
+        asyncio.create_task(release_held_packets()),
+        # Hot swap of model versions (app/core/registry.py)
+        asyncio.create_task(registry.refresher()),
+        # Local historical response cache follows the worker's invalidations (app/core/response_cache.py)
+        asyncio.create_task(response_cache.listener(publisher.client)),
+        # Ingest rate limits shared across API processes (app/core/admission.py)
+        asyncio.create_task(admission.sync(publisher.client)),
+        asyncio.create_task(admission.company_refresher()),
+        # Last minutes of every helmet for live charts (app/core/recent.py)
+        asyncio.create_task(recent.flusher(publisher.client)),
+        # Who is in which state right now, shared across API processes (app/core/fleet.py)
+        asyncio.create_task(fleet.syncer(publisher.client)),
+    ])
+
+@app.on_event("shutdown")
+async def stop_publisher():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await stats.snapshot(publisher.client)
+    await buffer.snapshot(publisher.client)
+    await publisher.stop()
+
+def _queue_depth():
+    return redis_client.llen("helmet_data_queue")
+
+metrics.QUEUE_DEPTH.set_function(_queue_depth)
+# list() snapshots the dict atomically: /metrics runs in the threadpool while requests mutate it
+metrics.BUFFER_OCCUPANCY.set_function(lambda: {(h,): len(b) for h, b in list(buffer.buffers.items())})
+
 latest_prediction = None
 
 # ✅ Input schema: Used by /predict
@@ -65,6 +143,43 @@ class SensorInput(BaseModel):
     SpO2: int
     Packet_no: int
 
+    class Config:
+        # inf / nan cannot be stored or packed into a binary frame: reject them with a 422
+        allow_inf_nan = False
+
+SENSOR_FIELDS = tuple(SensorInput.__annotations__)
+
+# Builds a SensorInput from already-typed binary frame fields without re-validating
+_construct_sensor_input = getattr(SensorInput, "model_construct", None) or SensorInput.construct
+# Parses and validates a JSON body in one pass with the model's compiled validator
+_validate_sensor_json = getattr(SensorInput, "model_validate_json", None) or SensorInput.parse_raw
+_sensor_input_schema = SensorInput.model_json_schema() if hasattr(SensorInput, "model_json_schema") \
+    else SensorInput.schema()
+
+READING_FIELDS = tuple(column.name for column in Reading.__table__.columns)
+SESSION_FIELDS = tuple(column.name for column in WorkSession.__table__.columns)
+
+
+def encode_queue_payload(data: SensorInput, fatigue_state: str, result: dict | None = None) -> bytes:
+    """Queue message for the worker, the only writer of readings (carries the model output too)."""
+    if QUEUE_FORMAT != "json":
+        try:
+            return codec.encode_reading(data, fatigue_state, result=result)
+        except ValueError:
+            pass  # Out-of-range values: fall back to JSON so nothing is lost
+
+    # getattr: coalesced readings from load shedding are plain namespaces, not SensorInput
+    payload = {field: getattr(data, field) for field in SENSOR_FIELDS}
+    payload["fatigue_state"] = fatigue_state
+    payload["received_at"] = int(time.time() * 1000)
+    payload["confidence"] = result["confidence"] if result else None
+    payload["raw_scores"] = [float(x) for x in result["raw_scores"]] if result else None
+    return json.dumps(payload).encode("utf-8")
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/")
 def root():
@@ -92,9 +207,6 @@ async def predict(input_data: ReadingInput):
         # Predict
         result = predict_fatigue(sequence)
 
-        # Log it
-        log_data(reading, result["prediction"], None)
-
         # Store for frontend
         latest_prediction = {
             "prediction": result["prediction"],
@@ -111,78 +223,202 @@ async def predict(input_data: ReadingInput):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Encoded body of latest_prediction, reused until the next prediction replaces it
+_live_body = (None, b"")
+
 @app.get("/live_predict")
 async def live_prediction():
-    global latest_prediction
+    global latest_prediction, _live_body
     if latest_prediction is None:
-        return {
+        return FastJSONResponse({
             "status": "collecting",
             "message": "Waiting for 100 readings...",
             "reading_progress":return_progress()
-        }
-    return latest_prediction
+        })
+    current = latest_prediction
+    if _live_body[0] is not current:
+        _live_body = (current, fastjson.dumps(current))
+    return Response(_live_body[1], media_type="application/json")
+
+# ✅ Streaming baseline of one helmet (Welford / EWMA / quantiles per metric); only the
+# caller's company's helmets, other helmets look like ones not heard from
+@app.get("/live_stats/{helmet_id}")
+async def live_stats(helmet_id: str, company_id: uuid.UUID = Depends(get_current_company)):
+    summary = stats.summary(helmet_id) if admission.companies.get(helmet_id) == str(company_id) else None
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No readings from this helmet yet")
+    return {"helmet_id": helmet_id, "metrics": summary}
+
+# ✅ Last `minutes` of readings for one or many helmets (comma separated) from the Redis
+# recent-history tier, in one round-trip; only the caller's company's helmets are returned
+@app.get("/live_history")
+def live_history(helmets: str, minutes: float = recent.RECENT_MINUTES, format: Literal["rows", "columns"] = "rows",
+                 company_id: uuid.UUID = Depends(get_current_company)):
+    codes = list(dict.fromkeys(code.strip() for code in helmets.split(",") if code.strip()))
+    if not codes or len(codes) > recent.MAX_HELMETS:
+        raise HTTPException(status_code=400, detail=f"Give between 1 and {recent.MAX_HELMETS} helmets")
+    minutes = max(0.0, min(minutes, recent.RECENT_MINUTES))
+    # helmet_ID -> company is kept in memory by admission control: no DB query here
+    company = str(company_id)
+    codes = [code for code in codes if admission.companies.get(code) == company]
+
+    series = recent.read(redis_client, codes, minutes) if codes else {}
+    if format == "rows":
+        series = {code: fastjson.rows(recent.FIELDS, zip(*columns.values())) for code, columns in series.items()}
+    else:
+        series = {code: {"count": len(columns["received_at"]), "columns": columns} for code, columns in series.items()}
+    return FastJSONResponse({"minutes": minutes, "helmets": series})
 
 # ✅ New: Sensor data directly from ESP32
-@app.post("/submit_reading")
-async def submit_sensor_data(data: SensorInput, request: Request):
-    global latest_prediction
+# The body is validated straight from the raw JSON (no dict round trip); the schema is
+# declared explicitly so /docs stays the same
+@app.post("/submit_reading", openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": _sensor_input_schema}}}})
+async def submit_sensor_data(request: Request):
+    try:
+        data = _validate_sensor_json(await request.body())
+    except ValidationError as e:
+        # Same 422 body as FastAPI's own validation
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+    return FastJSONResponse(handle_sensor_reading(data))
+
+# ✅ Same as /submit_reading, but the body is a compact binary frame (app/core/codec.py)
+@app.post("/submit_reading/bin")
+async def submit_sensor_data_binary(request: Request):
     try:
-        # Convert to fatigue model input: [HR, TEMP]
-        # Mapping new keys to model expected input
-        reading = [data.HR, data.BodyTemp]
+        fields = codec.decode_reading(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(handle_sensor_reading(_construct_sensor_input(**{k: fields[k] for k in SENSOR_FIELDS})))
+
+def enqueue(data: SensorInput, fatigue_state: str, result: dict | None = None):
+    # Every accepted reading goes to the live tier as it is, whatever shedding does below
+    recent.append(data, fatigue_state, result)
+    fleet.update(data.helmet_ID, fatigue_state)
+    # Normally exactly one message; fewer (or a coalesced one) while load shedding is active
+    for reading, state, reading_result in shedding.shape(data, fatigue_state, result):
+        publisher.publish(encode_queue_payload(reading, state, reading_result))
+
+def handle_sensor_reading(data: SensorInput):
+    # Everything before this point (body read + validation / frame decode) is one span
+    tracing.mark("parse")
+
+    # ESP32 retries over flaky Wi-Fi: drop packets that were already accepted
+    if sequencing.is_duplicate(data.helmet_ID, data.Packet_no):
+        sequencing.DUPLICATES.inc()
+        return {"status": "duplicate", "message": f"Packet {data.Packet_no} already received"}
+
+    # Gas hazard rules run on every reading, before buffering and independent of the model.
+    # Once per packet: a reading refused below (429) and retried is not counted twice.
+    with tracing.span("gas"):
+        gas_alerts, fresh = sequencing.precheck(data.helmet_ID, data.Packet_no, (data.CO_ppm, data.CH4_ppm),
+                                                lambda: gas_rules.evaluate(data))
+        if fresh:
+            for alert in gas_alerts:
+                publisher.notify(gas_rules.GAS_ALERT_CHANNEL, gas_rules.encode_alert(alert))
+                logger.warning("Gas %s %s %s on %s: %s (limit %s)", alert["gas"], alert["rule"], alert["state"],
+                               alert["helmet_ID"], alert["value"], alert["limit"])
+
+    # Per-helmet / per-company token buckets; readings raising an alert, or from a helmet
+    # still in alert, always pass (clearing one is not a priority)
+    wait = admission.admit(data.helmet_ID, gas_rules.any_raised(gas_alerts) or shedding.is_critical(data))
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many readings from this helmet or company, retry later",
+            headers={"Retry-After": str(admission.retry_after(wait))},
+        )
 
-        # Add to buffer
-        sequence = add_reading(reading)
+    # Shed non-critical readings while the worker is far behind (before doing any work)
+    if shedding.should_reject(data, gas_alerts):
+        raise HTTPException(
+            status_code=429,
+            detail="Ingest queue is backed up, retry later",
+            headers={"Retry-After": str(shedding.retry_after())},
+        )
 
-        # ALWAYS push to Redis for immediate historical tracking before buffering!
-        payload = data.dict()
-        
-        if sequence is None:
-            payload["fatigue_state"] = "Collecting" # No prediction yet
-            try:
-                redis_client.lpush("helmet_data_queue", json.dumps(payload))
-            except Exception as redis_error:
-                print(f"Redis Queue failed: {redis_error}", flush=True)
-                
-            return {
-                "status": "collecting",
-                "message": f"Waiting for 100 readings from ESP32... (Packet {data.Packet_no})"
-            }
+    try:
+        # Put packets back in Packet_no order (held ones are released by a later packet)
+        with tracing.span("sequence"):
+            ready = sequencing.accept(data.helmet_ID, data.Packet_no, data)
+        if not ready:
+            return {"status": "buffered", "message": f"Packet {data.Packet_no} held until earlier packets arrive"}
 
-        # 100 readings reached: Predict fatigue level!
-        result = predict_fatigue(sequence)
+        for reading in ready:
+            response = process_sensor_reading(reading)
+        return response
 
-        # Log reading with helmet ID (Skipped Writing to DB for now per request)
-        log_data(reading, result["prediction"], data.helmet_ID) 
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Push the finalized reading with AI Prediction 🚀
-        payload["fatigue_state"] = result["prediction"]
-        try:
-            redis_client.lpush("helmet_data_queue", json.dumps(payload))
-        except Exception as redis_error:
-            print(f"Redis Queue failed: {redis_error}", flush=True)
+def process_sensor_reading(data: SensorInput):
+    """Window, inference and enqueue for one in-order reading."""
+    global latest_prediction
+    # Convert to fatigue model input: [HR, TEMP]
+    # Mapping new keys to model expected input
+    reading = [data.HR, data.BodyTemp]
 
-        # Save for frontend
-        latest_prediction = {
-            "prediction": result["prediction"],
-            "confidence": f"{result['confidence']:.2f}%",
-            # "raw_scores": result["raw_scores"],
-             "raw_scores": [float(x) for x in result["raw_scores"]],
-            "heart_rate": data.HR,
-            "body_temp": data.BodyTemp,
-            "ch4_ppm": data.CH4_ppm,
-            "co_ppm": data.CO_ppm,
-            "helmet_id": data.helmet_ID,
-            "humidity": data.Humidity,
-            "spo2": data.SpO2,
-            "env_temp": data.EnvTemp,
-             "packet_no": data.Packet_no
+    # Compare against the worker's personal baseline, then fold the reading in
+    with tracing.span("stats"):
+        anomalies = stats.update(data)
+
+    # Add to this helmet's buffer
+    with tracing.span("buffer"):
+        sequence = add_reading(reading, data.helmet_ID)
+
+    # ALWAYS push to Redis for immediate historical tracking before buffering!
+    if sequence is None:
+        # No prediction yet
+        with tracing.span("queue"):
+            enqueue(data, "Collecting")
+
+        response = {
+            "status": "collecting",
+            "message": f"Waiting for 100 readings from ESP32... (Packet {data.Packet_no})"
         }
+        if anomalies:
+            response["anomalies"] = anomalies
+        return response
 
-        return latest_prediction
+    # 100 readings reached: Predict fatigue level!
+    with tracing.span("inference"):
+        result = predict_fatigue(sequence)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Push the finalized reading with AI Prediction 🚀 (the worker writes it to the DB)
+    with tracing.span("queue"):
+        enqueue(data, result["prediction"], result)
+
+    # Save for frontend
+    latest_prediction = {
+        "prediction": result["prediction"],
+        "confidence": f"{result['confidence']:.2f}%",
+        # "raw_scores": result["raw_scores"],
+         "raw_scores": [float(x) for x in result["raw_scores"]],
+        "heart_rate": data.HR,
+        "body_temp": data.BodyTemp,
+        "ch4_ppm": data.CH4_ppm,
+        "co_ppm": data.CO_ppm,
+        "helmet_id": data.helmet_ID,
+        "humidity": data.Humidity,
+        "spo2": data.SpO2,
+        "env_temp": data.EnvTemp,
+         "packet_no": data.Packet_no,
+        "model_version": result.get("model_version"),
+        "anomalies": anomalies
+    }
+
+    return latest_prediction
+
+async def release_held_packets():
+    """Processes packets held for reordering once their gap has timed out."""
+    while True:
+        await asyncio.sleep(sequencing.REORDER_DELAY / 2)
+        for reading in sequencing.expire():
+            try:
+                process_sensor_reading(reading)
+            except Exception as e:
+                logger.error("Could not process released packet %s from %s: %s",
+                             reading.Packet_no, reading.helmet_ID, e)
 
 
 # ✅ WEEKLY REPORT PIPELINE (MOCKED DATA)
@@ -211,27 +447,42 @@ async def get_weekly_report():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# ✅ Historical Data Retrieval Routes
+# ✅ Historical Data Retrieval Routes (read replicas when configured, see app/db/database.py)
+# Every query is scoped to the company in the caller's token, through the company-led
+# indexes on work_sessions / readings, so it only reads that tenant's rows
 @app.get("/historical/all_sessions")
-def get_all_sessions(db: Session = Depends(get_db)):
+def get_all_sessions(company_id: uuid.UUID = Depends(get_current_company), db: Session = Depends(get_read_db)):
     from sqlalchemy import func
     from datetime import datetime
     
     sessions = db.query(WorkSession, Helmet.helmet_code)\
                  .join(Helmet, WorkSession.helmet_id == Helmet.id)\
+                 .filter(WorkSession.company_id == company_id)\
                  .order_by(WorkSession.start_time.desc()).limit(100).all()
                  
     results = []
     for session, helmet_code in sessions:
-        aggs = db.query(
-            func.avg(Reading.hr).label("avg_hr"),
-            func.max(Reading.temperature).label("max_temp")
-        ).filter(Reading.session_id == session.id).first()
-        
-        fatigue_events = db.query(Reading).filter(Reading.session_id == session.id, Reading.fatigue_state == "Fatigue").count()
-        
-        avg_hr = int(aggs.avg_hr) if aggs.avg_hr else 0
-        peak_temp = round(aggs.max_temp, 1) if aggs.max_temp else 0.0
+        if session.reading_count is not None:
+            # Closed session: summary stored when it was closed (app/core/sessions.py)
+            aggs_avg_hr, aggs_max_temp = session.avg_hr, session.max_temp
+            fatigue_events = session.fatigue_events or 0
+        elif session.archived_at:
+            # Readings live in the Parquet archive now
+            summary = archive.session_summary(session, company_id=company_id)
+            aggs_avg_hr, aggs_max_temp = summary["avg_hr"], summary["max_temp"]
+            fatigue_events = summary["fatigue_events"]
+        else:
+            aggs = db.query(
+                func.avg(Reading.hr).label("avg_hr"),
+                func.max(Reading.temperature).label("max_temp")
+            ).filter(Reading.company_id == company_id, Reading.session_id == session.id).first()
+            aggs_avg_hr, aggs_max_temp = aggs.avg_hr, aggs.max_temp
+
+            fatigue_events = db.query(Reading).filter(Reading.company_id == company_id, Reading.session_id == session.id,
+                                                      Reading.fatigue_state == "Fatigue").count()
+
+        avg_hr = int(aggs_avg_hr) if aggs_avg_hr else 0
+        peak_temp = round(aggs_max_temp, 1) if aggs_max_temp else 0.0
         
         status = "High Risk" if fatigue_events > 0 else "Normal"
         
@@ -265,19 +516,84 @@ def get_all_sessions(db: Session = Depends(get_db)):
         })
     return results
 
+# Served from the response cache; the DB is only queried on a miss
 @app.get("/historical/sessions/{helmet_code}")
-def get_sessions(helmet_code: str, db: Session = Depends(get_db)):
-    helmet = db.query(Helmet).filter(Helmet.helmet_code == helmet_code).first()
+def get_sessions(helmet_code: str, request: Request, company_id: uuid.UUID = Depends(get_current_company),
+                 db: Session = Depends(get_read_db)):
+    key = response_cache.sessions_key(company_id, helmet_code)
+    entry = response_cache.lookup(redis_client, key)
+    if entry is None:
+        helmet = db.query(Helmet).filter(Helmet.helmet_code == helmet_code, Helmet.company_id == company_id).first()
+        if not helmet:
+            raise HTTPException(status_code=404, detail="Helmet not found in database. Have you registered it?")
+
+        sessions = fastjson.rows(SESSION_FIELDS, db.execute(
+            select(*WorkSession.__table__.columns)
+            .where(WorkSession.company_id == company_id, WorkSession.helmet_id == helmet.id)
+            .order_by(WorkSession.start_time.desc())
+        ))
+        # The list only changes when a session opens or closes, and the worker invalidates it then
+        # (a lagging replica may not show a session the worker just opened: never pin its view)
+        immutable = not any(session["is_active"] for session in sessions) and "replica" not in db.info
+        entry = response_cache.store(redis_client, key, sessions, immutable)
+    return response_cache.respond(request, entry)
+
+# format=columns returns {"count", "columns": {field: [values]}} instead of one object per reading
+@app.get("/historical/readings/{session_id}")
+def get_session_readings(session_id: str, request: Request, format: Literal["rows", "columns"] = "rows",
+                         company_id: uuid.UUID = Depends(get_current_company), db: Session = Depends(get_read_db)):
+    key = response_cache.readings_key(company_id, session_id, format)
+    entry = response_cache.lookup(redis_client, key)
+    if entry is None:
+        # Another company's session looks like an unknown one: no readings
+        session = db.query(WorkSession).filter(WorkSession.id == session_id, WorkSession.company_id == company_id).first()
+        if session is None:
+            readings = fastjson.shaped(READING_FIELDS, [], format)
+        elif session.archived_at:
+            if format == "columns":
+                columns = archive.read_session_columns(session, company_id=company_id)
+                readings = {"count": len(columns["id"]), "columns": columns}
+            else:
+                readings = archive.read_session(session, company_id=company_id)
+        else:
+            # Plain row tuples: no ORM instances to build and walk per reading
+            readings = fastjson.shaped(READING_FIELDS, db.execute(
+                select(*Reading.__table__.columns).where(Reading.company_id == company_id, Reading.session_id == session.id)
+                .order_by(Reading.inserted_at.asc())
+            ), format)
+        # Readings of a closed session never change
+        immutable = session is not None and not session.is_active
+        entry = response_cache.store(redis_client, key, readings, immutable)
+    return response_cache.respond(request, entry)
+
+# ✅ Chart series from the rollup tables: resolution picked so the range fits in `points`
+@app.get("/historical/series/{helmet_code}")
+def get_helmet_series(helmet_code: str, start: datetime | None = None, end: datetime | None = None,
+                      points: int = 2000, format: Literal["rows", "columns"] = "rows",
+                      company_id: uuid.UUID = Depends(get_current_company), db: Session = Depends(get_read_db)):
+    helmet = db.query(Helmet).filter(Helmet.helmet_code == helmet_code, Helmet.company_id == company_id).first()
     if not helmet:
         raise HTTPException(status_code=404, detail="Helmet not found in database. Have you registered it?")
-    
-    sessions = db.query(WorkSession).filter(WorkSession.helmet_id == helmet.id).order_by(WorkSession.start_time.desc()).all()
-    return sessions
 
-@app.get("/historical/readings/{session_id}")
-def get_session_readings(session_id: str, db: Session = Depends(get_db)):
-    readings = db.query(Reading).filter(Reading.session_id == session_id).order_by(Reading.inserted_at.asc()).all()
-    return readings
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    points = max(1, min(points, 10000))
+
+    resolution, series = rollups.query_series(db, helmet.id, start, end, points)
+    if format == "columns":
+        fields = rollups.SERIES_FIELDS
+        series = fastjson.columns(fields, ([point[field] for field in fields] for point in series))
+    return FastJSONResponse({
+        "helmet_id": helmet_code,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "resolution": resolution,
+        "points": series,
+    })
 
 # ✅ Mount authentication routes
 app.include_router(auth_router)
+app.include_router(admin_router)
+app.include_router(fleet_router)
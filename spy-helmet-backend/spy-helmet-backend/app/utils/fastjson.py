@@ -0,0 +1,73 @@
+# app/utils/fastjson.py
+#
+# JSON encoding for API responses without FastAPI's jsonable_encoder walk.
+#
+# orjson (see requirement.txt) serializes dicts, lists, datetimes, UUIDs and numpy
+# arrays natively; without it the stdlib encoder is used with the same output. Handlers
+# return FastJSONResponse (or pre-encoded bytes) so FastAPI hands the content straight
+# to the encoder, and query results are shaped from row tuples instead of ORM objects:
+#
+#   rows    : [{"hr": 80.0, "inserted_at": "...", ...}, ...]        (the default shape)
+#   columns : {"count": n, "columns": {"hr": [...], "inserted_at": [...], ...}}
+#
+# The columnar shape repeats no keys and is what charts consume directly.
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+SHAPES = ("rows", "columns")
+
+
+def _default(obj):
+    # numpy scalars (float32, int64, ...) and arrays
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if orjson is None:
+        if isinstance(obj, (datetime, date, time)):
+            return obj.isoformat()
+        if isinstance(obj, UUID):
+            return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content) -> bytes:
+        return orjson.dumps(content, default=_default, option=_OPTIONS)
+else:
+    def dumps(content) -> bytes:
+        return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def rows(fields, records) -> list[dict]:
+    """[{field: value}] from row tuples in `fields` order."""
+    return [dict(zip(fields, record)) for record in records]
+
+
+def columns(fields, records) -> dict:
+    """{"count": n, "columns": {field: [values]}} from row tuples in `fields` order."""
+    records = list(records)
+    values = list(zip(*records)) if records else [()] * len(fields)
+    return {"count": len(records), "columns": {field: list(column) for field, column in zip(fields, values)}}
+
+
+def shaped(fields, records, shape: str = "rows"):
+    return columns(fields, records) if shape == "columns" else rows(fields, records)
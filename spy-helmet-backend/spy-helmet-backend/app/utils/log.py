@@ -0,0 +1,90 @@
+# app/utils/log.py
+#
+# Leveled, structured (one JSON object per line), rate-limited logging.
+#
+#   from app.utils.log import get_logger
+#   logger = get_logger(__name__)
+#   logger.info("Created new WorkSession", extra={"helmet": helmet_code})
+#
+# LOG_LEVEL sets the level (default INFO). Messages from the same call site are limited
+# to LOG_RATE_LIMIT per LOG_RATE_WINDOW seconds; the number suppressed is attached to the
+# next line that gets through, so an error storm costs one line per window.
+
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "10"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `limit` records per call site through per window."""
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.state = {}
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        window_start, count, suppressed = self.state.get(key, (now, 0, 0))
+
+        if now - window_start >= self.window:
+            window_start, count = now, 0
+
+        if count >= self.limit:
+            self.state[key] = (window_start, count, suppressed + 1)
+            return False
+
+        if suppressed:
+            record.suppressed = suppressed
+        self.state[key] = (window_start, count + 1, 0)
+        return True
+
+
+_configured = False
+
+
+def _configure():
+    global _configured
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger("spy")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    if not _configured:
+        _configure()
+    return logging.getLogger(f"spy.{name}")
@@ -0,0 +1,274 @@
+# app/utils/metrics.py
+#
+# Minimal Prometheus-compatible metrics, cheap enough to stay on in production.
+#
+# Updates are plain attribute/list arithmetic on the calling thread (no locks): the API
+# runs on a single event loop and the worker is single threaded, so the only cost on the
+# hot path is a dict lookup and an addition. Values that are expensive to compute
+# (queue depth, buffer occupancy) are registered as callbacks and only evaluated when
+# /metrics is scraped.
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; tuned for an API whose normal requests finish in a few milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+REGISTRY = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{n}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def samples(self, name, labelnames, values):
+        yield f"{name}_total", _format_labels(labelnames, values), self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def dec(self, amount=1.0):
+        self.value -= amount
+
+    def samples(self, name, labelnames, values):
+        yield name, _format_labels(labelnames, values), self.value
+
+
+class Gauge(_Metric):
+    """
+    A gauge can also be backed by a callback returning either a number or, for
+    labelled gauges, a dict of {label values tuple: number}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1.0):
+        self.labels().dec(amount)
+
+    def set_function(self, callback):
+        self.callback = callback
+
+    def samples(self):
+        if self.callback is None:
+            yield from super().samples()
+            return
+        try:
+            value = self.callback()
+        except Exception:
+            value = math.nan
+        if isinstance(value, dict):
+            for values, v in value.items():
+                values = values if isinstance(values, tuple) else (values,)
+                yield self.name, _format_labels(self.labelnames, values), v
+        else:
+            yield self.name, "", value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labelnames, values):
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += n
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            yield f"{name}_bucket", _format_labels(labelnames + ("le",), values + (le,)), cumulative
+        yield f"{name}_sum", _format_labels(labelnames, values), self.sum
+        yield f"{name}_count", _format_labels(labelnames, values), self.count
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def render() -> str:
+    """Returns every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class RequestLatencyMiddleware:
+    """
+    Plain ASGI middleware recording REQUEST_LATENCY per route template
+    (no extra task or body copy per request, unlike BaseHTTPMiddleware).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route on the scope
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "unmatched"), status
+            ).observe(time.perf_counter() - start)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Serves /metrics from a background thread (for processes without an HTTP app, e.g. the worker)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not worth a log line
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+# --------------------------------------------------
+# Shared metric definitions
+# --------------------------------------------------
+
+# API
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route",
+                            ["method", "route", "status"])
+INFERENCE_LATENCY = Histogram("inference_duration_seconds", "Fatigue model inference latency")
+INFERENCE_BATCH_SIZE = Histogram("inference_batch_size", "Sequences per fatigue model call", buckets=SIZE_BUCKETS)
+BUFFER_OCCUPANCY = Gauge("buffer_occupancy_readings", "Readings held in each helmet's sliding window", ["helmet"])
+QUEUE_DEPTH = Gauge("redis_queue_depth", "Length of the helmet_data_queue Redis list")
+ENQUEUE_FAILURES = Counter("redis_enqueue_failures", "Readings that could not be pushed to Redis")
+
+# Worker
+WORKER_LAG = Gauge("worker_lag_seconds", "Age of the last reading processed by the worker")
+WORKER_READINGS = Counter("worker_readings", "Readings written by the worker")
+WORKER_ERRORS = Counter("worker_errors", "Worker failures while processing a reading")
+WORKER_DROPPED = Counter("worker_dropped", "Readings the worker could not write and dropped")
+WORKER_REQUEUED = Counter("worker_requeued", "Readings put back on the queue while the database was unavailable")
+DB_WRITE_LATENCY = Histogram("db_write_duration_seconds", "Worker DB commit latency (one per batch)")
+WORKER_BATCH_SIZE = Histogram("worker_batch_size", "Readings written per worker batch", buckets=SIZE_BUCKETS)
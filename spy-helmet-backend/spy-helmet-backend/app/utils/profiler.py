@@ -0,0 +1,95 @@
+# app/utils/profiler.py
+#
+# Built-in sampling profiler that can be switched on at runtime (see /admin/profile).
+#
+# A background thread snapshots the target thread's stack every `interval` seconds with
+# sys._current_frames() and counts identical stacks. Output is the "folded" format
+# (frame;frame;frame count per line) that flamegraph.pl, speedscope and inferno read.
+# Nothing runs while no profile is active.
+
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.utils.log import get_logger
+
+logger = get_logger("profiler")
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.target_thread_id = None
+        # When > 0 only requests that opted in are sampled (see request_fraction)
+        self.request_fraction = 0.0
+        self.active_requests = 0
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005, request_fraction: float = 0.0,
+              target_thread_id: int | None = None):
+        if self.running:
+            raise RuntimeError("A profile is already running")
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.request_fraction = request_fraction
+        self.active_requests = 0
+        self.target_thread_id = target_thread_id or threading.get_ident()
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._run, args=(seconds, interval), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+        logger.info("Profiler started for %ss (interval %sms)", seconds, interval * 1000)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self, seconds, interval):
+        deadline = time.monotonic() + seconds
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            if not self.request_fraction or self.active_requests > 0:
+                frame = sys._current_frames().get(self.target_thread_id)
+                if frame is not None:
+                    self.stacks[self._fold(frame)] += 1
+                    self.samples += 1
+            self.stop_event.wait(interval)
+        self.finished_at = time.time()
+        logger.info("Profiler finished with %s samples", self.samples)
+
+    @staticmethod
+    def _fold(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "request_fraction": self.request_fraction,
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,137 @@
+# app/utils/tracing.py
+#
+# Stage timings ("spans") for the ingest hot path.
+#
+#   with tracing.span("buffer"):
+#       sequence = add_reading(...)
+#
+# When tracing is off (the default) span() hands back one shared no-op context manager,
+# so an instrumented block costs a global lookup and an empty with-statement.
+# When it is on, every span feeds the stage_duration_seconds histogram; requests picked
+# by TRACE_SAMPLE_RATE additionally collect their spans into a per-request trace that is
+# returned in a Server-Timing header and logged when slower than TRACE_SLOW_MS.
+
+import os
+import random
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from app.utils import metrics
+from app.utils.log import get_logger
+from app.utils.profiler import profiler
+
+logger = get_logger("tracing")
+
+enabled = os.getenv("TRACE_SPANS", "0") == "1"
+sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+slow_ms = float(os.getenv("TRACE_SLOW_MS", "250"))
+
+STAGE_LATENCY = metrics.Histogram("stage_duration_seconds", "Time spent in each traced stage", ["stage"])
+
+_NULL = nullcontext()
+_current = ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("name", "start", "spans")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms:.3f}" for name, ms in self.spans)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        STAGE_LATENCY.labels(self.name).observe(elapsed)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append((self.name, elapsed * 1000))
+        return False
+
+
+def span(name: str):
+    if not enabled:
+        return _NULL
+    return _Span(name)
+
+
+def mark(name: str):
+    """Records the time since the trace started as a span (e.g. validation done by the framework)."""
+    if not enabled:
+        return
+    trace = _current.get()
+    if trace is not None:
+        elapsed = time.perf_counter() - trace.start
+        STAGE_LATENCY.labels(name).observe(elapsed)
+        trace.spans.append((name, elapsed * 1000))
+
+
+def configure(enable: bool | None = None, rate: float | None = None, slow: float | None = None):
+    global enabled, sample_rate, slow_ms
+    if enable is not None:
+        enabled = enable
+    if rate is not None:
+        sample_rate = min(max(rate, 0.0), 1.0)
+    if slow is not None:
+        slow_ms = slow
+    return {"enabled": enabled, "sample_rate": sample_rate, "slow_ms": slow_ms}
+
+
+class TracingMiddleware:
+    """
+    Starts a per-request trace for sampled requests and reports it as Server-Timing,
+    and marks requests picked for a request-fraction profile (app/utils/profiler.py).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not enabled and not profiler.running) or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiled = profiler.running and profiler.request_fraction and random.random() < profiler.request_fraction
+        traced = enabled and random.random() < sample_rate
+
+        if profiled:
+            profiler.active_requests += 1
+        if traced:
+            trace = Trace(scope["path"])
+            token = _current.set(trace)
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    total_ms = (time.perf_counter() - trace.start) * 1000
+                    trace.spans.append(("total", total_ms))
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+                    if total_ms >= slow_ms:
+                        logger.warning("Slow request %s", trace.name, extra={"spans": dict(trace.spans)})
+                await send(message)
+        else:
+            send_wrapper = send
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if traced:
+                _current.reset(token)
+            if profiled:
+                profiler.active_requests -= 1
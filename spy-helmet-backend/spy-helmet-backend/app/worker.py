@@ -1,38 +1,78 @@
 import os
 import time
-import json
 import redis
 from datetime import datetime
+from sqlalchemy import exc, insert
 from sqlalchemy.orm import Session
 from app.db.database import SessionLocal
 from app.db.models import WorkSession, Reading, Helmet, Company
+from app.core import response_cache, rollups, sessions
+from app.core.codec import decode_payload
+from app.core.shedding import LAST_PROCESSED_KEY
+from app.utils import metrics, tracing
+from app.utils.log import get_logger
 
-print("🚀 Historical Data Worker Starting up...", flush=True)
+logger = get_logger("worker")
 
-# Connect to Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-print(f"Connecting to Redis at {REDIS_URL}", flush=True)
+# Port for the worker's own /metrics endpoint (0 disables it)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+# Max readings written per INSERT/commit
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "500"))
+# Longest pause between attempts while the database is unavailable (seconds)
+WORKER_MAX_BACKOFF = float(os.getenv("WORKER_MAX_BACKOFF", "30"))
 
-retry_count = 0
-while retry_count < 10:
-    try:
-        redis_client = redis.from_url(REDIS_URL)
-        redis_client.ping()
-        print("✅ Redis Connected Successfully!", flush=True)
-        break
-    except Exception as e:
-        print(f"⌛ Waiting for Redis... ({e})", flush=True)
-        time.sleep(2)
-        retry_count += 1
+# The database, not the readings, is the problem (connection drop, failover, pool timeout):
+# the batch goes back on the queue instead of being retried reading by reading
+DB_UNAVAILABLE = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError)
+
+class DatabaseUnavailable(Exception):
+    """The database could not be reached; `messages` were not written."""
+
+    def __init__(self, messages: list[bytes], cause: Exception):
+        super().__init__(str(cause))
+        self.messages = messages
 
 db: Session = SessionLocal()
 
-def process_reading(payload: dict):
-    # Payload contains: helmet_ID, HR, BodyTemp, etc.
-    helmet_code = payload.get("helmet_ID")
-    
+def connect_redis():
+    logger.info("Connecting to Redis at %s", REDIS_URL)
+
+    client = None
+    retry_count = 0
+    while retry_count < 10:
+        try:
+            client = redis.from_url(REDIS_URL)
+            client.ping()
+            logger.info("✅ Redis Connected Successfully!")
+            break
+        except Exception as e:
+            logger.warning("⌛ Waiting for Redis... (%s)", e)
+            time.sleep(2)
+            retry_count += 1
+    return client
+
+# helmet_code -> helmets.id and helmets.id -> active work_sessions.id, so a batch only
+# touches the DB for helmets/sessions it has not seen yet
+helmet_cache: dict = {}
+session_cache: dict = {}
+# work_sessions.id -> last_reading_at written by this worker
+session_touched: dict = {}
+# helmets.id -> helmet_code, for the cache keys of the historical endpoints
+helmet_codes: dict = {}
+# helmets.id -> companies.id, copied onto the helmet's sessions and readings
+helmet_companies: dict = {}
+# Historical response cache keys changed since the last flush_invalidations()
+stale_keys: set = set()
+
+def get_helmet_id(helmet_code: str):
+    helmet_id = helmet_cache.get(helmet_code)
+    if helmet_id is not None:
+        return helmet_id
+
     # Check if Helmet exists
-    helmet = db.query(Helmet).filter(Helmet.helmet_code == helmet_code).first()
+    with tracing.span("worker_helmet_lookup"):
+        helmet = db.query(Helmet).filter(Helmet.helmet_code == helmet_code).first()
     if not helmet:
         # SECURITY OVERRIDE: Auto-create missing helmets on the fly
         default_company = db.query(Company).filter(Company.username == "system_auto").first()
@@ -46,51 +86,279 @@ def process_reading(payload: dict):
         db.add(helmet)
         db.commit()
         db.refresh(helmet)
-        print(f"🌟 Auto-registered missing Helmet {helmet_code}", flush=True)
+        logger.info("🌟 Auto-registered missing Helmet %s", helmet_code)
+
+    helmet_cache[helmet_code] = helmet.id
+    helmet_codes[helmet.id] = helmet_code
+    helmet_companies[helmet.id] = helmet.company_id
+    return helmet.id
+
+def get_active_session_id(helmet_id, helmet_code: str):
+    session_id = session_cache.get(helmet_id)
+    if session_id is not None:
+        return session_id
 
     # Check for Active WorkSession
-    active_session = db.query(WorkSession).filter(
-        WorkSession.helmet_id == helmet.id,
-        WorkSession.is_active == True
-    ).first()
+    with tracing.span("worker_session_lookup"):
+        session_id = sessions.active_session_id(db, helmet_id)
 
     # If no active session, automatically start one!
-    if not active_session:
-        active_session = WorkSession(helmet_id=helmet.id, is_active=True)
-        db.add(active_session)
-        db.commit()
-        db.refresh(active_session)
-        print(f"⚡ Created new WorkSession for Helmet {helmet_code}", flush=True)
-
-    # Insert Reading
-    new_reading = Reading(
-        session_id=active_session.id,
-        helmet_id=helmet.id,
-        temperature=payload.get("BodyTemp"),
-        env_temp=payload.get("EnvTemp"),
-        humidity=payload.get("Humidity"),
-        hr=payload.get("HR"),
-        spo2=payload.get("SpO2"),
-        co_ppm=payload.get("CO_ppm"),
-        ch4_ppm=payload.get("CH4_ppm"),
-        fatigue_state=payload.get("fatigue_state")
-    )
-    
-    db.add(new_reading)
+    if session_id is None:
+        company_id = helmet_companies[helmet_id]
+        session_id = sessions.open_session(db, helmet_id, company_id)
+        stale_keys.add(response_cache.sessions_key(company_id, helmet_code))
+        logger.info("⚡ Created new WorkSession for Helmet %s", helmet_code)
+
+    session_cache[helmet_id] = session_id
+    return session_id
+
+def touch_sessions(rows: list[dict]):
+    """
+    Moves the batch's sessions' last_reading_at forward. Rows whose cached session was
+    closed by an idle sweep in the meantime are moved to a new session.
+    """
+    last_reading = {}
+    for row in rows:
+        previous = last_reading.get(row["session_id"])
+        if previous is None or row["inserted_at"] > previous:
+            last_reading[row["session_id"]] = row["inserted_at"]
+    # last_reading_at only has to be as fresh as the idle gap needs
+    due = {
+        session_id: last for session_id, last in last_reading.items()
+        if session_id not in session_touched
+        or (last - session_touched[session_id]).total_seconds() >= sessions.TOUCH_INTERVAL
+    }
+    if not due:
+        return
+    active = sessions.touch(db, due)
+    for session_id in active:
+        session_touched[session_id] = due[session_id]
+    closed = set(due) - active
+    if not closed:
+        return
+
+    for row in rows:
+        if row["session_id"] in closed:
+            session_cache.pop(row["helmet_id"], None)
+    # Keep the touch of the open sessions; opening a session may roll back
     db.commit()
+    for row in rows:
+        if row["session_id"] in closed:
+            helmet_code = helmet_codes.get(row["helmet_id"], str(row["helmet_id"]))
+            row["session_id"] = get_active_session_id(row["helmet_id"], helmet_code)
+    touch_sessions([row for row in rows if row["session_id"] not in active])
+
+def build_row(payload: dict) -> dict:
+    # Payload contains: helmet_ID, HR, BodyTemp, etc. plus the model output
+    helmet_code = payload.get("helmet_ID")
+    helmet_id = get_helmet_id(helmet_code)
+    scores = payload.get("raw_scores") or (None, None, None)
+    received_at = payload.get("received_at")
+
+    return {
+        "session_id": get_active_session_id(helmet_id, helmet_code),
+        "helmet_id": helmet_id,
+        "company_id": helmet_companies[helmet_id],
+        "temperature": payload.get("BodyTemp"),
+        "env_temp": payload.get("EnvTemp"),
+        "humidity": payload.get("Humidity"),
+        "hr": payload.get("HR"),
+        "spo2": payload.get("SpO2"),
+        "co_ppm": payload.get("CO_ppm"),
+        "ch4_ppm": payload.get("CH4_ppm"),
+        "fatigue_state": payload.get("fatigue_state"),
+        "confidence": payload.get("confidence"),
+        "score_normal": scores[0],
+        "score_stressed": scores[1],
+        "score_fatigue": scores[2],
+        # Time the API received the reading, not when this batch happened to be written
+        "inserted_at": datetime.utcfromtimestamp(received_at / 1000) if received_at else datetime.utcnow(),
+    }
+
+def process_batch(payloads: list[dict]):
+    """Writes a batch of readings with one multi-row INSERT and one commit."""
+    if not payloads:
+        return
+
+    rows = [build_row(payload) for payload in payloads]
+
+    start = time.perf_counter()
+    with tracing.span("worker_commit"):
+        touch_sessions(rows)
+        db.execute(insert(Reading), rows)
+        # Chart aggregates, in the same transaction so they never drift from the readings
+        rollups.upsert(db, rows)
+        db.commit()
+    metrics.DB_WRITE_LATENCY.observe(time.perf_counter() - start)
+    for session_id, company_id in {(row["session_id"], row["company_id"]) for row in rows}:
+        stale_keys.update(response_cache.readings_keys(company_id, session_id))
+    metrics.WORKER_READINGS.inc(len(rows))
+    metrics.WORKER_BATCH_SIZE.observe(len(rows))
+
+    received_at = payloads[-1].get("received_at")
+    if received_at:
+        metrics.WORKER_LAG.set(max(0.0, time.time() - received_at / 1000))
 
-print("🎧 Worker listening to 'helmet_data_queue'...", flush=True)
+def process_reading(payload: dict):
+    process_batch([payload])
+
+def reset_caches():
+    # Rows created in a rolled back transaction must not stay cached
+    helmet_cache.clear()
+    session_cache.clear()
+    session_touched.clear()
+
+def drop_reading(payload: dict, error: Exception):
+    metrics.WORKER_ERRORS.inc()
+    metrics.WORKER_DROPPED.inc()
+    logger.error("⚠️ Dropped reading from %s: %s", payload.get("helmet_ID"), error)
 
-while True:
+def handle_batch(messages: list[bytes], payloads: list[dict]):
+    """Writes decoded `payloads` (`messages` are their queue frames, in the same order)."""
     try:
-        # blpop blocks indefinitely (timeout=0) until a payload is pushed by FastAPI
-        result = redis_client.blpop("helmet_data_queue", timeout=0)
-        if result:
-            queue_name, data_bytes = result
-            payload = json.loads(data_bytes.decode('utf-8'))
-            process_reading(payload)
-            
+        process_batch(payloads)
+        return
+    except DB_UNAVAILABLE as e:
+        db.rollback()
+        reset_caches()
+        raise DatabaseUnavailable(messages, e) from e
     except Exception as e:
-        print(f"⚠️ Worker Error: {e}", flush=True)
         db.rollback()
-        time.sleep(1) # Prevent CPU spinning on DB crash
+        reset_caches()
+        if len(payloads) == 1:
+            drop_reading(payloads[0], e)
+            return
+        logger.warning("⚠️ Batch of %s failed (%s), retrying individually", len(payloads), e)
+
+    # Retry one by one so a single bad reading does not drop the whole batch
+    for i, payload in enumerate(payloads):
+        try:
+            process_batch([payload])
+        except DB_UNAVAILABLE as e:
+            db.rollback()
+            reset_caches()
+            # The readings before this one are written: only the rest go back
+            raise DatabaseUnavailable(messages[i:], e) from e
+        except Exception as single_error:
+            db.rollback()
+            reset_caches()
+            drop_reading(payload, single_error)
+
+def requeue(redis_client, messages: list[bytes]):
+    """Puts unwritten messages back on the consumer end of the queue, oldest last (popped first)."""
+    redis_client.rpush("helmet_data_queue", *reversed(messages))
+    metrics.WORKER_REQUEUED.inc(len(messages))
+
+def decode_messages(messages: list[bytes]) -> tuple[list[bytes], list[dict]]:
+    """Decodes popped queue messages; a malformed frame is counted and dropped on its own.
+
+    Returns the decodable messages and their payloads, in the same order.
+    """
+    decoded, payloads = [], []
+    for message in messages:
+        try:
+            # Binary frames from the API, legacy JSON payloads still accepted
+            payloads.append(decode_payload(message))
+            decoded.append(message)
+        except Exception as e:
+            metrics.WORKER_ERRORS.inc()
+            metrics.WORKER_DROPPED.inc()
+            logger.error("⚠️ Dropped undecodable queue message (%s bytes): %s", len(message), e)
+    return decoded, payloads
+
+def sweep_sessions(position: float):
+    """Closes idle sessions; `position` is the receive time of the newest reading written."""
+    closed = sessions.close_idle(db, datetime.utcfromtimestamp(position))
+    for session_id, helmet_id, company_id in closed:
+        session_touched.pop(session_id, None)
+        if session_cache.get(helmet_id) == session_id:
+            del session_cache[helmet_id]
+        stale_keys.update(response_cache.readings_keys(company_id, session_id))
+
+    unknown = {helmet_id for _, helmet_id, _ in closed if helmet_id not in helmet_codes}
+    if unknown:
+        helmet_codes.update(db.query(Helmet.id, Helmet.helmet_code).filter(Helmet.id.in_(unknown)).all())
+        db.commit()
+    stale_keys.update(response_cache.sessions_key(company_id, helmet_codes[helmet_id])
+                      for _, helmet_id, company_id in closed if helmet_id in helmet_codes)
+
+def flush_invalidations(redis_client):
+    """Drops the historical responses this worker changed from the API caches."""
+    if not stale_keys:
+        return
+    keys = list(stale_keys)
+    stale_keys.clear()
+    try:
+        response_cache.invalidate(redis_client, keys)
+    except Exception:
+        # Retried with the next batch
+        stale_keys.update(keys)
+        raise
+
+def main():
+    logger.info("🚀 Historical Data Worker Starting up...")
+    redis_client = connect_redis()
+
+    if WORKER_METRICS_PORT:
+        metrics.start_metrics_server(WORKER_METRICS_PORT)
+    metrics.QUEUE_DEPTH.set_function(lambda: redis_client.llen("helmet_data_queue"))
+
+    logger.info("🎧 Worker listening to 'helmet_data_queue'...")
+
+    # Idle gaps are measured against the stream, so a backlog does not close live sessions
+    position = time.time()
+    last_sweep = 0.0
+    backoff = 1.0
+
+    while True:
+        try:
+            if time.monotonic() - last_sweep >= sessions.SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                sweep_sessions(position)
+                flush_invalidations(redis_client)
+
+            # The API LPUSHes, so the oldest reading is on the right: pop from the right for FIFO.
+            # brpop blocks until a payload is pushed by FastAPI (or the next sweep is due),
+            # then whatever else is already queued is drained into the same batch.
+            result = redis_client.brpop("helmet_data_queue", timeout=max(1, int(sessions.SWEEP_INTERVAL)))
+            if not result:
+                # Queue drained: the stream has caught up with the clock
+                position = time.time()
+            else:
+                queue_name, data_bytes = result
+                messages = [data_bytes] + (redis_client.rpop("helmet_data_queue", WORKER_BATCH_SIZE - 1) or [])
+
+                with tracing.span("worker_decode"):
+                    messages, payloads = decode_messages(messages)
+                if not payloads:
+                    continue
+                handle_batch(messages, payloads)
+                flush_invalidations(redis_client)
+
+                # Consumer position for the API's load shedding monitor (app/core/shedding.py)
+                received_at = payloads[-1].get("received_at")
+                if received_at:
+                    redis_client.set(LAST_PROCESSED_KEY, received_at)
+                position = received_at / 1000 if received_at else time.time()
+            backoff = 1.0
+
+        except DatabaseUnavailable as e:
+            metrics.WORKER_ERRORS.inc()
+            logger.error("⚠️ Database unavailable, putting %s readings back on the queue: %s", len(e.messages), e)
+            try:
+                requeue(redis_client, e.messages)
+            except Exception as push_error:
+                metrics.WORKER_DROPPED.inc(len(e.messages))
+                logger.error("⚠️ Could not put %s readings back on the queue, dropped: %s", len(e.messages), push_error)
+            # Back off so an outage does not spin through the queue
+            time.sleep(backoff)
+            backoff = min(backoff * 2, WORKER_MAX_BACKOFF)
+        except Exception as e:
+            metrics.WORKER_ERRORS.inc()
+            logger.error("⚠️ Worker Error: %s", e)
+            db.rollback()
+            reset_caches()
+            time.sleep(1) # Prevent CPU spinning on DB crash
+
+if __name__ == "__main__":
+    main()
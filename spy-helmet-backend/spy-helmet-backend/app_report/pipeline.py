@@ -1,36 +1,51 @@
 import os
 import joblib
+import numpy as np
 
+from app.core.registry import ModelRegistry
 from .features import extract_features
 from .decision import classify_risk, recommend_shift, generate_breaks
 from .report import generate_weekly_manager_report
 
 # --------------------------------------------------
-# Load model ONCE (safe absolute path)
+# Model versions (app/core/registry.py); the file below is the default version
 # --------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, "model", "weekly_fatigue_model.pkl")
 
+# A flat week, for warming up freshly loaded versions
+WARMUP_WEEK = [{"fatigue_minutes": 0.0, "avg_recovery_time": 0.0, "co_exposure": 0.0,
+                "heat_stress": 0.0, "avg_hr": 70.0}] * 7
 
-try:
-    if os.path.exists(MODEL_PATH):
-        model = joblib.load(MODEL_PATH)
-    else:
-        print(f"WARNING: Report model not found at {MODEL_PATH}")
-        model = None
-except Exception as e:
-    print(f"ERROR: Failed to load report model: {e}")
-    model = None
+
+def _same_risk(active, shadow):
+    # Versions agree when they put the worker in the same risk class
+    return np.array([classify_risk(a) == classify_risk(b) for a, b in zip(active, shadow)])
+
+
+registry = ModelRegistry(
+    "weekly_report",
+    loader=joblib.load,
+    predict=lambda model, features: model.predict(features),
+    agree=_same_risk,
+    warmup_input=lambda: extract_features(WARMUP_WEEK),
+    legacy_path=MODEL_PATH,
+    extension=".pkl",
+)
+registry.refresh()
+if registry.active is None:
+    print(f"WARNING: No report model loaded ({registry.last_error or f'not found at {MODEL_PATH}'})")
 
 
 def weekly_fatigue_pipeline(worker_id, last_7_days_kpi):
     features = extract_features(last_7_days_kpi)
 
-    if model is None:
+    version, output = registry.predict(features)
+    if output is None:
         # Fallback if model failed to load
         predicted = 50.0 # Default fallback
     else:
-        predicted = float(model.predict(features)[0])
+        predicted = float(output[0])
     predicted = round(predicted, 1)
 
     risk = classify_risk(predicted)
@@ -52,5 +67,6 @@ def weekly_fatigue_pipeline(worker_id, last_7_days_kpi):
         "risk_level": risk,
         "recommended_shift": shift,
         "recommended_breaks": breaks,
+        "model_version": version,
         "weekly_report": report
     }
@@ -0,0 +1,244 @@
+# bench/ingest_load.py
+#
+# Local load generator for the ingest path (/submit_reading).
+#
+# Simulates N helmets posting at a fixed rate with async clients against the FastAPI
+# app in-process (no network, no Redis, no Postgres) and reports latency percentiles,
+# throughput and the time split across parse / buffer / inference / queue / db.
+# The API no longer writes to the DB itself, so "db" is measured afterwards by draining
+# the queue through the worker's batch writer into in-memory SQLite (per reading).
+#
+#   python -m bench.ingest_load --helmets 50 --rate 5 --duration 10 --out results.json
+#   python -m bench.ingest_load --fake-model --binary
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.core.codec import encode_reading, CONTENT_TYPE
+from bench.stand_ins import MemoryRedis, AsyncMemoryRedis, use_local_database, install_fake_predictor
+
+STAGES = ["parse", "buffer", "inference", "queue", "db"]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summarize(samples_ns):
+    values = sorted(v / 1e6 for v in samples_ns)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 4),
+        "p99_ms": round(percentile(values, 99), 4),
+        "max_ms": round(values[-1], 4) if values else 0.0,
+    }
+
+
+class StageTimer:
+    """Wraps app callables and records how long each call spends in a stage."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES + ["handler", "server"]}
+
+    def wrap(self, stage, fn):
+        samples = self.samples[stage]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter_ns() - start)
+        return timed
+
+    def wrap_asgi(self, app):
+        samples = self.samples["server"]
+
+        async def timed_app(scope, receive, send):
+            start = time.perf_counter_ns()
+            try:
+                await app(scope, receive, send)
+            finally:
+                if scope["type"] == "http":
+                    samples.append(time.perf_counter_ns() - start)
+        return timed_app
+
+
+def load_app(args, timer):
+    use_local_database()
+    if args.fake_model:
+        install_fake_predictor()
+
+    import app.main as main
+    from app.core import admission
+
+    if not args.admission:
+        # Simulated helmets post well above the per-helmet admission rate
+        admission.HELMET_RATE = admission.COMPANY_RATE = 0
+
+    main.redis_client = MemoryRedis()
+    main.publisher.client = AsyncMemoryRedis(main.redis_client)
+    main.publisher.spool_path = os.path.join(tempfile.mkdtemp(), "bench.spool")
+    main.publisher.publish = timer.wrap("queue", main.publisher.publish)
+    main.add_reading = timer.wrap("buffer", main.add_reading)
+    main.predict_fatigue = timer.wrap("inference", main.predict_fatigue)
+    main.handle_sensor_reading = timer.wrap("handler", main.handle_sensor_reading)
+    return main
+
+
+def drain_queue(redis_client, queue_key, batch_size, timer):
+    """Runs the worker's batch writer over everything queued, recording per-reading DB time."""
+    from app.db.database import engine, Base
+    from app.core.codec import decode_payload
+    from app import worker
+
+    Base.metadata.create_all(bind=engine)
+    samples = timer.samples["db"]
+    while True:
+        messages = redis_client.rpop(queue_key, batch_size)
+        if not messages:
+            break
+        payloads = [decode_payload(m) for m in messages]
+        start = time.perf_counter_ns()
+        worker.process_batch(payloads)
+        per_reading = (time.perf_counter_ns() - start) // len(payloads)
+        samples.extend([per_reading] * len(payloads))
+
+
+def make_reading(helmet_id, packet_no, rng):
+    return {
+        "helmet_ID": helmet_id,
+        "BodyTemp": round(rng.uniform(36.5, 37.5), 2),
+        "EnvTemp": round(rng.uniform(27.0, 30.0), 2),
+        "Humidity": round(rng.uniform(90.0, 99.0), 2),
+        "CO_ppm": round(rng.uniform(0.0, 5.0), 2),
+        "CH4_ppm": round(rng.uniform(0.0, 5.0), 2),
+        "HR": int(rng.uniform(70, 125)),
+        "SpO2": int(rng.uniform(95, 99)),
+        "Packet_no": packet_no,
+    }
+
+
+async def run_helmet(client, helmet_id, args, latencies, errors, stop_at):
+    rng = random.Random(helmet_id)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    next_send = time.perf_counter() + rng.uniform(0, interval)
+    packet_no = 0
+
+    while time.perf_counter() < stop_at and (args.packets == 0 or packet_no < args.packets):
+        if interval:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += interval
+
+        packet_no += 1
+        payload = make_reading(helmet_id, packet_no, rng)
+        start = time.perf_counter_ns()
+        if args.binary:
+            res = await client.post("/submit_reading/bin", content=encode_reading(SimpleNamespace(**payload)),
+                                    headers={"Content-Type": CONTENT_TYPE})
+        else:
+            res = await client.post("/submit_reading", json=payload)
+        latencies.append(time.perf_counter_ns() - start)
+        if res.status_code != 200:
+            errors.append(res.status_code)
+
+
+async def run(args):
+    import httpx
+
+    timer = StageTimer()
+    main = load_app(args, timer)
+    transport = httpx.ASGITransport(app=timer.wrap_asgi(main.app))
+
+    latencies, errors = [], []
+    helmet_ids = [f"BENCH-{i:04d}" for i in range(args.helmets)]
+
+    # ASGITransport does not run lifespan events, so start the publisher by hand
+    await main.publisher.start()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm-up so imports / first inference do not skew the percentiles
+        for helmet_id in helmet_ids[:1]:
+            await client.post("/submit_reading", json=make_reading(helmet_id, 0, random.Random(0)))
+        for samples in timer.samples.values():
+            samples.clear()
+
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        await asyncio.gather(*(
+            run_helmet(client, helmet_id, args, latencies, errors, stop_at) for helmet_id in helmet_ids
+        ))
+        elapsed = time.perf_counter() - started
+    await main.publisher.flush()
+    await main.publisher.stop()
+
+    server = timer.samples["server"]
+    handler = timer.samples["handler"]
+    # Everything the server does before the handler runs: routing, body read, validation
+    timer.samples["parse"] = [s - h for s, h in zip(server, handler)]
+
+    queue_key = "helmet_data_queue"
+    queue_depth = main.redis_client.llen(queue_key)
+    queue_bytes = main.redis_client.memory_usage(queue_key)
+    drain_queue(main.redis_client, queue_key, args.worker_batch, timer)
+
+    return {
+        "benchmark": "ingest_load",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "config": vars(args),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(latencies),
+        "server_latency": summarize(server),
+        "stages": {stage: summarize(timer.samples[stage]) for stage in STAGES},
+        "queue": {
+            "depth": queue_depth,
+            "bytes": queue_bytes,
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local load benchmark for /submit_reading")
+    parser.add_argument("--helmets", type=int, default=20, help="number of simulated helmets")
+    parser.add_argument("--rate", type=float, default=10.0, help="packets per second per helmet (0 = as fast as possible)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--packets", type=int, default=0, help="stop each helmet after this many packets (0 = no limit)")
+    parser.add_argument("--binary", action="store_true", help="post binary frames to /submit_reading/bin")
+    parser.add_argument("--worker-batch", type=int, default=500, help="worker batch size when draining the queue")
+    parser.add_argument("--fake-model", action="store_true", help="skip TensorFlow and use a constant predictor")
+    parser.add_argument("--admission", action="store_true", help="keep the per-helmet / per-company rate limits")
+    parser.add_argument("--out", help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
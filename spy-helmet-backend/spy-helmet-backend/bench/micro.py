@@ -0,0 +1,422 @@
+# bench/micro.py
+#
+# Micro-benchmarks for the hot paths: predictor, sliding-window buffer, gas rules, weekly
+# report features, the worker's DB writes (against in-memory SQLite) and API response
+# encoding.
+#
+#   python -m bench.micro                      # run and compare against bench/baselines.json
+#   python -m bench.micro --only buffer        # run a subset
+#   python -m bench.micro --save-baseline      # record the current numbers as the new baseline
+#
+# Exits with status 1 when a case is slower than its baseline by more than --threshold.
+# Baselines are machine specific: re-record them on the machine that runs the comparison.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from bench.stand_ins import use_local_database
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+CASES = {}
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+class Skip(Exception):
+    pass
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def random_window(rng):
+    return [[rng.uniform(70, 125), rng.uniform(36.5, 37.5)] for _ in range(100)]
+
+
+# --------------------------------------------------
+# Predictor
+# --------------------------------------------------
+
+def load_predictor():
+    try:
+        from app.core import predictor
+    except ImportError as e:
+        raise Skip(f"model runtime unavailable: {e}")
+    if predictor.model is None:
+        raise Skip("fatigue model not loaded")
+    return predictor
+
+
+@case("predictor.single")
+def bench_predict_single():
+    import numpy as np
+    predictor = load_predictor()
+    sequence = np.array(random_window(random.Random(1)), dtype=np.float32)
+    return lambda: predictor.predict_fatigue(sequence), 1
+
+
+@case("predictor.batch_64")
+def bench_predict_batch():
+    import numpy as np
+    predictor = load_predictor()
+    rng = random.Random(2)
+    sequences = np.array([random_window(rng) for _ in range(64)], dtype=np.float32)
+    return lambda: predictor.predict_fatigue_batch(sequences), 64
+
+
+# --------------------------------------------------
+# Sliding-window buffer
+# --------------------------------------------------
+
+@case("buffer.add_reading_1k_helmets")
+def bench_buffer():
+    from app.core import buffer
+
+    helmets = [f"H-{i:04d}" for i in range(1000)]
+    rng = random.Random(3)
+    readings = [[rng.uniform(70, 125), rng.uniform(36.5, 37.5)] for _ in range(1000)]
+
+    # Pre-fill so every call assembles a full (100, 2) window
+    buffer.reset_buffer()
+    for helmet_id in helmets:
+        for reading in readings[:100]:
+            buffer.add_reading(reading, helmet_id)
+
+    def run():
+        for helmet_id, reading in zip(helmets, readings):
+            buffer.add_reading(reading, helmet_id)
+    return run, len(helmets)
+
+
+# --------------------------------------------------
+# Gas hazard rules
+# --------------------------------------------------
+
+@case("gas_rules.evaluate_1k_helmets")
+def bench_gas_single():
+    from app.core.gas_rules import GasRuleEngine, compile_rules, DEFAULT_RULES
+
+    engine = GasRuleEngine(compile_rules(DEFAULT_RULES))
+    helmets = [f"H-{i:04d}" for i in range(1000)]
+    rng = random.Random(7)
+    values = [(rng.uniform(0, 40), rng.uniform(0, 6000)) for _ in helmets]
+    clock = [time.time()]
+
+    def run():
+        clock[0] += 1
+        for helmet_id, value in zip(helmets, values):
+            engine.evaluate(helmet_id, value, clock[0])
+    return run, len(helmets)
+
+
+@case("gas_rules.evaluate_batch_10k")
+def bench_gas_batch():
+    import numpy as np
+    from app.core.gas_rules import GasRuleEngine, compile_rules, DEFAULT_RULES
+
+    engine = GasRuleEngine(compile_rules(DEFAULT_RULES))
+    helmets = [f"H-{i:04d}" for i in range(10_000)]
+    values = np.random.default_rng(8).uniform(0, 40, size=(len(helmets), 2))
+    clock = [time.time()]
+
+    def run():
+        clock[0] += 1
+        engine.evaluate_batch(helmets, values, np.full(len(helmets), clock[0]))
+    return run, len(helmets)
+
+
+# --------------------------------------------------
+# Weekly report features
+# --------------------------------------------------
+
+def random_kpis(rng, workers):
+    keys = ["fatigue_minutes", "avg_recovery_time", "co_exposure", "heat_stress", "avg_hr"]
+    return [[{k: rng.uniform(5, 120) for k in keys} for _ in range(7)] for _ in range(workers)]
+
+
+@case("features.extract_features_10k_workers")
+def bench_extract_features():
+    from app_report.features import extract_features
+    kpis = random_kpis(random.Random(4), 10_000)
+
+    def run():
+        for worker_kpi in kpis:
+            extract_features(worker_kpi)
+    return run, len(kpis)
+
+
+@case("features.ewma_10k_series")
+def bench_ewma():
+    import numpy as np
+    from app_report.features import ewma
+    rng = np.random.default_rng(5)
+    series = rng.uniform(5, 120, size=(10_000, 7))
+
+    def run():
+        for s in series:
+            ewma(s)
+    return run, len(series)
+
+
+# --------------------------------------------------
+# Worker DB writes
+# --------------------------------------------------
+
+def worker_batch(size=500):
+    from app.db.database import engine, Base
+    from app.core.codec import STATES
+    import app.db.models  # noqa: F401  (registers tables)
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(6)
+    helmets = [f"W-{i:03d}" for i in range(10)]
+    return [
+        {
+            "helmet_ID": rng.choice(helmets),
+            "BodyTemp": rng.uniform(36.5, 37.5),
+            "EnvTemp": rng.uniform(27.0, 30.0),
+            "Humidity": rng.uniform(90.0, 99.0),
+            "CO_ppm": rng.uniform(0.0, 5.0),
+            "CH4_ppm": rng.uniform(0.0, 5.0),
+            "HR": rng.randint(70, 125),
+            "SpO2": rng.randint(95, 99),
+            "Packet_no": n,
+            "fatigue_state": rng.choice(STATES[1:5]),
+            "received_at": int(time.time() * 1000),
+            "confidence": 80.0,
+            "raw_scores": [0.8, 0.15, 0.05],
+        }
+        for n in range(size)
+    ]
+
+
+@case("worker.process_reading_batch_500")
+def bench_process_reading():
+    from app import worker
+    batch = worker_batch()
+
+    def run():
+        for payload in batch:
+            worker.process_reading(payload)
+    return run, len(batch)
+
+
+@case("worker.process_batch_500")
+def bench_process_batch():
+    from app import worker
+    batch = worker_batch()
+    return lambda: worker.process_batch(batch), len(batch)
+
+
+# --------------------------------------------------
+# API response encoding
+# --------------------------------------------------
+
+def reading_records(count=10_000):
+    import uuid
+    from datetime import timedelta
+    from app.db.models import Reading
+
+    rng = random.Random(7)
+    session_id, helmet_id, company_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    start = datetime(2026, 1, 1)
+    fields = tuple(column.name for column in Reading.__table__.columns)
+    records = []
+    for n in range(count):
+        values = {
+            "id": n, "session_id": session_id, "helmet_id": helmet_id, "company_id": company_id,
+            "temperature": rng.uniform(36.5, 37.5), "env_temp": rng.uniform(27.0, 30.0),
+            "humidity": rng.uniform(90.0, 99.0), "hr": float(rng.randint(70, 125)), "spo2": 97.0,
+            "co_ppm": rng.uniform(0.0, 5.0), "ch4_ppm": rng.uniform(0.0, 5.0), "fatigue_state": "Normal",
+            "confidence": 80.0, "score_normal": 0.8, "score_stressed": 0.15, "score_fatigue": 0.05,
+            "inserted_at": start + timedelta(seconds=n),
+        }
+        records.append(tuple(values[field] for field in fields))
+    return Reading, fields, records
+
+
+@case("api.readings_json_orm_10k")
+def bench_readings_orm():
+    # What /historical/readings did before: ORM instances through jsonable_encoder
+    from fastapi.encoders import jsonable_encoder
+    Reading, fields, records = reading_records()
+    readings = [Reading(**dict(zip(fields, record))) for record in records]
+
+    def run():
+        json.dumps(jsonable_encoder(readings), separators=(",", ":")).encode("utf-8")
+    return run, len(readings)
+
+
+@case("api.readings_json_rows_10k")
+def bench_readings_rows():
+    from app.utils import fastjson
+    _, fields, records = reading_records()
+    return lambda: fastjson.dumps(fastjson.rows(fields, records)), len(records)
+
+
+@case("api.readings_json_columns_10k")
+def bench_readings_columns():
+    from app.utils import fastjson
+    _, fields, records = reading_records()
+    return lambda: fastjson.dumps(fastjson.columns(fields, records)), len(records)
+
+
+@case("recent.read_10min_100_helmets")
+def bench_recent_read():
+    # /live_history: 10 minutes of 1 Hz readings for 100 helmets from packed Redis records
+    import types
+    from app.core import recent
+    from bench.stand_ins import MemoryRedis
+
+    rng = random.Random(11)
+    client = MemoryRedis()
+    now_ms = 1_767_225_600_000
+    helmets = [f"BENCH-{i:04d}" for i in range(100)]
+    for helmet_id in helmets:
+        for n in range(600):
+            reading = types.SimpleNamespace(
+                helmet_ID=helmet_id, BodyTemp=rng.uniform(36.5, 37.5), EnvTemp=rng.uniform(27.0, 30.0),
+                Humidity=rng.uniform(90.0, 99.0), CO_ppm=rng.uniform(0.0, 5.0), CH4_ppm=rng.uniform(0.0, 5.0),
+                HR=rng.randint(70, 125), SpO2=97)
+            recent.append(reading, "Normal", {"confidence": 80.0}, now_ms - (599 - n) * 1000)
+    for key, records in recent.pending.items():
+        client.append(key, bytes(records))
+    recent.pending.clear()
+    return lambda: recent.read(client, helmets, 10, now_ms), len(helmets) * 600
+
+
+@case("fleet.overview_2000_helmets")
+def bench_fleet_overview():
+    # /fleet/overview of a 2,000-helmet site from the local fleet state index
+    from app.core import admission, fleet
+
+    rng = random.Random(13)
+    now_ms = 1_767_225_600_000
+    company = "bench-company"
+    admission.companies = {f"BENCH-{i:04d}": company for i in range(2000)}
+    fleet.index = fleet.FleetIndex()
+    for i, helmet_id in enumerate(admission.companies):
+        # A tenth of the site has gone quiet
+        seen = now_ms - (rng.uniform(120, 600) if i % 10 == 0 else rng.uniform(0, 30)) * 1000
+        fleet.update(helmet_id, rng.choice(("Normal", "Normal", "Normal", "Stressed", "Fatigue")), int(seen))
+    index = fleet.index
+    # Readings above were recorded out of time order: sort last_seen once, before timing
+    index.seen_before(0)
+
+    def run():
+        for _ in range(100):
+            index.counts(company)
+            index.silent_since(company, now_ms - 60_000)
+    return run, 100
+
+
+# --------------------------------------------------
+# Runner
+# --------------------------------------------------
+
+def run_cases(names, repeat):
+    results = {}
+    for name in names:
+        try:
+            fn, items = CASES[name]()
+        except Skip as e:
+            results[name] = {"skipped": str(e)}
+            print(f"⏭️  {name}: skipped ({e})", flush=True)
+            continue
+
+        samples = measure(fn, repeat)
+        median_ms = statistics.median(samples) / 1e6
+        results[name] = {
+            "items": items,
+            "repeat": repeat,
+            "median_ms": round(median_ms, 4),
+            "min_ms": round(min(samples) / 1e6, 4),
+            "per_item_us": round(median_ms * 1000 / items, 3),
+        }
+        print(f"⏱️  {name}: {median_ms:.3f} ms ({results[name]['per_item_us']} µs/item)", flush=True)
+    return results
+
+
+def compare(results, baselines, threshold):
+    regressions = {}
+    for name, result in results.items():
+        base = baselines.get(name)
+        if "median_ms" not in result or not base or "median_ms" not in base:
+            continue
+        ratio = result["median_ms"] / base["median_ms"]
+        result["baseline_ms"] = base["median_ms"]
+        result["ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions[name] = result["ratio"]
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot paths")
+    parser.add_argument("--only", help="run only cases whose name starts with this prefix")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--out", help="write the JSON result to this file")
+    args = parser.parse_args(argv)
+
+    use_local_database()
+    names = [n for n in CASES if not args.only or n.startswith(args.only)]
+    results = run_cases(names, args.repeat)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f).get("cases", {})
+
+    if args.save_baseline:
+        baselines.update({n: r for n, r in results.items() if "median_ms" in r})
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "recorded_at": datetime.utcnow().isoformat() + "Z", "cases": baselines}, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+        regressions = {}
+    else:
+        regressions = compare(results, baselines, args.threshold)
+
+    report = {
+        "benchmark": "micro",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "threshold": args.threshold,
+        "cases": results,
+        "regressions": regressions,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for name, ratio in regressions.items():
+        print(f"❌ REGRESSION {name}: {ratio}x baseline", flush=True)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,290 @@
+# bench/stand_ins.py
+#
+# Local stand-ins for Redis and Postgres so benchmarks run without any services.
+
+import os
+import sys
+import time
+import threading
+import types
+from collections import deque
+
+
+class MemoryRedis:
+    """Tiny in-process replacement for the redis-py calls used by the app."""
+
+    def __init__(self):
+        self.lists = {}
+        self.kv = {}
+        # key -> time.monotonic() deadline
+        self.expiry = {}
+        self.cond = threading.Condition()
+
+    def ping(self):
+        return True
+
+    def lpush(self, key, *values):
+        with self.cond:
+            lst = self.lists.setdefault(key, deque())
+            for v in values:
+                lst.appendleft(v)
+            self.cond.notify_all()
+            return len(lst)
+
+    def rpush(self, key, *values):
+        with self.cond:
+            lst = self.lists.setdefault(key, deque())
+            lst.extend(values)
+            self.cond.notify_all()
+            return len(lst)
+
+    def rpop(self, key, count=None):
+        with self.cond:
+            lst = self.lists.get(key)
+            if not lst:
+                return None
+            if count is None:
+                return lst.pop()
+            return [lst.pop() for _ in range(min(count, len(lst)))]
+
+    def lpop(self, key, count=None):
+        with self.cond:
+            lst = self.lists.get(key)
+            if not lst:
+                return None
+            if count is None:
+                return lst.popleft()
+            return [lst.popleft() for _ in range(min(count, len(lst)))]
+
+    def blpop(self, key, timeout=0):
+        deadline = None if not timeout else time.monotonic() + timeout
+        with self.cond:
+            while not self.lists.get(key):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            return (key.encode(), self.lists[key].popleft())
+
+    def brpop(self, key, timeout=0):
+        deadline = None if not timeout else time.monotonic() + timeout
+        with self.cond:
+            while not self.lists.get(key):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            return (key.encode(), self.lists[key].pop())
+
+    def llen(self, key):
+        return len(self.lists.get(key, ()))
+
+    def _expire(self, key):
+        deadline = self.expiry.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self.kv.pop(key, None)
+            del self.expiry[key]
+
+    def get(self, key):
+        self._expire(key)
+        return self.kv.get(key)
+
+    def set(self, key, value, ex=None, px=None):
+        self.kv[key] = value
+        self.expiry.pop(key, None)
+        if ex or px:
+            self.expiry[key] = time.monotonic() + (ex if ex else px / 1000)
+        return True
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def append(self, key, value):
+        self._expire(key)
+        self.kv[key] = self.kv.get(key, b"") + value
+        return len(self.kv[key])
+
+    def zadd(self, key, mapping, nx=False, gt=False):
+        z = self.kv.setdefault(key, {})
+        added = 0
+        for member, score in mapping.items():
+            member = member.encode() if isinstance(member, str) else member
+            if member in z and (nx or (gt and score <= z[member])):
+                continue
+            added += member not in z
+            z[member] = float(score)
+        return added
+
+    def zrem(self, key, *members):
+        z = self.kv.get(key, {})
+        return sum(z.pop(m.encode() if isinstance(m, str) else m, None) is not None for m in members)
+
+    def zrange(self, key, start, end, withscores=False):
+        items = sorted(self.kv.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+        items = items[start:None if end == -1 else end + 1]
+        return items if withscores else [member for member, _ in items]
+
+    def sadd(self, key, *members):
+        s = self.kv.setdefault(key, set())
+        before = len(s)
+        s.update(m.encode() if isinstance(m, str) else m for m in members)
+        return len(s) - before
+
+    def smembers(self, key):
+        return set(self.kv.get(key, ()))
+
+    def pttl(self, key):
+        self._expire(key)
+        if key not in self.kv:
+            return -2
+        deadline = self.expiry.get(key)
+        return -1 if deadline is None else int((deadline - time.monotonic()) * 1000)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        h = self.kv.setdefault(key, {})
+        if field is not None:
+            h[field] = value
+        h.update(mapping or {})
+        return len(mapping or {}) + (field is not None)
+
+    def hincrby(self, key, field, amount=1):
+        h = self.kv.setdefault(key, {})
+        h[field] = h.get(field, 0) + amount
+        return h[field]
+
+    def expire(self, key, seconds):
+        if key not in self.kv:
+            return False
+        self.expiry[key] = time.monotonic() + seconds
+        return True
+
+    def hgetall(self, key):
+        return {k.encode() if isinstance(k, str) else k: v for k, v in self.kv.get(key, {}).items()}
+
+    def hdel(self, key, *fields):
+        h = self.kv.get(key, {})
+        return sum(h.pop(field, None) is not None for field in fields)
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        entries = self.kv.setdefault(key, [])
+        ms = int(time.time() * 1000)
+        last = entries[-1][0] if entries else (0, 0)
+        entry_id = (ms, 0) if ms > last[0] else (last[0], last[1] + 1)
+        entries.append((entry_id, {k.encode(): v.encode() if isinstance(v, str) else v for k, v in fields.items()}))
+        if maxlen is not None:
+            del entries[:-maxlen]
+        return f"{entry_id[0]}-{entry_id[1]}".encode()
+
+    def _entries(self, key, after=None):
+        return [(f"{ms}-{seq}".encode(), fields) for (ms, seq), fields in self.kv.get(key, [])
+                if after is None or (ms, seq) > after]
+
+    def xrange(self, key, start="-", end="+", count=None):
+        return self._entries(key)[:count]
+
+    def xread(self, streams, count=None, block=None):
+        result = []
+        for key, after in streams.items():
+            ms, _, seq = (after.decode() if isinstance(after, bytes) else after).partition("-")
+            entries = self._entries(key, (int(ms), int(seq or 0)))[:count]
+            if entries:
+                result.append([key.encode(), entries])
+        return result
+
+    def delete(self, *keys):
+        n = 0
+        for key in keys:
+            self.expiry.pop(key, None)
+            n += (self.kv.pop(key, None) is not None) + (self.lists.pop(key, None) is not None)
+        return n
+
+    def publish(self, channel, message):
+        return 0
+
+    def memory_usage(self, key):
+        # Rough equivalent of MEMORY USAGE: payload bytes of a list
+        return sum(len(v) for v in self.lists.get(key, ()))
+
+    def pipeline(self, transaction=False):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """Buffers commands and runs them on execute(), like a redis-py pipeline."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queued(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+        return queued
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.calls = []
+
+
+class AsyncMemoryRedis:
+    """redis.asyncio-style facade over a MemoryRedis (for the async publisher)."""
+
+    def __init__(self, client: MemoryRedis):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    def pipeline(self, transaction=False):
+        return AsyncMemoryPipeline(self.client)
+
+
+class AsyncMemoryPipeline(MemoryPipeline):
+    async def execute(self):
+        return super().execute()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.calls = []
+
+
+def use_local_database():
+    """Points SQLAlchemy at an in-memory SQLite database (must run before app imports)."""
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+def install_fake_predictor():
+    """
+    Replaces app.core.predictor with a TensorFlow-free stand-in so the ingest path
+    can be measured on machines without the model runtime.
+    """
+    import numpy as np
+
+    fake = types.ModuleType("app.core.predictor")
+    fake.class_names = {0: "Normal", 1: "Stressed", 2: "Fatigue"}
+    fake.model = None
+
+    def predict_fatigue(sequence):
+        if sequence.shape != (100, 2):
+            raise ValueError("Expected input shape (100, 2), got: " + str(sequence.shape))
+        scores = np.array([0.8, 0.15, 0.05], dtype=np.float32)
+        return {"prediction": "Normal", "confidence": 80.0, "raw_scores": scores.tolist()}
+
+    fake.predict_fatigue = predict_fatigue
+    sys.modules["app.core.predictor"] = fake
+    return fake
@@ -1,6 +1,53 @@
+from sqlalchemy import text
+
 from app.db.database import engine
 from app.db.models import Base
 
+# create_all only creates missing tables; columns and indexes added to existing tables
+# later are applied here (idempotent, Postgres only)
+UPGRADES = [
+    "ALTER TABLE readings ADD COLUMN IF NOT EXISTS confidence DOUBLE PRECISION",
+    "ALTER TABLE readings ADD COLUMN IF NOT EXISTS score_normal DOUBLE PRECISION",
+    "ALTER TABLE readings ADD COLUMN IF NOT EXISTS score_stressed DOUBLE PRECISION",
+    "ALTER TABLE readings ADD COLUMN IF NOT EXISTS score_fatigue DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_readings_helmet_inserted_at ON readings (helmet_id, inserted_at)",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS last_reading_at TIMESTAMP",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS reading_count INTEGER",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS avg_hr DOUBLE PRECISION",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS max_temp DOUBLE PRECISION",
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS fatigue_events INTEGER",
+    # Sessions opened before the lifecycle existed: last reading, and only the newest stays active
+    "UPDATE work_sessions SET last_reading_at = (SELECT max(inserted_at) FROM readings "
+    "WHERE readings.session_id = work_sessions.id) WHERE is_active AND last_reading_at IS NULL",
+    "UPDATE work_sessions SET is_active = false, end_time = coalesce(last_reading_at, start_time) "
+    "WHERE is_active AND id NOT IN (SELECT DISTINCT ON (helmet_id) id FROM work_sessions "
+    "WHERE is_active ORDER BY helmet_id, start_time DESC)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_work_sessions_active_helmet ON work_sessions (helmet_id) "
+    "INCLUDE (id) WHERE is_active",
+    # Tenant column on sessions and readings, copied from the helmet, and tenant-led indexes
+    "ALTER TABLE work_sessions ADD COLUMN IF NOT EXISTS company_id UUID REFERENCES companies (id)",
+    "UPDATE work_sessions SET company_id = helmets.company_id FROM helmets "
+    "WHERE helmets.id = work_sessions.helmet_id AND work_sessions.company_id IS NULL",
+    "ALTER TABLE work_sessions ALTER COLUMN company_id SET NOT NULL",
+    "ALTER TABLE readings ADD COLUMN IF NOT EXISTS company_id UUID REFERENCES companies (id)",
+    "UPDATE readings SET company_id = work_sessions.company_id FROM work_sessions "
+    "WHERE work_sessions.id = readings.session_id AND readings.company_id IS NULL",
+    "ALTER TABLE readings ALTER COLUMN company_id SET NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_work_sessions_company_start ON work_sessions (company_id, start_time)",
+    "CREATE INDEX IF NOT EXISTS ix_work_sessions_company_helmet_start "
+    "ON work_sessions (company_id, helmet_id, start_time)",
+    "CREATE INDEX IF NOT EXISTS ix_readings_company_session_inserted_at "
+    "ON readings (company_id, session_id, inserted_at)",
+]
+
 print("🚀 Initializing Database Tables...")
 Base.metadata.create_all(bind=engine)
+
+if engine.dialect.name == "postgresql":
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
+    print(f"✅ Applied {len(UPGRADES)} schema upgrades")
+
 print("✅ Tables created successfully!")
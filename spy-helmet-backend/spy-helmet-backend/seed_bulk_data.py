@@ -0,0 +1,408 @@
+# seed_bulk_data.py
+#
+# Fills a local Postgres with production-scale synthetic data: companies, helmets, one
+# closed work session per helmet and day, and every reading of those shifts.
+#
+# Signals are generated per shift with NumPy (no per-row Python): HR and body
+# temperature drift around a per-worker baseline, fatigue episodes ramp HR and
+# temperature up and SpO2 down, environment temperature / humidity follow the day, and
+# CO / CH4 have background noise plus decaying spikes. Fatigue state, confidence and
+# scores follow the signals, the first 99 readings of a shift are "Collecting".
+#
+# Readings are encoded straight into PostgreSQL's binary COPY format (also vectorized)
+# and loaded with COPY by a pool of processes, each on its own connection. Session
+# summaries are filled in afterwards, so the loaded sessions look like ones closed by
+# app/core/sessions.py.
+#
+#   python seed_bulk_data.py --helmets 1000 --days 30 --workers 8 [--interval 1]
+#                            [--defer-indexes] [--rollups]
+#
+# --defer-indexes drops the secondary indexes on readings for the load and recreates
+# them at the end (much faster for large loads; only for a local test database).
+
+import argparse
+import io
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
+# Ensure app path is in sys.path
+sys.path.append(os.getcwd())
+
+from app.db.db import get_db_connection
+
+READING_COLUMNS = ("id", "session_id", "helmet_id", "company_id", "inserted_at", "temperature", "env_temp", "humidity", "hr",
+                   "spo2", "co_ppm", "ch4_ppm", "confidence", "score_normal", "score_stressed", "score_fatigue",
+                   "fatigue_state")
+STATES = ("Normal", "Stressed", "Fatigue", "Collecting")
+COLLECTING = 99
+
+PG_EPOCH = datetime(2000, 1, 1)
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (0).to_bytes(4, "big")
+COPY_TRAILER = b"\xff\xff"
+
+
+# --------------------------------------------------
+# Binary COPY encoding
+# --------------------------------------------------
+
+def fixed(values: np.ndarray, dtype: str, nulls: np.ndarray | None = None) -> tuple:
+    """Column of fixed-width values (big-endian), as (bytes matrix, field lengths)."""
+    data = np.ascontiguousarray(values, dtype=dtype)
+    matrix = data.view(np.uint8).reshape(len(data), -1)
+    lengths = np.full(len(data), matrix.shape[1], dtype=np.int32)
+    if nulls is not None:
+        lengths[nulls] = -1
+    return matrix, lengths
+
+
+def repeated(value: bytes, n: int) -> tuple:
+    """The same raw value (e.g. a UUID) in every row."""
+    matrix = np.broadcast_to(np.frombuffer(value, dtype=np.uint8), (n, len(value)))
+    return matrix, np.full(n, len(value), dtype=np.int32)
+
+
+def text(codes: np.ndarray, labels: tuple) -> tuple:
+    """Text column from category codes into `labels`."""
+    encoded = [label.encode() for label in labels]
+    width = max(len(e) for e in encoded)
+    table = np.zeros((len(encoded), width), dtype=np.uint8)
+    for i, e in enumerate(encoded):
+        table[i, :len(e)] = np.frombuffer(e, dtype=np.uint8)
+    sizes = np.array([len(e) for e in encoded], dtype=np.int32)
+    return table[codes], sizes[codes]
+
+
+def encode_copy(columns: list[tuple]) -> bytes:
+    """Rows of PostgreSQL binary COPY data (without header / trailer) from encoded columns."""
+    n = len(columns[0][1])
+    row_sizes = 2 + sum(4 + np.maximum(lengths, 0).astype(np.int64) for _, lengths in columns)
+    out = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+    pos = np.concatenate([[0], np.cumsum(row_sizes)[:-1]])
+
+    out[pos[:, None] + np.arange(2)] = np.frombuffer(len(columns).to_bytes(2, "big"), dtype=np.uint8)
+    pos = pos + 2
+    length_offsets = np.arange(4)
+    for matrix, lengths in columns:
+        out[pos[:, None] + length_offsets] = lengths.astype(">i4").view(np.uint8).reshape(n, 4)
+        pos = pos + 4
+        width = matrix.shape[1]
+        idx = pos[:, None] + np.arange(width)
+        if (lengths == width).all():
+            out[idx] = matrix
+        else:
+            mask = np.arange(width) < lengths[:, None]
+            out[idx[mask]] = matrix[mask]
+        pos = pos + np.maximum(lengths, 0)
+    return out.tobytes()
+
+
+# --------------------------------------------------
+# Signal generation
+# --------------------------------------------------
+
+def smooth(x: np.ndarray, width: int) -> np.ndarray:
+    """Moving average (same length) via cumulative sums."""
+    if width <= 1 or len(x) < width:
+        return x
+    padded = np.pad(x, (width // 2, width - width // 2 - 1), mode="reflect")
+    sums = np.cumsum(padded)
+    sums[width:] = sums[width:] - sums[:-width]
+    return sums[width - 1:] / width
+
+
+def episodes(rng, n: int, per_shift: float, min_len: int, max_len: int) -> np.ndarray:
+    """0/1 mask of random episodes across n samples."""
+    mask = np.zeros(n + 1, dtype=np.int32)
+    count = rng.poisson(per_shift)
+    starts = rng.integers(0, n, count)
+    ends = np.minimum(starts + rng.integers(min_len, max_len, count), n)
+    np.add.at(mask, starts, 1)
+    np.add.at(mask, ends, -1)
+    return (np.cumsum(mask)[:n] > 0).astype(np.float64)
+
+
+def spikes(rng, t: np.ndarray, per_shift: float, peak: tuple, decay: tuple) -> np.ndarray:
+    """Sum of exponentially decaying spikes at random times (t in seconds)."""
+    level = np.zeros(len(t))
+    count = rng.poisson(per_shift)
+    for start, height, tau in zip(rng.uniform(t[0], t[-1], count), rng.uniform(*peak, count),
+                                  rng.uniform(*decay, count)):
+        after = t >= start
+        level[after] += height * np.exp(-(t[after] - start) / tau)
+    return level
+
+
+def generate_shift(seed: tuple, n: int, interval: float, start: datetime, profile: dict) -> dict:
+    """One shift of readings as column arrays, plus its summary."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * interval
+    per_minute = max(1, int(60 / interval))
+
+    # Fatigue episodes of 5..40 minutes, ramping in and out over ~2 minutes
+    fatigue = smooth(episodes(rng, n, profile["fatigue_rate"], 5 * per_minute, 40 * per_minute), 2 * per_minute)
+    # Slow wander of about +-4 bpm (smoothed white noise, so it stays around the baseline)
+    drift_width = 10 * per_minute
+    drift = smooth(rng.normal(0, 1, n), drift_width) * 4 * np.sqrt(min(drift_width, n))
+    activity = 4 * np.sin(2 * np.pi * t / rng.uniform(1800, 5400) + rng.uniform(0, 6.3))
+
+    hr = profile["hr"] + drift + activity + 22 * fatigue + rng.normal(0, 1.5, n)
+    temperature = profile["temp"] + 0.15 * np.sin(np.pi * t / max(t[-1], 1)) + 0.8 * fatigue + rng.normal(0, 0.05, n)
+    spo2 = np.clip(np.round(97.5 - 2.5 * fatigue + rng.normal(0, 0.7, n)), 85, 100)
+    hour = start.hour + start.minute / 60 + t / 3600
+    env_temp = 24 + 5 * np.sin(np.pi * (hour - 8) / 12) + rng.normal(0, 0.3, n)
+    humidity = np.clip(55 - 10 * np.sin(np.pi * (hour - 8) / 12) + rng.normal(0, 1.5, n), 10, 100)
+    co = np.abs(rng.normal(2, 0.8, n)) + spikes(rng, t, profile["co_spikes"], (30, 300), (60, 600))
+    ch4 = np.abs(rng.normal(20, 8, n)) + spikes(rng, t, profile["ch4_spikes"], (2000, 12000), (120, 900))
+
+    stressed = hr > profile["hr"] + 12
+    state = np.where(fatigue > 0.5, 2, np.where(stressed, 1, 0))
+    state[:min(COLLECTING, n)] = 3
+
+    # Scores: winning class 0.55..0.99, the rest split between the other two
+    top = rng.uniform(0.55, 0.99, n)
+    split = rng.uniform(0, 1, n)
+    winner = np.minimum(state, 2)
+    scores = np.empty((n, 3))
+    scores[np.arange(n), winner] = top
+    others = np.ones((n, 3), dtype=bool)
+    others[np.arange(n), winner] = False
+    scores[others] = ((1 - top)[:, None] * np.stack([split, 1 - split], axis=1)).ravel()
+    collecting = state == 3
+
+    inserted_us = int((start - PG_EPOCH).total_seconds() * 1e6) + (t * 1e6).astype(np.int64)
+    return {
+        "n": n,
+        "inserted_at": inserted_us,
+        "temperature": temperature, "env_temp": env_temp, "humidity": humidity, "hr": hr, "spo2": spo2,
+        "co_ppm": co, "ch4_ppm": ch4,
+        "confidence": top * 100, "scores": scores, "collecting": collecting, "state": state,
+        "summary": (n, float(hr.mean()), float(temperature.max()), int((state == 2).sum())),
+    }
+
+
+def encode_shift(shift: dict, first_id: int, session_id: uuid.UUID, helmet_id: uuid.UUID,
+                 company_id: uuid.UUID) -> bytes:
+    n, collecting = shift["n"], shift["collecting"]
+    columns = [
+        fixed(np.arange(first_id, first_id + n), ">i8"),
+        repeated(session_id.bytes, n),
+        repeated(helmet_id.bytes, n),
+        repeated(company_id.bytes, n),
+        fixed(shift["inserted_at"], ">i8"),
+    ]
+    columns += [fixed(shift[name], ">f8") for name in ("temperature", "env_temp", "humidity", "hr", "spo2",
+                                                       "co_ppm", "ch4_ppm")]
+    columns.append(fixed(shift["confidence"], ">f8", collecting))
+    columns += [fixed(shift["scores"][:, i], ">f8", collecting) for i in range(3)]
+    columns.append(text(shift["state"], STATES))
+    return encode_copy(columns)
+
+
+# --------------------------------------------------
+# Plan and load
+# --------------------------------------------------
+
+def helmet_profile(seed: int, helmet: int) -> dict:
+    rng = np.random.default_rng((seed, helmet))
+    return {
+        "hr": rng.uniform(62, 82),
+        "temp": rng.uniform(36.4, 36.9),
+        "fatigue_rate": rng.uniform(0.2, 2.5),
+        "co_spikes": rng.uniform(0, 1.5),
+        "ch4_spikes": rng.uniform(0, 0.4),
+    }
+
+
+def plan_sessions(seed: int, helmet_ids: list, days: int, first_day: datetime, interval: float) -> list[tuple]:
+    """(helmet index, helmet id, day, session id, start, readings) for every shift."""
+    rng = np.random.default_rng(seed)
+    plan = []
+    for day in range(days):
+        starts = rng.uniform(5.5, 10, len(helmet_ids))
+        hours = rng.uniform(6, 10, len(helmet_ids))
+        for h, helmet_id in enumerate(helmet_ids):
+            start = first_day + timedelta(days=day, hours=float(starts[h]))
+            session_id = uuid.UUID(int=int(rng.integers(0, 2**63)) << 64 | int(rng.integers(0, 2**63)), version=4)
+            plan.append((h, helmet_id, day, session_id, start, int(hours[h] * 3600 / interval)))
+    return plan
+
+
+_conn = None
+
+
+def _worker_connection():
+    global _conn
+    if _conn is None:
+        _conn = get_db_connection()
+        with _conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+    return _conn
+
+
+def load_task(task: tuple) -> list[tuple]:
+    """Generates and COPYs a group of shifts. Returns (session id, summary) per shift."""
+    seed, interval, shifts = task
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    summaries = []
+    for h, helmet_id, company_id, day, session_id, start, n, first_id, profile in shifts:
+        shift = generate_shift((seed, h, day), n, interval, start, profile)
+        buffer.write(encode_shift(shift, first_id, session_id, helmet_id, company_id))
+        summaries.append((str(session_id),) + shift["summary"])
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+
+    conn = _worker_connection()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY readings ({', '.join(READING_COLUMNS)}) FROM STDIN WITH (FORMAT binary)", buffer)
+    conn.commit()
+    return summaries
+
+
+def ensure_fleet(cur, companies: int, helmets: int, prefix: str) -> tuple[list, list]:
+    """(helmet ids, company id of each helmet)"""
+    from app.auth.auth import hash_password
+
+    password_hash = hash_password("seedpass")
+    company_ids = []
+    for c in range(companies):
+        username = f"{prefix.lower()}_company_{c:03d}"
+        cur.execute(
+            "INSERT INTO companies (id, company_name, username, password_hash, created_at, is_active, \"isAdmin\") "
+            "VALUES (gen_random_uuid(), %s, %s, %s, NOW(), TRUE, FALSE) ON CONFLICT (username) DO NOTHING",
+            (f"{prefix} Company {c:03d}", username, password_hash))
+        cur.execute("SELECT id FROM companies WHERE username = %s", (username,))
+        company_ids.append(cur.fetchone()[0])
+
+    helmet_ids, helmet_companies = [], []
+    for h in range(helmets):
+        code = f"{prefix}-{h:05d}"
+        cur.execute(
+            "INSERT INTO helmets (id, company_id, helmet_code, model, assigned_to, created_at, is_active) "
+            "VALUES (gen_random_uuid(), %s, %s, 'V1', %s, NOW(), TRUE) ON CONFLICT (helmet_code) DO NOTHING",
+            (company_ids[h % companies], code, f"Worker {h:05d}"))
+        cur.execute("SELECT id, company_id FROM helmets WHERE helmet_code = %s", (code,))
+        helmet_id, company_id = cur.fetchone()
+        helmet_ids.append(uuid.UUID(str(helmet_id)))
+        helmet_companies.append(uuid.UUID(str(company_id)))
+    return helmet_ids, helmet_companies
+
+
+def reserve_ids(cur, count: int) -> int:
+    """Moves the readings id sequence past `count` ids; returns the first one."""
+    cur.execute("SELECT pg_get_serial_sequence('readings', 'id')")
+    sequence = cur.fetchone()[0]
+    cur.execute("SELECT greatest(nextval(%s), (SELECT coalesce(max(id), 0) + 1 FROM readings))", (sequence,))
+    first = cur.fetchone()[0]
+    cur.execute("SELECT setval(%s, %s)", (sequence, first + count))
+    return first
+
+
+def drop_secondary_indexes(cur) -> list[str]:
+    cur.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'readings' "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = 'readings'::regclass)")
+    indexes = cur.fetchall()
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX IF EXISTS "{name}"')
+    return [definition for _, definition in indexes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic helmet data into Postgres")
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--helmets", type=int, default=200)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between readings")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None, help="first day (default: --days ago)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--copy-rows", type=int, default=250_000, help="readings per COPY")
+    parser.add_argument("--prefix", default="SEED")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--defer-indexes", action="store_true")
+    parser.add_argument("--rollups", action="store_true", help="rebuild reading_rollups for the loaded range")
+    args = parser.parse_args()
+
+    first_day = (args.start or datetime.utcnow() - timedelta(days=args.days)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    helmet_ids, helmet_companies = ensure_fleet(cur, args.companies, args.helmets, args.prefix)
+    plan = plan_sessions(args.seed, helmet_ids, args.days, first_day, args.interval)
+    total = sum(shift[-1] for shift in plan)
+    print(f"🚀 Seeding {total:,} readings: {len(helmet_ids)} helmets x {args.days} days, {args.workers} workers")
+
+    cur.execute("INSERT INTO work_sessions (id, helmet_id, company_id, start_time, end_time, last_reading_at, "
+                "is_active) SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::uuid[], %s::timestamp[], "
+                "%s::timestamp[], %s::timestamp[], %s::boolean[])", (
+                    [str(s[3]) for s in plan], [str(s[1]) for s in plan],
+                    [str(helmet_companies[s[0]]) for s in plan], [s[4] for s in plan],
+                    [s[4] + timedelta(seconds=(s[5] - 1) * args.interval) for s in plan],
+                    [s[4] + timedelta(seconds=(s[5] - 1) * args.interval) for s in plan],
+                    [False] * len(plan)))
+    first_id = reserve_ids(cur, total)
+    index_definitions = drop_secondary_indexes(cur) if args.defer_indexes else []
+    conn.commit()
+
+    # Shifts -> COPY tasks of about --copy-rows readings
+    profiles = [helmet_profile(args.seed, h) for h in range(len(helmet_ids))]
+    tasks, current, rows = [], [], 0
+    for h, helmet_id, day, session_id, start, n in plan:
+        current.append((h, helmet_id, helmet_companies[h], day, session_id, start, n, first_id, profiles[h]))
+        first_id += n
+        rows += n
+        if rows >= args.copy_rows:
+            tasks.append((args.seed, args.interval, current))
+            current, rows = [], 0
+    if current:
+        tasks.append((args.seed, args.interval, current))
+
+    started = time.perf_counter()
+    loaded = 0
+    summaries = []
+    with Pool(args.workers) as pool:
+        for i, task_summaries in enumerate(pool.imap_unordered(load_task, tasks), 1):
+            summaries.extend(task_summaries)
+            loaded += sum(s[1] for s in task_summaries)
+            elapsed = time.perf_counter() - started
+            print(f"   {i}/{len(tasks)} COPY batches, {loaded:,} readings ({loaded / elapsed:,.0f}/s)")
+
+    cur.execute("UPDATE work_sessions AS s SET reading_count = v.n, avg_hr = v.avg_hr, max_temp = v.max_temp, "
+                "fatigue_events = v.events FROM unnest(%s::uuid[], %s::int[], %s::float8[], %s::float8[], %s::int[]) "
+                "AS v(id, n, avg_hr, max_temp, events) WHERE s.id = v.id",
+                tuple(list(column) for column in zip(*summaries)))
+    conn.commit()
+
+    if index_definitions:
+        print(f"🔧 Recreating {len(index_definitions)} indexes...")
+        for definition in index_definitions:
+            cur.execute(definition)
+        conn.commit()
+    conn.autocommit = True
+    cur.execute("ANALYZE readings")
+    cur.execute("ANALYZE work_sessions")
+
+    if args.rollups:
+        from app.core import rollups
+        from app.db.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            rollups.rebuild(db, first_day, first_day + timedelta(days=args.days + 1))
+        finally:
+            db.close()
+
+    cur.close()
+    conn.close()
+    print(f"✅ Seeded {loaded:,} readings in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,17 @@ import random
 import uuid
 import sys
 import os
+from types import SimpleNamespace
+
+from app.core.codec import encode_reading, CONTENT_TYPE
 
 # Use 127.0.0.1 to avoid IPv6 resolution issues in some containers
 # Inside the container, this points to the FastAPI app running on port 8000
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000/submit_reading")
 
+# Set PAYLOAD_FORMAT=binary to send compact frames to /submit_reading/bin (like newer firmware)
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json")
+
 
 
 try:
@@ -63,7 +69,11 @@ while packet_counter < MAX_PACKETS:
     payload = generate_sensor_reading(packet_counter)
     
     try:
-        res = requests.post(API_URL, json=payload, timeout=5)
+        if PAYLOAD_FORMAT == "binary":
+            res = requests.post(API_URL + "/bin", data=encode_reading(SimpleNamespace(**payload)),
+                                headers={"Content-Type": CONTENT_TYPE}, timeout=5)
+        else:
+            res = requests.post(API_URL, json=payload, timeout=5)
         status_icon = "✅" if res.status_code == 200 else "⚠️"
         print(f"{status_icon} Packet #{packet_counter}: HR={payload['HR']} Temp={payload['BodyTemp']} | Res: {res.status_code}", flush=True)
         
@@ -8,6 +8,12 @@ import {
   ReferenceLine, RadialBarChart, RadialBar
 } from "recharts";
 
+// Historical data is scoped to the logged-in company (token from /auth/login)
+const authHeaders = () => {
+  const token = localStorage.getItem("token");
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 export default function AdvancedDashboard() {
   const [activeTab, setActiveTab] = useState("Overview");
 
@@ -49,7 +55,7 @@ export default function AdvancedDashboard() {
   const handleSessionClick = (fullId) => {
     setSelectedSessionId(fullId);
     setIsReadingsLoading(true);
-    axios.get(`${API_URL}/historical/readings/${fullId}`)
+    axios.get(`${API_URL}/historical/readings/${fullId}`, { headers: authHeaders() })
       .then(res => setSessionReadings(res.data))
       .catch(err => console.error("Failed to fetch readings:", err))
       .finally(() => setIsReadingsLoading(false));
@@ -250,7 +256,7 @@ export default function AdvancedDashboard() {
   useEffect(() => {
     if (activeTab === "Database" && dbData.length === 0) {
       setIsDbLoading(true);
-      axios.get(`${API_URL}/historical/all_sessions`)
+      axios.get(`${API_URL}/historical/all_sessions`, { headers: authHeaders() })
         .then(res => {
           if (res.data) setDbData(res.data);
         })